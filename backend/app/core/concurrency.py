@@ -0,0 +1,29 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _worker_count_from_env(name: str, default: int) -> int:
+    try:
+        value = int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        value = default
+
+    return max(1, value)
+
+
+CPU_COUNT = os.cpu_count() or 1
+
+TRACE_INGEST_WORKERS = _worker_count_from_env("TRACE_INGEST_WORKERS", CPU_COUNT)
+TRACE_DECOMPOSITION_WORKERS = _worker_count_from_env("TRACE_DECOMPOSITION_WORKERS", CPU_COUNT)
+
+
+def create_process_pool(max_workers: int, initializer=None, initargs=()) -> ProcessPoolExecutor:
+    # Spawn instead of fork: the API process runs background tasks on threads
+    # and holds open DB connections, neither of which is safe to fork.
+    return ProcessPoolExecutor(
+        max_workers=max(1, int(max_workers)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initializer,
+        initargs=initargs,
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, JSON, DateTime, Text, Boolean, Index 
+from sqlalchemy import Column, Integer, String, ForeignKey, JSON, DateTime, Text, Boolean, Index, UniqueConstraint
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -34,6 +34,16 @@ class Project(Base):
         back_populates="project",
         cascade="all, delete-orphan",
     )
+    trace_ingest_jobs = relationship(
+        "TraceIngestJob",
+        back_populates="project",
+        cascade="all, delete-orphan",
+    )
+    trace_blobs = relationship(
+        "TraceBlob",
+        back_populates="project",
+        cascade="all, delete-orphan",
+    )
 
     logs = relationship("ProjectLog", back_populates="project", cascade="all, delete-orphan")
 
@@ -115,4 +125,29 @@ class Trace(Base):
         "TraceHierarchicalCluster",
         back_populates="trace",
         cascade="all, delete-orphan",
-    )
\ No newline at end of file
+    )
+
+class TraceBlob(Base):
+    """
+    A resolved dynamic graph stored once per distinct upload. The content
+    hash covers the raw trace bytes and the project's operation lookup, so
+    identical uploads against an unchanged graph share one file.
+    """
+
+    __tablename__ = "trace_blobs"
+    __table_args__ = (
+        UniqueConstraint('project_id', 'content_hash', name='uq_trace_blobs_project_hash'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), index=True, nullable=False)
+    content_hash = Column(String(64), nullable=False, index=True)
+    path = Column(String, nullable=False, index=True)
+    total_steps = Column(Integer, nullable=False, default=0)
+    resolved_steps = Column(Integer, nullable=False, default=0)
+    ambiguous_steps = Column(Integer, nullable=False, default=0)
+    unresolved_steps = Column(Integer, nullable=False, default=0)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    project = relationship("Project", back_populates="trace_blobs")
@@ -0,0 +1,42 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+
+from app.core.database import Base
+
+
+class TraceIngestJob(Base):
+    __tablename__ = "trace_ingest_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), index=True, nullable=False)
+    status = Column(String, nullable=False, default="queued") # 'queued', 'processing', 'completed', 'failed'
+    total_files = Column(Integer, nullable=False, default=0)
+    processed_files = Column(Integer, nullable=False, default=0)
+    failed_files = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    project = relationship("Project", back_populates="trace_ingest_jobs")
+    files = relationship(
+        "TraceIngestJobFile",
+        back_populates="job",
+        cascade="all, delete-orphan",
+        order_by="TraceIngestJobFile.id",
+    )
+
+
+class TraceIngestJobFile(Base):
+    __tablename__ = "trace_ingest_job_files"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("trace_ingest_jobs.id", ondelete="CASCADE"), index=True, nullable=False)
+    filename = Column(String, nullable=False)
+    trace_name = Column(String, nullable=False)
+    spool_path = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued") # 'queued', 'processing', 'completed', 'failed'
+    error = Column(Text, nullable=True)
+    trace_id = Column(Integer, ForeignKey("traces.id", ondelete="SET NULL"), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    job = relationship("TraceIngestJob", back_populates="files")
@@ -1,21 +1,64 @@
 from sqlalchemy.orm import Session
-from typing import List
-from app.models.feature import Feature
+from typing import List, Sequence
+from app.models.feature import Feature, feature_node_association
 
 class FeatureRepository:
     def __init__(self, db: Session):
         self.db = db
+        self._pending_node_links = []
+
+    def create_feature_without_commit(self, feature: Feature, node_db_ids: Sequence[int] = ()):
+        """
+        Adds a feature and queues its links to nodes by db id, so callers need no ORM Node objects. The
+        links of all queued features are written together by commit.
+        """
 
-    def create_feature_without_commit(self, feature: Feature):
         self.db.add(feature)
 
+        if node_db_ids:
+            self._pending_node_links.append((feature, node_db_ids))
+
+    def _write_pending_node_links(self):
+        if not self._pending_node_links:
+            return
+
+        # One flush assigns every queued feature its id, then one executemany writes all links.
+        self.db.flush()
+        self.db.execute(
+            feature_node_association.insert(),
+            [
+                {"feature_id": feature.id, "node_db_id": node_db_id}
+                for feature, node_db_ids in self._pending_node_links
+                for node_db_id in node_db_ids
+            ],
+        )
+        self._pending_node_links = []
+
     def delete_features_by_project(self, project_id: int):
         self.db.query(Feature).filter(Feature.project_id == project_id).delete(synchronize_session=False)
         self.db.commit()
 
+    def delete_features_without_commit(self, feature_ids: List[int]):
+        if not feature_ids:
+            return
+
+        self.db.query(Feature).filter(Feature.id.in_(feature_ids)).delete(synchronize_session=False)
+
     def get_features_by_project(self, project_id: int):
         return self.db.query(Feature).filter(Feature.project_id == project_id).all()
     
+    def get_feature_node_ids(self, project_id: int):
+        """
+        (feature_id, node_db_id) rows linking the features of a project to their nodes, in one query.
+        """
+
+        return (
+            self.db.query(feature_node_association.c.feature_id, feature_node_association.c.node_db_id)
+            .join(Feature, Feature.id == feature_node_association.c.feature_id)
+            .filter(Feature.project_id == project_id)
+            .all()
+        )
+
     def get_nodes_of_feature(self, feature_id: int):
         feature = self.db.query(Feature).filter(Feature.id == feature_id).first()
         if feature:
@@ -30,4 +73,5 @@ class FeatureRepository:
         return nodes
 
     def commit(self):
+        self._write_pending_node_links()
         self.db.commit()
\ No newline at end of file
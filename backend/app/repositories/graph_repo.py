@@ -1,5 +1,5 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import not_, text
+from sqlalchemy import func, not_, text
 from app.models.graph import Project, ProjectLog, Node, Edge
 from app.services.sabo_gen.signature_utils import extract_signature_parameters, normalized_signature_parameters, has_parameter_list
 
@@ -100,6 +100,33 @@ class GraphRepository:
     def get_all_nodes(self, project_id: int):
         return self.db.query(Node).filter(Node.project_id == project_id).all()
     
+    def get_node_projection_rows(self, project_id: int):
+        """
+        Column-only rows of every node in a project, with the simple name and summary description read
+        out of the JSON columns by the database.
+        """
+
+        return self.db.query(
+            Node.db_id,
+            Node.id,
+            Node.parent_id,
+            Node.ancestors,
+            Node.labels,
+            Node.properties["simpleName"].as_string().label("simple_name"),
+            Node.ai_summary["description"].as_string().label("description"),
+        ).filter(Node.project_id == project_id).all()
+
+    def get_node_version(self, project_id: int):
+        """
+        Changes whenever nodes are added to or removed from a project, or a node gets its first summary.
+        """
+
+        return tuple(self.db.query(
+            func.count(Node.db_id),
+            func.max(Node.db_id),
+            func.count(Node.ai_summary),
+        ).filter(Node.project_id == project_id).one())
+
     def get_all_edges(self, project_id: int):
         return self.db.query(Edge).filter(Edge.project_id == project_id).all()
     
@@ -150,6 +177,12 @@ class GraphRepository:
         
         return query.all()
 
+    def get_edge_endpoints_by_labels(self, project_id: int, labels: list[str]):
+        return self.db.query(Edge.source_id, Edge.target_id, Edge.label).filter(
+            Edge.project_id == project_id,
+            Edge.label.in_(labels)
+        ).all()
+
     def bulk_create_nodes(self, nodes_data: list[dict]):
         self.db.bulk_insert_mappings(Node, nodes_data)
         self.db.commit()
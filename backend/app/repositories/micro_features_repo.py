@@ -1,3 +1,4 @@
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 
 from app.models.micro_features import TraceHierarchicalCluster, TraceMicroFeature, TraceMicroFeatureFlow
@@ -25,6 +26,15 @@ class MicroFeaturesRepository:
         else:
             self.db.flush()
 
+    def get_decomposed_trace_ids(self, project_id: int) -> set[int]:
+        rows = (
+            self.db.query(TraceMicroFeature.trace_id)
+            .filter(TraceMicroFeature.project_id == project_id)
+            .distinct()
+            .all()
+        )
+        return {row.trace_id for row in rows}
+
     def create_micro_feature(
         self,
         project_id: int,
@@ -61,6 +71,16 @@ class MicroFeaturesRepository:
         self.db.refresh(row)
         return row
 
+    def create_micro_features(self, rows: list[dict]):
+        """
+        Inserts micro features in one flush. The returned rows have their ids assigned.
+        """
+
+        micro_features = [TraceMicroFeature(**row) for row in rows]
+        self.db.add_all(micro_features)
+        self.db.flush()
+        return micro_features
+
     def create_hierarchical_cluster(
         self,
         project_id: int,
@@ -129,6 +149,12 @@ class MicroFeaturesRepository:
         self.db.refresh(row)
         return row
 
+    def create_micro_feature_flows(self, rows: list[dict]):
+        flows = [TraceMicroFeatureFlow(**row) for row in rows]
+        self.db.add_all(flows)
+        self.db.flush()
+        return flows
+
     def get_micro_features_by_trace(self, trace_id: int):
         return (
             self.db.query(TraceMicroFeature)
@@ -151,4 +177,49 @@ class MicroFeaturesRepository:
             .filter(TraceHierarchicalCluster.trace_id == trace_id)
             .order_by(TraceHierarchicalCluster.sequence_order.asc())
             .all()
-        )
\ No newline at end of file
+        )
+
+    def get_execution_unit_components(self, project_id: int):
+        """
+        (trace_id, cluster_id, component) rows for every execution unit of a project, in one query.
+        An execution unit is a top-level hierarchical cluster with the components of its member micro
+        features; a trace without top-level clusters is one unit (cluster_id NULL) of all its micro features.
+        """
+
+        sql = text("""
+            WITH top_clusters AS (
+                SELECT id, trace_id, sequence_order, member_micro_feature_ids
+                FROM trace_hierarchical_clusters
+                WHERE project_id = :project_id
+                    AND parent_cluster_id IS NULL
+            ),
+            unit_members AS (
+                SELECT tc.trace_id, tc.id AS cluster_id, tc.sequence_order, member.value::int AS micro_feature_id
+                FROM top_clusters tc
+                CROSS JOIN LATERAL json_array_elements_text(
+                    CASE WHEN json_typeof(tc.member_micro_feature_ids) = 'array'
+                        THEN tc.member_micro_feature_ids
+                        ELSE '[]'::json
+                    END
+                ) AS member(value)
+
+                UNION ALL
+
+                SELECT mf.trace_id, NULL, NULL, mf.id
+                FROM trace_micro_features mf
+                WHERE mf.project_id = :project_id
+                    AND NOT EXISTS (SELECT 1 FROM top_clusters tc WHERE tc.trace_id = mf.trace_id)
+            )
+            SELECT DISTINCT um.trace_id, um.cluster_id, um.sequence_order, component.value AS component
+            FROM unit_members um
+            JOIN trace_micro_features mf ON mf.id = um.micro_feature_id AND mf.trace_id = um.trace_id
+            CROSS JOIN LATERAL json_array_elements_text(
+                CASE WHEN json_typeof(mf.components) = 'array'
+                    THEN mf.components
+                    ELSE '[]'::json
+                END
+            ) AS component(value)
+            ORDER BY um.trace_id, um.sequence_order NULLS FIRST, um.cluster_id, component
+        """)
+
+        return self.db.execute(sql, {"project_id": project_id}).fetchall()
@@ -0,0 +1,94 @@
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+
+from app.models.trace_jobs import TraceIngestJob, TraceIngestJobFile
+
+
+class TraceJobRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def create_job(self, project_id: int, commit: bool = False):
+        job = TraceIngestJob(project_id=project_id, status="queued")
+        self.db.add(job)
+
+        if commit:
+            self.db.commit()
+        else:
+            self.db.flush()
+
+        self.db.refresh(job)
+        return job
+
+    def add_job_file(self, job: TraceIngestJob, filename: str, trace_name: str, spool_path: str):
+        job_file = TraceIngestJobFile(
+            job_id=job.id,
+            filename=filename,
+            trace_name=trace_name,
+            spool_path=spool_path,
+            status="queued",
+        )
+        self.db.add(job_file)
+        job.total_files = (job.total_files or 0) + 1
+        self.db.flush()
+        return job_file
+
+    def get_job_by_id(self, job_id: int):
+        return self.db.query(TraceIngestJob).filter(TraceIngestJob.id == job_id).first()
+
+    def get_jobs_by_project_id(self, project_id: int, limit: int = 20):
+        return (
+            self.db.query(TraceIngestJob)
+            .filter(TraceIngestJob.project_id == project_id)
+            .order_by(TraceIngestJob.id.desc())
+            .limit(limit)
+            .all()
+        )
+
+    def mark_job_status(self, job: TraceIngestJob, status: str):
+        job.status = status
+        if status in ("completed", "failed"):
+            job.finished_at = func.now()
+        self.db.commit()
+
+    def mark_files_processing(self, job_files: list[TraceIngestJobFile]):
+        for job_file in job_files:
+            job_file.status = "processing"
+        self.db.commit()
+
+    def complete_file(self, job: TraceIngestJob, job_file: TraceIngestJobFile, trace_id: int, commit: bool = True):
+        job_file.status = "completed"
+        job_file.trace_id = trace_id
+        job_file.error = None
+        job.processed_files = (job.processed_files or 0) + 1
+
+        if commit:
+            self.db.commit()
+
+    def fail_file(self, job: TraceIngestJob, job_file: TraceIngestJobFile, error: str):
+        job_file.status = "failed"
+        job_file.error = error[:1000]
+        job.processed_files = (job.processed_files or 0) + 1
+        job.failed_files = (job.failed_files or 0) + 1
+        self.db.commit()
+
+    def get_unfinished_jobs(self):
+        return (
+            self.db.query(TraceIngestJob)
+            .filter(TraceIngestJob.status.in_(("queued", "processing")))
+            .all()
+        )
+
+    def fail_unfinished_job(self, job: TraceIngestJob, error: str):
+        """
+        Fails every file of a job that has no outcome yet, and the job itself, in one commit.
+        """
+
+        for job_file in job.files:
+            if job_file.status in ("queued", "processing"):
+                job_file.status = "failed"
+                job_file.error = error[:1000]
+                job.processed_files = (job.processed_files or 0) + 1
+                job.failed_files = (job.failed_files or 0) + 1
+
+        self.mark_job_status(job, "failed")
@@ -1,6 +1,7 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import not_, text
-from app.models.graph import Project, Trace
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import func, not_, text, update
+from app.models.graph import Project, Trace, TraceBlob
 
 class TraceRepository:
     def __init__(self, db: Session):
@@ -46,4 +47,101 @@ class TraceRepository:
         trace = self.get_trace_by_id(trace_id)
         if trace:
             self.db.delete(trace)
-            self.db.commit()
\ No newline at end of file
+            self.db.commit()
+
+    def get_blob_by_hash(self, project_id: int, content_hash: str, for_update: bool = False):
+        """
+        With for_update, the row stays locked until the transaction ends, so no other job attaches to or
+        releases the blob in between.
+        """
+
+        query = self.db.query(TraceBlob).filter(
+            TraceBlob.project_id == project_id,
+            TraceBlob.content_hash == content_hash,
+        )
+        if for_update:
+            query = query.with_for_update()
+
+        return query.first()
+
+    def get_blob_by_path(self, project_id: int, path: str, for_update: bool = False):
+        query = self.db.query(TraceBlob).filter(TraceBlob.project_id == project_id, TraceBlob.path == path)
+        if for_update:
+            query = query.with_for_update()
+
+        return query.first()
+
+    def save_blob(
+        self,
+        project_id: int,
+        content_hash: str,
+        path: str,
+        total_steps: int = 0,
+        resolved_steps: int = 0,
+        ambiguous_steps: int = 0,
+        unresolved_steps: int = 0,
+        commit: bool = True,
+    ):
+        blob = self.get_blob_by_hash(project_id, content_hash)
+        if not blob:
+            blob = TraceBlob(project_id=project_id, content_hash=content_hash, ref_count=0)
+            self.db.add(blob)
+
+        blob.path = path
+        blob.total_steps = total_steps
+        blob.resolved_steps = resolved_steps
+        blob.ambiguous_steps = ambiguous_steps
+        blob.unresolved_steps = unresolved_steps
+
+        if commit:
+            self.db.commit()
+        else:
+            self.db.flush()
+        self.db.refresh(blob)
+        return blob
+
+    def acquire_blob(self, blob: TraceBlob) -> int:
+        """
+        Adds one reference in a single UPDATE, so concurrent jobs cannot lose increments. Raises
+        LookupError when the blob row was deleted in the meantime.
+        """
+
+        remaining = self._change_blob_references(blob, 1)
+        if remaining is None:
+            raise LookupError("The stored trace was deleted while it was being attached.")
+
+        return remaining
+
+    def release_blob(self, blob: TraceBlob) -> int:
+        """
+        Drops one reference in a single UPDATE and deletes the blob row once none are left.
+        Returns the remaining reference count; the caller owns the files.
+        """
+
+        remaining = self._change_blob_references(blob, -1)
+        if remaining is None:
+            return 0
+
+        if remaining == 0:
+            self.delete_blob(blob)
+
+        return remaining
+
+    def delete_blob(self, blob: TraceBlob):
+        self.db.delete(blob)
+        self.db.flush()
+
+    def _change_blob_references(self, blob: TraceBlob, delta: int):
+        remaining = self.db.execute(
+            update(TraceBlob)
+            .where(TraceBlob.id == blob.id)
+            .values(ref_count=func.greatest(func.coalesce(TraceBlob.ref_count, 0) + delta, 0))
+            .returning(TraceBlob.ref_count)
+            .execution_options(synchronize_session=False)
+        ).scalar_one_or_none()
+
+        if remaining is not None:
+            # The UPDATE already wrote the count; this only refreshes the loaded row.
+            set_committed_value(blob, "ref_count", remaining)
+
+        return remaining
@@ -3,7 +3,7 @@ import shutil
 
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks, Body, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Literal
 
 from app.core.database import get_db
 from app.services.graph_service import GraphService
@@ -230,7 +230,9 @@ def start_decomposition(
     service: FunctionalDecompositionService = Depends(get_decomposition_service),
     graph_service: GraphService = Depends(get_service),
     use_ai: bool = Query(True, description="Use AI for feature naming and descriptions"),
-    use_execution_units: bool = Query(True, description="Use trace-decomposition execution units as observations. Disable this to cluster features from whole traces while still persisting trace decomposition.")
+    use_execution_units: bool = Query(True, description="Use trace-decomposition execution units as observations. Disable this to cluster features from whole traces while still persisting trace decomposition."),
+    incremental: bool = Query(False, description="Only decompose traces without a trace decomposition yet, then re-cluster. Features whose members did not change keep their names and descriptions."),
+    clustering_mode: Literal["auto", "exact", "approximate"] = Query("auto", description="Exact agglomerative clustering, approximate MinHash/LSH neighborhoods clustered one by one, or auto to switch to approximate above FUNCTIONAL_APPROXIMATE_MIN_FUNCTIONS functions.")
 ):
     if not graph_service.get_project_by_id(project_id):
         raise HTTPException(status_code=404, detail="Project not found")
@@ -241,6 +243,8 @@ def start_decomposition(
             project_id,
             use_ai,
             use_execution_units,
+            incremental,
+            clustering_mode,
         )
         return {"message": "Decomposition started in the background"}
     except Exception as e:
@@ -1,17 +1,20 @@
 import json
 from pathlib import Path
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, UploadFile, File
 from sqlalchemy.orm import Session
-from typing import List, Union
+from typing import List, Optional
 
 from app.core.database import get_db
 from app.core.exceptions import TraceValidationError
 from app.services.func_decomp_service import FunctionalDecompositionService
-from app.services.trace_service import TraceService
+from app.services.trace_service import DEFAULT_STEP_PAGE_SIZE, MAX_STEP_PAGE_SIZE, TraceService
+from app.services.trace_ingest_job import run_trace_ingest_job
 from app.services.graph_service import GraphService
 from app.schemas.graph_schemas import (
     MicroFeatureSummary,
     TraceExecutionFlowResponse,
+    TraceIngestJobSummary,
+    TraceStepsPage,
     TraceSummary,
     VisibleTraceFilterRequest,
     VisibleTraceStepsResponse,
@@ -52,9 +55,10 @@ def get_trace_file(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/projects/{project_id}/traces", response_model=Union[TraceSummary, List[TraceSummary]])
+@router.post("/projects/{project_id}/traces", response_model=TraceIngestJobSummary, status_code=202)
 def upload_trace(
     project_id: int,
+    background_tasks: BackgroundTasks,
     file: UploadFile | None = File(default=None),
     files: List[UploadFile] | None = File(default=None),
     service: TraceService = Depends(get_trace_service),
@@ -73,12 +77,42 @@ def upload_trace(
         raise HTTPException(status_code=422, detail="No trace files were provided")
     
     try:
-        processed = [service.process_trace_file(project_id, upload) for upload in uploads]
-        return processed[0] if len(processed) == 1 else processed
+        job = service.spool_trace_files(project_id, uploads)
     except TraceValidationError as e:
         raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Trace processing failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Trace upload failed: {str(e)}")
+
+    background_tasks.add_task(
+        run_trace_ingest_job,
+        job.id,
+        str(service.get_traces_dir(project_id)),
+    )
+    return job
+
+
+@router.get("/projects/{project_id}/trace-jobs", response_model=List[TraceIngestJobSummary])
+def get_project_trace_jobs(
+    project_id: int,
+    service: TraceService = Depends(get_trace_service),
+    graph_service: GraphService = Depends(get_graph_service)
+):
+    if not graph_service.get_project_by_id(project_id):
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    return service.get_project_ingest_jobs(project_id)
+
+
+@router.get("/trace-jobs/{job_id}", response_model=TraceIngestJobSummary)
+def get_trace_job(
+    job_id: int,
+    service: TraceService = Depends(get_trace_service)
+):
+    job = service.get_ingest_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trace ingest job not found")
+
+    return job
     
 @router.delete("/traces/{trace_id}")
 def delete_trace(
@@ -94,6 +128,39 @@ def delete_trace(
         raise HTTPException(status_code=500, detail=f"Failed to delete trace: {str(e)}")
 
 
+@router.get("/traces/{trace_id}/steps", response_model=TraceStepsPage)
+def get_trace_steps(
+    trace_id: int,
+    start: int = Query(default=1, ge=0),
+    end: Optional[int] = Query(default=None, ge=0),
+    page_size: int = Query(default=DEFAULT_STEP_PAGE_SIZE, ge=1, le=MAX_STEP_PAGE_SIZE),
+    service: TraceService = Depends(get_trace_service)
+):
+    try:
+        return service.get_trace_steps(trace_id, start, end, page_size)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read trace steps: {str(e)}")
+
+
+@router.get("/traces/{trace_id}/steps/window", response_model=TraceStepsPage)
+def get_trace_steps_in_window(
+    trace_id: int,
+    start_us: Optional[int] = Query(default=None),
+    end_us: Optional[int] = Query(default=None),
+    cursor: int = Query(default=0, ge=0),
+    page_size: int = Query(default=DEFAULT_STEP_PAGE_SIZE, ge=1, le=MAX_STEP_PAGE_SIZE),
+    service: TraceService = Depends(get_trace_service)
+):
+    try:
+        return service.get_trace_steps_in_window(trace_id, start_us, end_us, cursor, page_size)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read trace steps: {str(e)}")
+
+
 @router.post("/traces/{trace_id}/steps/visible", response_model=VisibleTraceStepsResponse)
 def get_visible_trace_steps(
     trace_id: int,
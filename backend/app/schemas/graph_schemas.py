@@ -79,6 +79,15 @@ class VisibleTraceStepsResponse(BaseModel):
     steps: List[Dict[str, Any]]
 
 
+class TraceStepsPage(BaseModel):
+    total_steps: int
+    matched_steps: int
+    steps: List[Dict[str, Any]]
+    next_cursor: Optional[int] = None
+    first_epoch_us: Optional[int] = None
+    last_epoch_us: Optional[int] = None
+
+
 class MicroFeatureSummary(BaseModel):
     id: int
     project_id: int
@@ -136,3 +145,31 @@ class TraceExecutionFlowResponse(BaseModel):
     micro_features: List[MicroFeatureSummary]
     flow_edges: List[MicroFeatureFlowEdge]
     hierarchical_clusters: List[HierarchicalClusterSummary] = []
+
+
+class TraceIngestJobFileStatus(BaseModel):
+    id: int
+    filename: str
+    trace_name: str
+    status: str
+    error: Optional[str] = None
+    trace_id: Optional[int] = None
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+class TraceIngestJobSummary(BaseModel):
+    id: int
+    project_id: int
+    status: str
+    total_files: int = 0
+    processed_files: int = 0
+    failed_files: int = 0
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    files: List[TraceIngestJobFileStatus] = []
+
+    class Config:
+        from_attributes = True
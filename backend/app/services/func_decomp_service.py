@@ -1,10 +1,13 @@
 import re
-from collections import Counter
+from collections import Counter, defaultdict
+from concurrent.futures import as_completed
 from typing import Any, Optional
 
 import numpy as np
+from scipy import sparse
 from sqlalchemy.orm import Session
 
+from app.core.concurrency import TRACE_DECOMPOSITION_WORKERS, create_process_pool
 from app.services.sabo_gen.config import NODE_OPERATION, EDGE_INVOKES
 from app.models.feature import Feature
 from app.repositories.feature_repo import FeatureRepository
@@ -14,6 +17,7 @@ from app.services.summarization_service import SummarizationService
 from app.services.trace_service import TraceService
 from .functional_decomposition.agglomerative import AgglomerativeDecomposition
 from .trace_decomposition.trace_decomposition import TraceDecomposition
+from .trace_decomposition.trace_workers import _init_trace_decomposition_worker, decompose_trace_file
 
 
 class FunctionalDecompositionService:
@@ -192,19 +196,28 @@ class FunctionalDecompositionService:
         return trace_data
 
     def build_feature_matrix(self, traces):
+        """
+        Binary functions x units matrix in CSR form, built from the (function, unit) pairs of the given
+        traces or execution units. Rows follow the sorted function ids.
+        """
+
         if not traces:
-            return np.array([]), []
+            return sparse.csr_matrix((0, 0), dtype=np.float64), []
 
-        all_functions = sorted(list(set().union(*[trace["functions"] for trace in traces])))
+        all_functions = sorted(set().union(*[trace["functions"] for trace in traces]))
+        function_index = {function_id: index for index, function_id in enumerate(all_functions)}
 
-        matrix_data = []
-        for func in all_functions:
-            row = []
-            for trace in traces:
-                row.append(1 if func in trace["functions"] else 0)
-            matrix_data.append(row)
+        rows = []
+        columns = []
+        for unit_index, trace in enumerate(traces):
+            for function_id in trace["functions"]:
+                rows.append(function_index[function_id])
+                columns.append(unit_index)
 
-        X = np.array(matrix_data)
+        X = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float64), (rows, columns)),
+            shape=(len(all_functions), len(traces)),
+        )
         return X, all_functions
 
     def collect_nodes_with_ancestors(self, components, node_lookup):
@@ -239,11 +252,26 @@ class FunctionalDecompositionService:
         allow_ai,
         node_lookup,
         score=0.0,
+        operation_edges_by_source=None,
+        reusable_features=None,
     ):
         linked_nodes = self.collect_nodes_with_ancestors(components, node_lookup)
         if not linked_nodes:
             return
 
+        if reusable_features is not None:
+            # An unchanged feature keeps its row, name and description; only its score is refreshed.
+            key = self._feature_membership_key(category, linked_nodes)
+            candidates = reusable_features.get(key)
+            if candidates:
+                reused = candidates.pop(0)
+                if not candidates:
+                    del reusable_features[key]
+
+                reused.score = float(score)
+                self.increment_decomposition_progress(reused.name)
+                return
+
         feature_description = None
         feature_name = default_name
 
@@ -253,11 +281,20 @@ class FunctionalDecompositionService:
             if operation_nodes:
                 operation_node_ids = [node.id for node in operation_nodes]
 
-                operation_edges = self.graph_service.get_edges_between_nodes(
-                    project_id=project_id,
-                    node_ids=operation_node_ids,
-                    labels=[EDGE_INVOKES],
-                )
+                if operation_edges_by_source is None:
+                    operation_edges = self.graph_service.get_edges_between_nodes(
+                        project_id=project_id,
+                        node_ids=operation_node_ids,
+                        labels=[EDGE_INVOKES],
+                    )
+                else:
+                    operation_node_id_set = set(operation_node_ids)
+                    operation_edges = [
+                        edge
+                        for node_id in operation_node_ids
+                        for edge in operation_edges_by_source.get(node_id, ())
+                        if edge.target_id in operation_node_id_set
+                    ]
 
                 ai_result = summarizer.prompt_feature(
                     operation_nodes = operation_nodes,
@@ -274,11 +311,59 @@ class FunctionalDecompositionService:
             category=category,
             score=float(score),
         )
-        feature.nodes = linked_nodes
-        self.feature_repo.create_feature_without_commit(feature)
+        self.feature_repo.create_feature_without_commit(feature, [node.db_id for node in linked_nodes])
 
         self.increment_decomposition_progress(feature_name)
 
+    def _feature_membership_key(self, category, linked_nodes):
+        return category, frozenset(node.db_id for node in linked_nodes)
+
+    def _unmatched_feature_ids(self, reusable_features):
+        return [feature.id for features in reusable_features.values() for feature in features]
+
+    def load_reusable_features(self, project_id: int):
+        """
+        The stored features of a project keyed by category and linked node ids, for an incremental run to
+        keep the features whose membership did not change. Features sharing a key are listed together, so
+        each matching cluster reuses one of them and the rest are deleted with the unmatched ones.
+        """
+
+        features = {feature.id: feature for feature in self.feature_repo.get_features_by_project(project_id)}
+        node_ids = {feature_id: set() for feature_id in features}
+
+        for feature_id, node_db_id in self.feature_repo.get_feature_node_ids(project_id):
+            node_ids[feature_id].add(node_db_id)
+
+        reusable_features = {}
+        for feature_id, feature in features.items():
+            key = (feature.category, frozenset(node_ids[feature_id]))
+            reusable_features.setdefault(key, []).append(feature)
+
+        return reusable_features
+
+    def load_feature_operation_edges(self, project_id, feature_components, node_lookup):
+        """
+        Invokes edges among the operations of all features, grouped by source operation, so persist_feature
+        can pick out the edges of each feature without querying. The project's invokes edges are read in one
+        column-only query instead of one query with two IN lists per feature.
+        """
+
+        operation_ids = set()
+        for components in feature_components:
+            operation_ids.update(node.id for node in self.collect_operation_nodes(components, node_lookup))
+
+        operation_edges_by_source = defaultdict(list)
+        if not operation_ids:
+            return operation_edges_by_source
+
+        operation_edges = self.graph_service.get_edge_endpoints_by_labels(project_id, [EDGE_INVOKES])
+
+        for edge in operation_edges:
+            if edge.source_id in operation_ids and edge.target_id in operation_ids:
+                operation_edges_by_source[edge.source_id].append(edge)
+
+        return operation_edges_by_source
+
     def generate_feature_name(self, components):
         words = []
 
@@ -308,7 +393,16 @@ class FunctionalDecompositionService:
         project_id: int,
         use_ai: bool = True,
         use_execution_units: bool = True,
+        incremental: bool = False,
+        clustering_mode: str = "auto",
     ):
+        """
+        Decomposes the project's traces and clusters their execution units into features. An incremental
+        run keeps the stored trace decompositions and only decomposes traces that have none yet; features
+        whose membership did not change keep their names and descriptions, so the LLM only names new or
+        changed clusters. clustering_mode is passed on to AgglomerativeDecomposition.run.
+        """
+
         self.graph_service.change_project_status(
             project_id,
             status="decomposing",
@@ -321,10 +415,20 @@ class FunctionalDecompositionService:
         is_llm_enabled = summarizer.llm.is_enabled
         allow_ai = use_ai and is_llm_enabled
 
-        db_nodes = self.graph_service.get_all_nodes(project_id)
-        node_lookup = {n.id: n for n in db_nodes}
+        node_lookup = self.graph_service.get_node_projections(project_id)
 
-        self.feature_repo.delete_features_by_project(project_id) 
+        if incremental:
+            reusable_features = self.load_reusable_features(project_id)
+            decomposed_trace_ids = self.micro_features_repo.get_decomposed_trace_ids(project_id)
+            pending_traces = [
+                trace
+                for trace in self.trace_service.get_project_traces(project_id)
+                if trace.id not in decomposed_trace_ids
+            ]
+        else:
+            reusable_features = None
+            pending_traces = None
+            self.feature_repo.delete_features_by_project(project_id)
 
         self._set_decomposition_status(
             "Functional Decomposition: Decomposing traces..."
@@ -332,13 +436,15 @@ class FunctionalDecompositionService:
 
         self._reset_trace_progress(project_id)
 
-        self.micro_features_repo.clear_project_decomposition(project_id, commit=False)
+        if not incremental:
+            self.micro_features_repo.clear_project_decomposition(project_id, commit=False)
 
         self._save_project_trace_decomposition(
             project_id=project_id,
             summarizer=summarizer,
             allow_ai=allow_ai,
             node_lookup=node_lookup,
+            traces=pending_traces,
         )
 
         unit_source = "trace decomposition" if use_execution_units else "whole traces"
@@ -354,6 +460,10 @@ class FunctionalDecompositionService:
         )
 
         if not functional_units:
+            if reusable_features:
+                self.feature_repo.delete_features_without_commit(self._unmatched_feature_ids(reusable_features))
+                self.feature_repo.commit()
+
             self.graph_service.change_project_status(
                 project_id,
                 status="ready",
@@ -374,8 +484,14 @@ class FunctionalDecompositionService:
             summarizer=summarizer,
             allow_ai=allow_ai,
             node_lookup=node_lookup,
+            reusable_features=reusable_features,
+            clustering_mode=clustering_mode,
         )
 
+        if reusable_features:
+            # Stored features no cluster matched anymore are replaced by the new ones in the same commit.
+            self.feature_repo.delete_features_without_commit(self._unmatched_feature_ids(reusable_features))
+
         self.feature_repo.commit()
 
         self.graph_service.change_project_status(
@@ -410,8 +526,7 @@ class FunctionalDecompositionService:
 
         summarizer = SummarizationService(self.db)
         allow_ai = use_ai and summarizer.llm.is_enabled
-        db_nodes = self.graph_service.get_all_nodes(project_id)
-        node_lookup = {n.id: n for n in db_nodes}
+        node_lookup = self.graph_service.get_node_projections(project_id)
 
         self._set_trace_status("Trace Decomposition: Decomposing traces...")
         self._save_project_trace_decomposition(
@@ -449,10 +564,19 @@ class FunctionalDecompositionService:
         summarizer,
         allow_ai: bool,
         node_lookup,
+        traces=None,
     ):
-        traces = self.trace_service.get_project_traces(project_id)
+        if traces is None:
+            traces = self.trace_service.get_project_traces(project_id)
 
         total_traces = len(traces)
+        trace_workers = min(TRACE_DECOMPOSITION_WORKERS, total_traces)
+
+        # AI naming goes through this process's LLM client and node lookup,
+        # so only AI-free runs fan out across traces.
+        if not allow_ai and trace_workers > 1:
+            self._save_traces_in_pool(project_id, traces, trace_workers)
+            return
 
         for index, trace in enumerate(traces, start=1):
             trace_label = trace.name or f"Trace_{trace.id}"
@@ -480,6 +604,19 @@ class FunctionalDecompositionService:
                     total_traces=trace_total_snapshot,
                 )
 
+            step_index = self.trace_service.get_step_index(trace.id)
+            if self.trace_decomposition.should_stream(step_index.total_steps):
+                self._stream_trace_decomposition(
+                    project_id=project_id,
+                    trace_id=trace.id,
+                    step_index=step_index,
+                    summarizer=summarizer,
+                    allow_ai=allow_ai,
+                    node_lookup=node_lookup,
+                    progress_callback=progress_callback,
+                )
+                continue
+
             trace_data = self.trace_service.get_trace_file(trace.id)
             decomposition_result = self.trace_decomposition.decompose_trace(
                 trace_data=trace_data,
@@ -490,60 +627,180 @@ class FunctionalDecompositionService:
                 collect_nodes_with_ancestors=self.collect_nodes_with_ancestors,
                 progress_callback=progress_callback,
             )
-            micro_segments = decomposition_result.get("micro_segments", [])
+            micro_features = [
+                self.trace_decomposition.micro_feature_record(segment)
+                for segment in decomposition_result.get("micro_segments", [])
+            ]
             hierarchical_clusters = decomposition_result.get("hierarchical_clusters", [])
             self._persist_trace_decomposition(
                 project_id,
                 trace.id,
-                micro_segments,
+                micro_features,
                 hierarchical_clusters,
             )
 
+    def _save_traces_in_pool(self, project_id: int, traces, trace_workers: int):
+        """
+        Decomposes traces concurrently on a process pool. This process is the
+        only DB writer: it persists each trace's result as it arrives and
+        reports progress across all traces.
+        """
+
+        total_traces = len(traces)
+        operation_nodes = self.graph_service.get_summary_map(project_id)
+        segment_workers = max(1, TRACE_DECOMPOSITION_WORKERS // trace_workers)
+
+        self._set_trace_status(f"Trace Decomposition: Decomposing {total_traces} traces...")
+
+        with create_process_pool(trace_workers, _init_trace_decomposition_worker, (operation_nodes, segment_workers)) as pool:
+            futures = {
+                pool.submit(decompose_trace_file, project_id, trace.trace_seq_path): trace
+                for trace in traces
+            }
+
+            for done, future in enumerate(as_completed(futures), start=1):
+                trace = futures[future]
+                result = future.result()
+
+                self._persist_trace_decomposition(
+                    project_id,
+                    trace.id,
+                    result["micro_features"],
+                    result["hierarchical_clusters"],
+                )
+
+                trace_label = trace.name or f"Trace_{trace.id}"
+                self._set_trace_status(
+                    f"Trace Decomposition: Decomposed {done}/{total_traces} traces ({int(done / total_traces * 100)}%) - {trace_label}"
+                )
+
+    def _stream_trace_decomposition(
+        self,
+        project_id: int,
+        trace_id: int,
+        step_index,
+        summarizer,
+        allow_ai: bool,
+        node_lookup,
+        progress_callback,
+    ):
+        # Micro features are written as their window completes; flows and
+        # clusters need all of them and are written at the end.
+        persisted = []
+        persisted_by_segment_index = {}
+
+        def persist_micro_segments(micro_segments):
+            self._persist_micro_features(
+                project_id,
+                trace_id,
+                [self.trace_decomposition.micro_feature_record(segment) for segment in micro_segments],
+                persisted,
+                persisted_by_segment_index,
+            )
+
+        hierarchical_clusters = self.trace_decomposition.decompose_trace_stream(
+            step_index=step_index,
+            project_id=project_id,
+            summarizer=summarizer,
+            allow_ai=allow_ai,
+            node_lookup=node_lookup,
+            collect_nodes_with_ancestors=self.collect_nodes_with_ancestors,
+            persist_micro_segments=persist_micro_segments,
+            progress_callback=progress_callback,
+        )
+
+        self._persist_micro_feature_links(
+            project_id,
+            trace_id,
+            persisted,
+            persisted_by_segment_index,
+            hierarchical_clusters,
+        )
+
     def _persist_trace_decomposition(
         self,
         project_id: int,
         trace_id: int,
-        micro_segments,
+        micro_features,
         hierarchical_clusters,
     ):
         persisted = []
         persisted_by_segment_index = {}
 
-        for segment in micro_segments:
-            segment_steps = segment.get("steps", [])
-            components = segment.get("components", [])
-            step_numbers = self.trace_decomposition.extract_step_numbers(segment_steps)
+        self._persist_micro_features(
+            project_id,
+            trace_id,
+            micro_features,
+            persisted,
+            persisted_by_segment_index,
+        )
+
+        self._persist_micro_feature_links(
+            project_id,
+            trace_id,
+            persisted,
+            persisted_by_segment_index,
+            hierarchical_clusters,
+        )
 
-            start_step = min(step_numbers) if step_numbers else None
-            end_step = max(step_numbers) if step_numbers else None
+    def _persist_micro_features(
+        self,
+        project_id: int,
+        trace_id: int,
+        micro_features,
+        persisted,
+        persisted_by_segment_index,
+    ):
+        """
+        Inserts the micro feature records of a trace in one flush and
+        appends the rows to persisted / persisted_by_segment_index.
+        """
+
+        rows = []
+        segment_indexes = []
+
+        for micro_feature in micro_features:
+            position = len(persisted) + len(rows) + 1
+
+            rows.append({
+                "project_id": project_id,
+                "trace_id": trace_id,
+                "sequence_order": int(micro_feature.get("segmentIndex") or position),
+                "name": str(micro_feature.get("name") or f"Segment_{position}"),
+                "description": micro_feature.get("description"),
+                "category": "MicroFeature",
+                "components": micro_feature.get("components", []),
+                "step_count": micro_feature.get("stepCount", 0),
+                "start_step": micro_feature.get("startStep"),
+                "end_step": micro_feature.get("endStep"),
+            })
+            segment_indexes.append(int(micro_feature.get("segmentIndex") or position))
+
+        if not rows:
+            return
 
-            persisted_row = self.micro_features_repo.create_micro_feature(
-                project_id=project_id,
-                trace_id=trace_id,
-                sequence_order=int(segment.get("segmentIndex", len(persisted) + 1)),
-                name=str(segment.get("name") or f"Segment_{len(persisted) + 1}"),
-                description=segment.get("description"),
-                category="MicroFeature",
-                components=components,
-                step_count=len(segment_steps),
-                start_step=start_step,
-                end_step=end_step,
-                commit=False,
-            )
+        for segment_index, persisted_row in zip(segment_indexes, self.micro_features_repo.create_micro_features(rows)):
             persisted.append(persisted_row)
-
-            segment_index = int(segment.get("segmentIndex", len(persisted)))
             persisted_by_segment_index[segment_index] = persisted_row
 
-        for index in range(len(persisted) - 1):
-            self.micro_features_repo.create_micro_feature_flow(
-                project_id=project_id,
-                trace_id=trace_id,
-                source_micro_feature_id=persisted[index].id,
-                target_micro_feature_id=persisted[index + 1].id,
-                sequence_order=index + 1,
-                commit=False,
-            )
+    def _persist_micro_feature_links(
+        self,
+        project_id: int,
+        trace_id: int,
+        persisted,
+        persisted_by_segment_index,
+        hierarchical_clusters,
+    ):
+        self.micro_features_repo.create_micro_feature_flows([
+            {
+                "project_id": project_id,
+                "trace_id": trace_id,
+                "source_micro_feature_id": persisted[index].id,
+                "target_micro_feature_id": persisted[index + 1].id,
+                "sequence_order": index + 1,
+            }
+            for index in range(len(persisted) - 1)
+        ])
 
         if hierarchical_clusters:
             self._persist_hierarchical_clusters(
@@ -628,67 +885,27 @@ class FunctionalDecompositionService:
         return sorted(set(member_ids))
 
     def _load_execution_units_from_trace_decomposition(self, project_id: int):
-        traces = self.trace_service.get_project_traces(project_id)
-
-        execution_units = []
-
-        for trace in traces:
-            micro_features = self.micro_features_repo.get_micro_features_by_trace(trace.id)
-            clusters = self.micro_features_repo.get_hierarchical_clusters_by_trace(trace.id)
-
-            micro_by_id = {
-                micro_feature.id: micro_feature
-                for micro_feature in micro_features
-            }
-
-            top_level_clusters = [
-                cluster
-                for cluster in clusters
-                if cluster.parent_cluster_id is None
-            ]
-
-            # Fallback: if something went wrong and no top-level cluster exists, treat the whole trace as one execution unit.
-            if not top_level_clusters and micro_features:
-                functions = set()
-
-                for micro_feature in micro_features:
-                    for component in micro_feature.components or []:
-                        functions.add(component)
-
-                if functions:
-                    execution_units.append({
-                        "trace_id": trace.id,
-                        "trace_name": trace.name,
-                        "execution_unit_id": f"{trace.id}:full",
-                        "functions": functions,
-                    })
-                
-                continue
-
-            for index, cluster in enumerate(top_level_clusters, start=1):
-                functions = set()
-
-                for micro_feature_id in cluster.member_micro_feature_ids or []:
-                    micro_feature = micro_by_id.get(micro_feature_id)
-
-                    if not micro_feature:
-                        continue
-
-                    for component in micro_feature.components or []:
-                        functions.add(component)
-
-                if not functions:
-                    continue
-
-                execution_units.append({
-                    "trace_id": trace.id,
-                    "trace_name": trace.name,
-                    "execution_unit_id": f"{trace.id}:episode:{cluster.id}",
-                    "episode_index": index,
-                    "functions": functions,
-                })
-
-        return execution_units
+        units = {}
+
+        for row in self.micro_features_repo.get_execution_unit_components(project_id):
+            unit_key = (row.trace_id, row.cluster_id)
+
+            unit = units.get(unit_key)
+            if unit is None:
+                unit = units[unit_key] = {
+                    "trace_id": row.trace_id,
+                    # Traces without top-level clusters fall back to one unit for the whole trace.
+                    "execution_unit_id": (
+                        f"{row.trace_id}:full"
+                        if row.cluster_id is None
+                        else f"{row.trace_id}:episode:{row.cluster_id}"
+                    ),
+                    "functions": set(),
+                }
+
+            unit["functions"].add(row.component)
+
+        return list(units.values())
     
     def collect_operation_nodes(self, components, node_lookup):
         operation_nodes = []
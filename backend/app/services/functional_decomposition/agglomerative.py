@@ -1,24 +1,203 @@
 from __future__ import annotations
 
+import heapq
+import os
 from typing import TYPE_CHECKING
 
 import numpy as np
-from sklearn.cluster import AgglomerativeClustering
+from scipy import sparse
+from scipy.cluster import hierarchy
 from sklearn.feature_extraction.text import TfidfTransformer
-from sklearn.metrics import silhouette_score
+
+from app.services.functional_decomposition.minhash import MinHashNeighborhoods
 
 if TYPE_CHECKING:
     from app.services.func_decomp_service import FunctionalDecompositionService
 
+# Functions whose silhouette is tracked while the partitions are scored; every function below this count.
+SILHOUETTE_SAMPLE_SIZE = int(os.getenv("FUNCTIONAL_SILHOUETTE_SAMPLE_SIZE", "2000"))
+
+# Above this many functions the automatic clustering mode switches to MinHash/LSH neighborhoods.
+APPROXIMATE_MIN_FUNCTIONS = int(os.getenv("FUNCTIONAL_APPROXIMATE_MIN_FUNCTIONS", "20000"))
+
+# Largest candidate neighborhood the approximate mode clusters exactly.
+APPROXIMATE_MAX_NEIGHBORHOOD = int(os.getenv("FUNCTIONAL_APPROXIMATE_MAX_NEIGHBORHOOD", "5000"))
+
+CLUSTERING_MODES = ("auto", "exact", "approximate")
+
+# Similarities computed at once while filling the condensed distance vector.
+DISTANCE_BLOCK_ENTRIES = 4_000_000
+
+
+def _condensed_indices(function_count, index, others):
+    """
+    Positions of the pairs (index, other) in a condensed pairwise vector, for every other in others.
+    """
+
+    low = np.minimum(others, index)
+    high = np.maximum(others, index)
+    return low * function_count - low * (low + 1) // 2 + high - low - 1
+
+
+class _SampledSilhouette:
+    """
+    Silhouette of a fixed sample of functions, kept up to date while the merges of a linkage are replayed.
+    Every sampled function holds its summed distance to each current cluster, so a merge adds two columns
+    and only re-scans the functions whose nearest other cluster took part in it.
+    """
+
+    def __init__(self, distances, function_count, sample_size, seed=42):
+        if function_count <= sample_size:
+            sample = np.arange(function_count)
+        else:
+            sample = np.sort(np.random.default_rng(seed).choice(function_count, size=sample_size, replace=False))
+
+        everyone = np.arange(function_count)
+
+        self.rows = np.arange(len(sample))
+        self.own = sample.copy()
+        self.sizes = np.ones(function_count)
+        self.cluster_sums = np.empty((len(sample), function_count))
+
+        for row, index in enumerate(sample):
+            self.cluster_sums[row] = distances[_condensed_indices(function_count, index, everyone)]
+            self.cluster_sums[row, index] = 0.0
+
+        self.nearest = np.empty(len(sample), dtype=np.int64)
+        self.nearest_mean = np.empty(len(sample))
+        self._rescan(self.rows)
+
+    def _rescan(self, rows):
+        if not len(rows):
+            return
+
+        means = self.cluster_sums[rows] / self.sizes
+        means[np.arange(len(rows)), self.own[rows]] = np.inf
+
+        nearest = np.argmin(means, axis=1)
+        self.nearest[rows] = nearest
+        self.nearest_mean[rows] = means[np.arange(len(rows)), nearest]
+
+    def merge(self, kept, absorbed):
+        self.cluster_sums[:, kept] += self.cluster_sums[:, absorbed]
+        self.cluster_sums[:, absorbed] = np.inf
+        self.sizes[kept] += self.sizes[absorbed]
+        self.own[self.own == absorbed] = kept
+
+        merged_mean = self.cluster_sums[:, kept] / self.sizes[kept]
+        touched = (self.nearest == kept) | (self.nearest == absorbed)
+
+        # Other clusters are unchanged, so the merged cluster is nearest whenever it is at least as close as
+        # the previous nearest one; a function that lost its nearest cluster otherwise needs a re-scan.
+        closer = (self.own != kept) & (merged_mean <= self.nearest_mean)
+        self.nearest[closer] = kept
+        self.nearest_mean[closer] = merged_mean[closer]
+
+        self._rescan(np.flatnonzero(touched & ~closer))
+
+    def score(self):
+        own_sizes = self.sizes[self.own]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            intra = self.cluster_sums[self.rows, self.own] / (own_sizes - 1.0)
+            values = (self.nearest_mean - intra) / np.maximum(intra, self.nearest_mean)
+
+        # Functions alone in their cluster score 0, as in sklearn.
+        values = np.nan_to_num(values)
+        values[own_sizes == 1.0] = 0.0
+
+        return float(np.mean(values))
+
+
+class _NearestCentroids:
+    """
+    Cosine similarity of every current cluster centroid to its nearest other centroid, kept up to date while
+    the merges of a linkage are replayed. Centroid similarities come from the dot products between the summed
+    rows of the clusters, which a merge adds up in the condensed vector the way average linkage adds distances.
+    """
+
+    def __init__(self, products, self_products, function_count):
+        self.products = products
+        self.self_products = self_products
+        self.function_count = function_count
+        self.active = np.ones(function_count, dtype=bool)
+        self.nearest = np.zeros(function_count, dtype=np.int64)
+        self.nearest_similarity = np.zeros(function_count)
+
+        for slot in range(function_count):
+            self._rescan(slot)
+
+    def _others(self, slot):
+        others = np.flatnonzero(self.active)
+        return others[others != slot]
+
+    def _similarities(self, slot, others):
+        products = self.products[_condensed_indices(self.function_count, slot, others)]
+        norms = np.sqrt(self.self_products[others] * self.self_products[slot])
+
+        # Clusters without weight have similarity 0, i.e. distance 1, to everything.
+        similarities = np.zeros(len(others))
+        np.divide(products, norms, out=similarities, where=norms > 0.0)
+        return similarities
+
+    def _rescan(self, slot):
+        others = self._others(slot)
+        if not len(others):
+            return
+
+        similarities = self._similarities(slot, others)
+        best = int(np.argmax(similarities))
+        self.nearest[slot] = others[best]
+        self.nearest_similarity[slot] = similarities[best]
+
+    def merge(self, kept, absorbed):
+        self.active[absorbed] = False
+        others = self._others(kept)
+
+        cross_product = float(self.products[_condensed_indices(self.function_count, kept, absorbed)])
+        self.products[_condensed_indices(self.function_count, kept, others)] += (
+            self.products[_condensed_indices(self.function_count, absorbed, others)]
+        )
+        self.self_products[kept] += self.self_products[absorbed] + 2.0 * cross_product
+
+        if not len(others):
+            return
+
+        similarities = self._similarities(kept, others)
+        best = int(np.argmax(similarities))
+        self.nearest[kept] = others[best]
+        self.nearest_similarity[kept] = similarities[best]
+
+        previous = self.nearest[others]
+        touched = (previous == kept) | (previous == absorbed)
+
+        closer = similarities >= self.nearest_similarity[others]
+        self.nearest[others[closer]] = kept
+        self.nearest_similarity[others[closer]] = similarities[closer]
+
+        for slot in others[touched & ~closer]:
+            self._rescan(slot)
+
+    def separation(self):
+        active = np.flatnonzero(self.active)
+        if len(active) <= 1:
+            return 0.0
+
+        nearest_distances = np.clip(1.0 - self.nearest_similarity[active], 0.0, 1.0)
+
+        # Mean nearest rewards generally well-separated clusters.
+        # Min nearest prevents one pair of almost-identical clusters from being ignored.
+        return 0.70 * float(np.mean(nearest_distances)) + 0.30 * float(np.min(nearest_distances))
+
 
 class AgglomerativeDecomposition:
     def __init__(self, service: "FunctionalDecompositionService"):
         self.service = service
 
-    def _frequency_filtering(self, X: np.ndarray):
+    def _frequency_filtering(self, X: sparse.csr_matrix):
         # TF-IDF down-weights very common functions and highlights trace-specific functions.
         tfidf = TfidfTransformer(norm="l2", use_idf=True, smooth_idf=True)
-        X_weighted = tfidf.fit_transform(X.T).T.toarray()
+        X_weighted = tfidf.fit_transform(sparse.csr_matrix(X).T).T.tocsr()
 
         idfs = tfidf.idf_
         idf_min, idf_max = np.min(idfs), np.max(idfs)
@@ -29,29 +208,31 @@ class AgglomerativeDecomposition:
 
         return X_weighted, normalized_idfs
 
-    def _cluster_traces(self, X: np.ndarray):
-        if X.size == 0:
+    def _cluster_traces(self, X: sparse.csr_matrix):
+        if X.shape[0] == 0 or X.shape[1] == 0:
             return {}
-        
+
         function_count = X.shape[0]
 
         if function_count == 1:
             return {0: [0]}
-        
+
         if function_count == 2:
-            distance = self._cosine_distance(X[0], X[1])
+            distance = self._cosine_distance(self._row(X, 0), self._row(X, 1))
             if distance >= 0.55:
                 return {0: [0], 1: [1]}
             return {0: [0, 1]}
-        
-        partitions, merge_distances = self._build_full_hierarchy(X)
 
-        selected_partition = self._select_best_partition(
+        distances, merges, merge_distances = self._build_full_hierarchy(X)
+
+        merge_count = self._select_best_partition(
             X=X,
-            partitions=partitions,
+            distances=distances,
+            merges=merges,
             merge_distances=merge_distances,
         )
 
+        selected_partition = self._partition_after(function_count, merges, merge_count)
         selected_partition = self._merge_weak_singletons(X, selected_partition)
 
         return {
@@ -59,250 +240,300 @@ class AgglomerativeDecomposition:
             for label, indices in enumerate(selected_partition)
             if indices
         }
-    
-    def _build_full_hierarchy(self, X: np.ndarray):
-        function_count = X.shape[0]
 
-        model = AgglomerativeClustering(
-            n_clusters=None,
-            distance_threshold=0.0,
-            metric="cosine",
-            linkage="average",
-            compute_distances=True,
-        )
+    def _uses_approximate_clustering(self, function_count, clustering_mode):
+        if clustering_mode not in CLUSTERING_MODES:
+            raise ValueError(f"Unknown clustering mode: {clustering_mode}")
 
-        model.fit(X)
+        if clustering_mode == "auto":
+            return function_count > APPROXIMATE_MIN_FUNCTIONS
 
-        cluster_members = {
-            index: [index]
-            for index in range(function_count)
+        return clustering_mode == "approximate"
+
+    def _cluster_traces_approximate(self, X: sparse.csr_matrix):
+        """
+        Clusters every MinHash/LSH candidate neighborhood on its own with the exact path, so the quadratic
+        distances only ever cover one neighborhood. Singletons are finally attached to the nearest cluster.
+        """
+
+        if X.shape[0] == 0 or X.shape[1] == 0:
+            return {}
+
+        neighborhoods = MinHashNeighborhoods(max_size=APPROXIMATE_MAX_NEIGHBORHOOD).neighborhoods(X)
+
+        clusters = []
+        for rows in neighborhoods:
+            if len(rows) == 1:
+                clusters.append([int(rows[0])])
+                continue
+
+            for indices in self._cluster_traces(X[rows]).values():
+                clusters.append(sorted(int(rows[index]) for index in indices))
+
+        clusters = self._attach_singletons(X, clusters)
+        clusters.sort(key=lambda cluster: cluster[0])
+
+        return {
+            label: cluster
+            for label, cluster in enumerate(clusters)
         }
 
-        active_cluster_ids = list(range(function_count))
+    def _attach_singletons(
+            self,
+            X,
+            clusters,
+            min_isolation=0.65,
+            min_support=2,
+    ):
+        """
+        Approximate counterpart of _merge_weak_singletons across neighborhoods: every singleton moves into
+        the nearest larger cluster unless it has enough evidence and is clearly isolated. Centroids stay
+        fixed while singletons move, so all of them are scored in sparse products instead of one by one.
+        """
 
-        partitions = [
-            self._snapshot_partition(active_cluster_ids, cluster_members)
-        ]
+        singletons = [cluster[0] for cluster in clusters if len(cluster) == 1]
+        groups = [cluster for cluster in clusters if len(cluster) > 1]
 
-        merge_distances = np.asarray(model.distances_, dtype=float)
+        if not singletons or not groups:
+            return clusters
 
-        for merge_index, children in enumerate(model.children_):
-            left_id = int(children[0])
-            right_id = int(children[1])
-            new_id = function_count + merge_index
+        centroids = self._unit_rows(sparse.csr_matrix(self._centroids(X, groups)))
+        singleton_rows = self._unit_rows(X[singletons])
+        supports = np.diff(X[singletons].indptr)
 
-            merged_members = (
-                cluster_members[left_id]
-                + cluster_members[right_id]
-            )
+        block = max(1, DISTANCE_BLOCK_ENTRIES // len(groups))
+        kept = []
 
-            cluster_members[new_id] = merged_members
+        for start in range(0, len(singletons), block):
+            similarities = (singleton_rows[start:start + block] @ centroids.T).tocsr()
 
-            active_cluster_ids = [
-                cluster_id
-                for cluster_id in active_cluster_ids
-                if cluster_id not in {left_id, right_id}
-            ]
-            active_cluster_ids.append(new_id)
+            for offset in range(similarities.shape[0]):
+                function_index = singletons[start + offset]
+                begin, end = similarities.indptr[offset], similarities.indptr[offset + 1]
 
-            partitions.append(
-                self._snapshot_partition(active_cluster_ids, cluster_members)
-            )
+                # Without any overlap every centroid is at distance 1; like argmin in _merge_weak_singletons,
+                # the first cluster is then the nearest.
+                if begin == end:
+                    nearest, distance = 0, 1.0
+                else:
+                    best = begin + int(np.argmax(similarities.data[begin:end]))
+                    nearest = int(similarities.indices[best])
+                    distance = 1.0 - min(1.0, float(similarities.data[best]))
 
-        return partitions, merge_distances
-    
-    def _snapshot_partition(self, active_cluster_ids, cluster_members):
-        return [
-            sorted(cluster_members[cluster_id])
-            for cluster_id in sorted(
-                active_cluster_ids,
-                key=lambda cluster_id: min(cluster_members[cluster_id])
-            )
-        ]
-    
-    def _select_best_partition(self, X, partitions, merge_distances):
-        if not partitions:
-            return []
-        
-        if len(partitions) == 1:
-            return partitions[0]
-        
-        function_count = X.shape[0]
+                if supports[start + offset] >= min_support and distance >= min_isolation:
+                    kept.append([function_index])
+                else:
+                    groups[nearest].append(function_index)
 
-        best_partition = partitions[-1]
-        best_score = float("-inf")
+        return [sorted(cluster) for cluster in groups] + kept
 
-        for partition_index, partition in enumerate(partitions):
-            cluster_count = len(partition)
+    def _build_full_hierarchy(self, X: sparse.csr_matrix):
+        """
+        Average-linkage merge log over the cosine distances of the rows. The condensed distances are
+        returned too, since the partition search reuses them instead of recomputing distances per cut.
+        """
 
-            silhouette = self._partition_silhouette(X, partition)
-            cohesion = self._partition_cohesion(X, partition)
-            separation = self._partition_separation(X, partition)
-            merge_jump = self._partition_merge_jump(partition_index, merge_distances)
+        distances = self._condensed_cosine_distances(X)
+        linkage = hierarchy.linkage(distances, method="average")
 
-            complexity_penalty = self._complexity_penalty(
-                cluster_count=cluster_count,
-                function_count=function_count,
-            )
+        return distances, linkage[:, :2].astype(int), np.asarray(linkage[:, 2], dtype=float)
+
+    def _condensed_cosine_distances(self, X):
+        function_count = X.shape[0]
+        unit_rows = self._unit_rows(X)
 
-            singleton_penalty = self._singleton_penalty(partition)
+        distances = np.empty(function_count * (function_count - 1) // 2)
+        block = max(1, DISTANCE_BLOCK_ENTRIES // function_count)
+        position = 0
 
-            score = (
-                0.30 * silhouette
-                + 0.25 * cohesion
-                + 0.20 * separation
-                + 0.15 * merge_jump
-                - 0.20 * complexity_penalty
-                - 0.25 * singleton_penalty
-            )
+        for start in range(0, function_count - 1, block):
+            stop = min(function_count - 1, start + block)
+            similarities = (unit_rows[start:stop] @ unit_rows[start:].T).toarray()
 
-            if cluster_count == function_count and function_count > 2:
-                score -= 0.20
+            for offset in range(stop - start):
+                row = similarities[offset, offset + 1:]
+                distances[position:position + len(row)] = row
+                position += len(row)
 
-            if score > best_score:
-                best_score = score
-                best_partition = partition
+        # Rows without weight are at distance 1 from everything, as in _cosine_distance.
+        np.subtract(1.0, distances, out=distances)
+        np.clip(distances, 0.0, 1.0, out=distances)
 
-        return best_partition
-    
-    def _partition_silhouette(self, X, partition):
-        labels = self._labels_from_partition(X.shape[0], partition)
-        cluster_count = len(set(labels))
+        return distances
 
-        if cluster_count <= 1:
-            return 0.0
+    def _partition_after(self, function_count, merges, merge_count):
+        members = {
+            index: [index]
+            for index in range(function_count)
+        }
 
-        if cluster_count >= X.shape[0]:
-            return 0.0
+        for merge_index in range(merge_count):
+            left = members.pop(int(merges[merge_index][0]))
+            right = members.pop(int(merges[merge_index][1]))
 
-        try:
-            raw_score = silhouette_score(X, labels, metric="cosine")
-        except ValueError:
-            return 0.0
+            if len(left) < len(right):
+                left, right = right, left
 
-        # Convert from [-1, 1] to [0, 1].
-        return float((raw_score + 1.0) / 2.0)
-    
-    def _labels_from_partition(self, function_count, partition):
-        labels = np.zeros(function_count, dtype=int)
-
-        for label, cluster in enumerate(partition):
-            for index in cluster:
-                labels[index] = label
-
-        return labels
-    
-    def _partition_cohesion(self, X, partition):
-        dispersion = self._partition_internal_dispersion(X, partition)
-        return float(max(0.0, min(1.0, 1.0 - dispersion)))
-    
-    def _partition_internal_dispersion(self, X, partition):
-        if not partition:
-            return 0.0
+            left.extend(right)
+            members[function_count + merge_index] = left
 
-        total_weight = 0.0
-        weighted_dispersion = 0.0
+        return sorted(
+            (sorted(cluster) for cluster in members.values()),
+            key=lambda cluster: cluster[0],
+        )
 
-        for cluster in partition:
-            if not cluster:
-                continue
+    def _select_best_partition(self, X, distances, merges, merge_distances):
+        """
+        Returns the number of merges after which the partition scores best.
+        The partitions are visited by replaying the merge log once. Cohesion, separation and singleton
+        counts are running totals over the current clusters, and silhouette is tracked for a sample of
+        functions. The condensed distances are turned into centroid dot products in place.
+        """
 
-            weight = len(cluster)
-            dispersion = self._cluster_internal_dispersion(X, cluster)
+        function_count = X.shape[0]
 
-            weighted_dispersion += weight * dispersion
-            total_weight += weight
+        if not len(merges):
+            return 0
 
-        if total_weight == 0.0:
-            return 0.0
+        row_norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1), dtype=float).ravel())
+        unit_rows = self._unit_rows(X)
 
-        return float(weighted_dispersion / total_weight)
-    
-    def _cluster_internal_dispersion(self, X, cluster):
-        if len(cluster) <= 1:
-            return 0.0
+        silhouette_state = _SampledSilhouette(distances, function_count, SILHOUETTE_SAMPLE_SIZE)
 
-        vectors = X[cluster]
-        centroid = np.mean(vectors, axis=0)
+        # Row dot products from the cosine distances, computed in place: x_i . x_j = |x_i| |x_j| (1 - d_ij).
+        position = 0
+        for index in range(function_count - 1):
+            row = distances[position:position + function_count - index - 1]
+            np.subtract(1.0, row, out=row)
+            row *= row_norms[index] * row_norms[index + 1:]
+            position += len(row)
 
-        distances = [
-            self._cosine_distance(vector, centroid)
-            for vector in vectors
-        ]
+        centroid_state = _NearestCentroids(distances, row_norms ** 2, function_count)
 
-        if not distances:
-            return 0.0
+        # Summed rows and summed unit rows of the clusters with more than one function. The summed cosine
+        # distance of a cluster's rows to its centroid is then size - (unit sum . sum) / |sum|.
+        summed_rows = {}
+        spreads = np.zeros(function_count)
+        spread_total = 0.0
 
-        return float(sum(distances) / len(distances))
-    
-    def _partition_separation(self, X, partition):
-        if len(partition) <= 1:
-            return 0.0
+        def cluster_vectors(slot):
+            if slot in summed_rows:
+                return summed_rows.pop(slot)
+            return self._row(X, slot), self._row(unit_rows, slot)
 
-        centroids = [
-            np.mean(X[cluster], axis=0)
-            for cluster in partition
-            if cluster
-        ]
+        sizes = np.ones(function_count, dtype=np.int64)
+        singleton_count = function_count
+        slots = list(range(function_count))
 
-        if len(centroids) <= 1:
-            return 0.0
+        distance_range = float(np.max(merge_distances) - np.min(merge_distances))
 
-        nearest_distances = []
+        # Two heaps holding the merge distances seen so far, for their running median
+        lower_distances = []
+        upper_distances = []
 
-        for index, centroid in enumerate(centroids):
-            distances = []
+        best_merge_count = len(merges)
+        best_score = float("-inf")
 
-            for other_index, other_centroid in enumerate(centroids):
-                if index == other_index:
-                    continue
+        for partition_index in range(len(merges) + 1):
+            cluster_count = function_count - partition_index
 
-                distances.append(
-                    self._cosine_distance(centroid, other_centroid)
+            if 1 < cluster_count < function_count:
+                # Convert from [-1, 1] to [0, 1].
+                silhouette = (silhouette_state.score() + 1.0) / 2.0
+            else:
+                silhouette = 0.0
+
+            cohesion = max(0.0, min(1.0, 1.0 - spread_total / function_count))
+            separation = centroid_state.separation()
+
+            if 0 < partition_index < len(merge_distances):
+                if len(lower_distances) > len(upper_distances):
+                    previous_reference = -lower_distances[0]
+                else:
+                    previous_reference = (-lower_distances[0] + upper_distances[0]) / 2
+
+                merge_jump = self._merge_jump(
+                    next_distance=float(merge_distances[partition_index]),
+                    previous_reference=previous_reference,
+                    distance_range=distance_range,
                 )
+            else:
+                merge_jump = 0.0
 
-            if distances:
-                nearest_distances.append(min(distances))
+            complexity_penalty = self._complexity_penalty(
+                cluster_count=cluster_count,
+                function_count=function_count,
+            )
 
-        if not nearest_distances:
-            return 0.0
+            singleton_penalty = singleton_count / cluster_count
 
-        mean_nearest = float(np.mean(nearest_distances))
-        min_nearest = float(np.min(nearest_distances))
+            score = (
+                0.30 * silhouette
+                + 0.25 * cohesion
+                + 0.20 * separation
+                + 0.15 * merge_jump
+                - 0.20 * complexity_penalty
+                - 0.25 * singleton_penalty
+            )
 
-        # Mean nearest rewards generally well-separated clusters.
-        # Min nearest prevents one pair of almost-identical clusters from being ignored.
-        return 0.70 * mean_nearest + 0.30 * min_nearest
-    
-    def _partition_merge_jump(self, partition_index, merge_distances):
-        if merge_distances is None or len(merge_distances) == 0:
-            return 0.0
+            if cluster_count == function_count and function_count > 2:
+                score -= 0.20
 
-        if partition_index <= 0:
-            return 0.0
+            if score > best_score:
+                best_score = score
+                best_merge_count = partition_index
 
-        if partition_index >= len(merge_distances):
-            return 0.0
+            if partition_index == len(merges):
+                break
 
-        next_distance = float(merge_distances[partition_index])
-        previous_distances = np.asarray(merge_distances[:partition_index], dtype=float)
+            # Apply the next merge to the running totals
+            left_slot = slots[int(merges[partition_index][0])]
+            right_slot = slots[int(merges[partition_index][1])]
+            kept, absorbed = min(left_slot, right_slot), max(left_slot, right_slot)
+            slots.append(kept)
 
-        if previous_distances.size == 0:
-            return 0.0
+            singleton_count -= int(sizes[kept] == 1) + int(sizes[absorbed] == 1)
+            sizes[kept] += sizes[absorbed]
+
+            kept_sum, kept_unit_sum = cluster_vectors(kept)
+            absorbed_sum, absorbed_unit_sum = cluster_vectors(absorbed)
+            merged_sum = kept_sum + absorbed_sum
+            merged_unit_sum = kept_unit_sum + absorbed_unit_sum
+            summed_rows[kept] = (merged_sum, merged_unit_sum)
+
+            merged_norm = np.linalg.norm(merged_sum)
+            merged_spread = float(sizes[kept])
+            if merged_norm > 0.0:
+                merged_spread -= float(np.dot(merged_unit_sum, merged_sum)) / merged_norm
+
+            spread_total += merged_spread - spreads[kept] - spreads[absorbed]
+            spreads[kept] = merged_spread
+            spreads[absorbed] = 0.0
+
+            silhouette_state.merge(kept, absorbed)
+            centroid_state.merge(kept, absorbed)
+
+            distance = float(merge_distances[partition_index])
+            if lower_distances and distance > -lower_distances[0]:
+                heapq.heappush(upper_distances, distance)
+            else:
+                heapq.heappush(lower_distances, -distance)
 
-        previous_reference = float(np.median(previous_distances))
+            if len(lower_distances) > len(upper_distances) + 1:
+                heapq.heappush(upper_distances, -heapq.heappop(lower_distances))
+            elif len(upper_distances) > len(lower_distances):
+                heapq.heappush(lower_distances, -heapq.heappop(upper_distances))
 
-        distance_min = float(np.min(merge_distances))
-        distance_max = float(np.max(merge_distances))
-        distance_range = distance_max - distance_min
+        return best_merge_count
 
+    def _merge_jump(self, next_distance, previous_reference, distance_range):
         if distance_range <= 0.0:
             return 0.0
 
         jump = max(0.0, next_distance - previous_reference)
 
         return float(min(1.0, jump / distance_range))
-    
+
     def _complexity_penalty(self, cluster_count, function_count):
         if function_count <= 1:
             return 0.0
@@ -311,19 +542,7 @@ class AgglomerativeDecomposition:
             return 0.0
 
         return float((cluster_count - 1) / max(1, function_count - 1))
-    
-    def _singleton_penalty(self, partition):
-        if not partition:
-            return 0.0
-
-        singleton_count = sum(
-            1
-            for cluster in partition
-            if len(cluster) == 1
-        )
 
-        return float(singleton_count / len(partition))
-    
     def _merge_weak_singletons(
             self,
             X,
@@ -340,62 +559,103 @@ class AgglomerativeDecomposition:
         if len(clusters) <= 1:
             return clusters
 
-        changed = True
+        # Centroids keep the row of their cluster's original position; rows lists the clusters still in
+        # use, in partition order.
+        centroids = self._centroids(X, clusters).toarray()
+        centroid_norms = np.linalg.norm(centroids, axis=1)
+        in_use = np.ones(len(clusters), dtype=bool)
+        rows = list(range(len(clusters)))
+
+        # Singletons already found isolated. A merge only moves the centroid it merged into, so they
+        # stay isolated unless that centroid came closer than min_isolation.
+        isolated = set()
+
+        while len(rows) > 1:
+            row = next(
+                (row for row in rows if len(clusters[row]) == 1 and row not in isolated),
+                None,
+            )
 
-        while changed and len(clusters) > 1:
-            changed = False
+            if row is None:
+                break
 
-            for cluster_index, cluster in enumerate(list(clusters)):
-                if len(cluster) != 1:
-                    continue
+            function_index = clusters[row][0]
+            support = int(np.count_nonzero(self._row(X, function_index) > 0.0))
 
-                function_index = cluster[0]
-                support = int(np.count_nonzero(X[function_index] > 0.0))
+            distances = self._centroid_distances(centroids, centroid_norms, row)
+            distances[~in_use] = np.inf
+            distances[row] = np.inf
 
-                nearest_index, nearest_distance = self._nearest_cluster(
-                    X,
-                    clusters,
-                    cluster_index,
-                )
+            nearest_row = int(np.argmin(distances))
 
-                if nearest_index is None:
-                    continue
+            # Keep a singleton only if it has enough evidence and is clearly isolated.
+            if support >= min_support and distances[nearest_row] >= min_isolation:
+                isolated.add(row)
+                continue
 
-                # Keep a singleton only if it has enough evidence and is clearly isolated.
-                if support >= min_support and nearest_distance >= min_isolation:
-                    continue
+            clusters[nearest_row].extend(clusters[row])
+            in_use[row] = False
+            rows.remove(row)
 
-                clusters[nearest_index].extend(cluster)
-                del clusters[cluster_index]
+            centroids[nearest_row] = self._centroid(X, clusters[nearest_row])
+            centroid_norms[nearest_row] = np.linalg.norm(centroids[nearest_row])
 
-                changed = True
-                break
+            isolated.discard(nearest_row)
+            if isolated:
+                moved = self._centroid_distances(centroids, centroid_norms, nearest_row)
+                isolated = {
+                    isolated_row
+                    for isolated_row in isolated
+                    if moved[isolated_row] >= min_isolation
+                }
 
         return [
-            sorted(cluster)
-            for cluster in clusters
+            sorted(clusters[row])
+            for row in rows
         ]
-    
-    def _nearest_cluster(self, X, clusters, cluster_index):
-        source_cluster = clusters[cluster_index]
-        source_centroid = np.mean(X[source_cluster], axis=0)
-
-        best_index = None
-        best_distance = float("inf")
 
-        for other_index, other_cluster in enumerate(clusters):
-            if other_index == cluster_index:
-                continue
-
-            other_centroid = np.mean(X[other_cluster], axis=0)
-            distance = self._cosine_distance(source_centroid, other_centroid)
-
-            if distance < best_distance:
-                best_distance = distance
-                best_index = other_index
-
-        return best_index, best_distance
+    def _centroid_distances(self, centroids, centroid_norms, row):
+        """
+        Cosine distance of every centroid to the centroid in row, 1 where either has no weight.
+        """
+
+        norms = centroid_norms * centroid_norms[row]
+        similarities = np.zeros(len(centroids))
+        np.divide(centroids @ centroids[row], norms, out=similarities, where=norms > 0.0)
+
+        return np.clip(1.0 - np.clip(similarities, -1.0, 1.0), 0.0, 1.0)
+
+    def _row(self, X, index):
+        row = np.zeros(X.shape[1])
+        start, stop = X.indptr[index], X.indptr[index + 1]
+        row[X.indices[start:stop]] = X.data[start:stop]
+        return row
+
+    def _unit_rows(self, X):
+        row_norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1), dtype=float).ravel())
+        scale = np.zeros(len(row_norms))
+        np.divide(1.0, row_norms, out=scale, where=row_norms > 0.0)
+
+        return (sparse.diags(scale) @ X).tocsr()
+
+    def _centroid(self, X, cluster):
+        return np.asarray(X[cluster].mean(axis=0)).ravel()
+
+    def _centroids(self, X, clusters):
+        """
+        Sparse matrix with the mean row of every cluster, built as one averaging product.
+        """
+
+        sizes = np.asarray([len(cluster) for cluster in clusters], dtype=float)
+        averaging = sparse.csr_matrix(
+            (
+                np.repeat(1.0 / sizes, sizes.astype(int)),
+                (np.repeat(np.arange(len(clusters)), sizes.astype(int)), np.concatenate(clusters)),
+            ),
+            shape=(len(clusters), X.shape[0]),
+        )
 
+        return averaging @ X
 
     def _cosine_distance(self, vector_a, vector_b):
         vector_a = np.asarray(vector_a, dtype=float)
@@ -411,7 +671,7 @@ class AgglomerativeDecomposition:
         cosine_similarity = max(-1.0, min(1.0, cosine_similarity))
 
         return float(max(0.0, min(1.0, 1.0 - cosine_similarity)))
-        
+
     def _automatic_infrastructure_threshold(self, cluster_scores):
         # Low average IDF scores indicate functions that are common across many traces, suggesting they are likely infrastructure.
         scores = np.asarray(cluster_scores, dtype=float)
@@ -454,14 +714,20 @@ class AgglomerativeDecomposition:
     def run(
         self,
         project_id: int,
-        X: np.ndarray,
+        X: sparse.csr_matrix,
         all_functions,
         summarizer,
         allow_ai: bool,
-        node_lookup
+        node_lookup,
+        reusable_features=None,
+        clustering_mode: str = "auto",
     ):
         X_weighted, idf_scores = self._frequency_filtering(X)
-        clusters = self._cluster_traces(X_weighted)
+
+        if self._uses_approximate_clustering(X_weighted.shape[0], clustering_mode):
+            clusters = self._cluster_traces_approximate(X_weighted)
+        else:
+            clusters = self._cluster_traces(X_weighted)
 
         cluster_items = []
 
@@ -479,6 +745,14 @@ class AgglomerativeDecomposition:
 
         self.service.init_decomposition_progress(len(clusters), allow_ai)
 
+        operation_edges_by_source = None
+        if allow_ai:
+            operation_edges_by_source = self.service.load_feature_operation_edges(
+                project_id,
+                [item["components"] for item in cluster_items],
+                node_lookup,
+            )
+
         for item in cluster_items:
             avg_score = item["avg_score"]
             components = item["components"]
@@ -504,4 +778,6 @@ class AgglomerativeDecomposition:
                 allow_ai=allow_ai,
                 node_lookup=node_lookup,
                 score=avg_score,
+                operation_edges_by_source=operation_edges_by_source,
+                reusable_features=reusable_features,
             )
@@ -4,8 +4,8 @@ from typing import TYPE_CHECKING
 
 import igraph as ig
 import leidenalg as leidenalg
-import networkx as nx
 import numpy as np
+from scipy import sparse
 
 if TYPE_CHECKING:
     from app.services.func_decomp_service import FunctionalDecompositionService
@@ -15,138 +15,112 @@ class GraphCommunityDecomposition:
     def __init__(self, service: "FunctionalDecompositionService"):
         self.service = service
 
-    def _build_coexecution_graph(self, X: np.ndarray, all_functions, min_weight: float):
-        graph = nx.Graph()
-        graph.add_nodes_from(all_functions)
+    def _build_coexecution_graph(self, X: sparse.csr_matrix, min_weight: float):
+        """
+        Symmetric sparse adjacency between the rows of X, weighted by the Jaccard co-execution of two
+        functions across units and kept where it reaches min_weight.
+        """
 
-        if X.size == 0:
-            return graph
+        function_count = X.shape[0]
 
-        # Build weighted links between functions based on Jaccard co-execution across traces.
-        frequencies = X.sum(axis=1).astype(float)
-        intersections = X @ X.T
+        if function_count == 0 or X.nnz == 0:
+            return sparse.csr_matrix((function_count, function_count), dtype=float)
 
-        num_ops = len(all_functions)
-        for i in range(num_ops):
-            for j in range(i + 1, num_ops):
-                intersection = float(intersections[i, j])
-                if intersection <= 0.0:
-                    continue
+        # Only function pairs that share a unit have a stored intersection.
+        frequencies = np.asarray(X.sum(axis=1), dtype=float).ravel()
+        intersections = sparse.triu(X @ X.T, k=1).tocoo()
 
-                union = float(frequencies[i] + frequencies[j] - intersection)
-                if union <= 0.0:
-                    continue
+        unions = frequencies[intersections.row] + frequencies[intersections.col] - intersections.data
+        weights = np.zeros(len(unions))
+        np.divide(intersections.data, unions, out=weights, where=unions > 0.0)
 
-                weight = intersection / union
-                if weight >= min_weight:
-                    graph.add_edge(all_functions[i], all_functions[j], weight=float(weight))
+        keep = (intersections.data > 0.0) & (unions > 0.0) & (weights >= min_weight)
+        upper = sparse.csr_matrix(
+            (weights[keep], (intersections.row[keep], intersections.col[keep])),
+            shape=(function_count, function_count),
+        )
+
+        return (upper + upper.T).tocsr()
 
-        return graph
+    def _detect_communities(self, adjacency: sparse.csr_matrix, resolution: float):
+        """
+        Community label of every function.
+        """
 
-    def _detect_communities(self, graph: nx.Graph, resolution: float):
-        if graph.number_of_nodes() == 0:
-            return []
+        function_count = adjacency.shape[0]
 
-        if graph.number_of_edges() == 0:
-            return [{node} for node in graph.nodes]
+        if function_count == 0:
+            return np.zeros(0, dtype=np.int64)
 
-        node_list = list(graph.nodes)
-        node_to_idx = {node_id: idx for idx, node_id in enumerate(node_list)}
+        upper = sparse.triu(adjacency, k=1).tocsr()
+        upper.sort_indices()
+        upper = upper.tocoo()
 
-        edges = []
-        weights = []
-        for source, target, data in graph.edges(data=True):
-            edges.append((node_to_idx[source], node_to_idx[target]))
-            weights.append(float(data.get("weight", 1.0)))
+        if upper.nnz == 0:
+            return np.arange(function_count)
 
         # Leiden optimizes modularity-like quality and returns dense functional communities.
-        ig_graph = ig.Graph(n=len(node_list), edges=edges, directed=False)
+        ig_graph = ig.Graph(n=function_count, edges=np.column_stack((upper.row, upper.col)).tolist(), directed=False)
         partition = leidenalg.find_partition(
             ig_graph,
             leidenalg.RBConfigurationVertexPartition,
-            weights=weights,
+            weights=upper.data.tolist(),
             resolution_parameter=float(resolution),
             seed=42,
         )
 
-        communities = []
-        for cluster in partition:
-            communities.append({node_list[idx] for idx in cluster})
+        return np.asarray(partition.membership, dtype=np.int64)
 
-        if not communities:
-            return [{node} for node in graph.nodes]
+    def _community_strengths(self, adjacency: sparse.csr_matrix, labels):
+        """
+        Edge weight from every function into every community, as a sparse function x community matrix,
+        with each function's total edge weight.
+        """
 
-        return communities
+        function_count = adjacency.shape[0]
+        community_count = int(labels.max()) + 1 if len(labels) else 0
 
-    def _compute_association_scores(self, graph: nx.Graph, communities):
-        if not communities:
-            return {}, {}
+        membership = sparse.csr_matrix(
+            (np.ones(function_count), (np.arange(function_count), labels)),
+            shape=(function_count, community_count),
+        )
 
-        node_to_community = {}
-        for cid, community in enumerate(communities):
-            for node in community:
-                node_to_community[node] = cid
+        strengths = (adjacency @ membership).tocsr()
 
-        association_scores = {}
-        for node in graph.nodes:
-            strengths = np.zeros(len(communities), dtype=float)
-            total_strength = 0.0
+        # Summed from the strengths, every neighbour belonging to one community, so a function tied to a
+        # single community gets an association of exactly 1.
+        totals = np.asarray(strengths.sum(axis=1), dtype=float).ravel()
 
-            for neighbor, edge_data in graph[node].items():
-                weight = float(edge_data.get("weight", 0.0))
-                if weight <= 0.0:
-                    continue
-                total_strength += weight
+        return strengths, totals
 
-                neighbor_community = node_to_community.get(neighbor)
-                if neighbor_community is not None:
-                    strengths[neighbor_community] += weight
+    def _compute_association_scores(self, adjacency: sparse.csr_matrix, labels):
+        """
+        Share of every function's edge weight going into each community. Functions without edges belong
+        only to their own community.
+        """
 
-            if total_strength > 0.0:
-                association_scores[node] = {
-                    cid: float(strengths[cid] / total_strength) for cid in range(len(communities))
-                }
-            else:
-                primary_cid = node_to_community.get(node)
-                association_scores[node] = {
-                    cid: (1.0 if cid == primary_cid else 0.0) for cid in range(len(communities))
-                }
-
-        return association_scores, node_to_community
-
-    def _compute_participation_coefficients(self, graph: nx.Graph, communities):
-        if not communities:
-            return {}
-
-        node_to_community = {}
-        for cid, community in enumerate(communities):
-            for node in community:
-                node_to_community[node] = cid
-
-        participation = {}
-        for node in graph.nodes:
-            k_i = 0.0
-            k_is = np.zeros(len(communities), dtype=float)
-
-            for neighbor, edge_data in graph[node].items():
-                weight = float(edge_data.get("weight", 0.0))
-                if weight <= 0.0:
-                    continue
-                k_i += weight
-
-                neighbor_community = node_to_community.get(neighbor)
-                if neighbor_community is not None:
-                    k_is[neighbor_community] += weight
-
-            if k_i <= 0.0:
-                participation[node] = 0.0
-                continue
+        strengths, totals = self._community_strengths(adjacency, labels)
+
+        # Functions without edges have no stored strengths, so only connected rows are divided.
+        association = strengths.copy()
+        association.data /= np.repeat(totals, np.diff(association.indptr))
+
+        isolated = totals <= 0.0
+        isolated_rows = np.flatnonzero(isolated)
+        own_community = sparse.csr_matrix(
+            (np.ones(len(isolated_rows)), (isolated_rows, labels[isolated_rows])),
+            shape=strengths.shape,
+        )
+
+        association = (association + own_community).tocsr()
+        association.sum_duplicates()
 
-            # High participation means a node bridges communities and is likely infrastructure.
-            dispersion = np.sum((k_is / k_i) ** 2)
-            participation[node] = float(1.0 - dispersion)
+        return association
 
-        return participation
+    def _compute_participation_coefficients(self, association: sparse.csr_matrix):
+        # High participation means a node bridges communities and is likely infrastructure.
+        # Functions without edges have an association of 1 with their own community only, so they score 0.
+        return 1.0 - np.asarray(association.multiply(association).sum(axis=1), dtype=float).ravel()
 
     def _otsu_threshold(self, values, bins=32):
         arr = np.asarray(values, dtype=float)
@@ -180,79 +154,78 @@ class GraphCommunityDecomposition:
         self,
         project_id: int,
         traces,
-        X: np.ndarray,
+        X: sparse.csr_matrix,
         all_functions,
         summarizer,
         allow_ai: bool,
         node_lookup,
         overlap_alpha: float,
         leiden_resolution: float,
+        reusable_features=None,
     ):
-        graph = self._build_coexecution_graph(X, all_functions, self.service.MIN_COEXEC_WEIGHT)
+        adjacency = self._build_coexecution_graph(X, self.service.MIN_COEXEC_WEIGHT)
         resolution = leiden_resolution if leiden_resolution is not None else self.service.LEIDEN_RESOLUTION
-        communities = self._detect_communities(graph, resolution)
-        if not communities:
+        labels = self._detect_communities(adjacency, resolution)
+        if not len(labels):
             return
 
-        assoc_scores, node_primary_map = self._compute_association_scores(graph, communities)
-        participation = self._compute_participation_coefficients(graph, communities)
+        community_count = int(labels.max()) + 1
+        association = self._compute_association_scores(adjacency, labels)
+        participation = self._compute_participation_coefficients(association)
 
-        frequency = X.sum(axis=1).astype(float)
+        frequency = np.asarray(X.sum(axis=1), dtype=float).ravel()
         trace_count = max(len(traces), 1)
-        normalized_frequency = {
-            all_functions[idx]: float(frequency[idx] / trace_count) for idx in range(len(all_functions))
-        }
+        normalized_frequency = frequency / trace_count
 
-        specificity = {
-            node: float(max(scores.values()) if scores else 0.0)
-            for node, scores in assoc_scores.items()
-        }
+        specificity = association.max(axis=1).toarray().ravel()
+        primary_communities = np.asarray(association.argmax(axis=1)).ravel()
 
-        infra_scores = []
-        for node in all_functions:
-            freq_score = normalized_frequency.get(node, 0.0)
-            participation_score = participation.get(node, 0.0)
-            specificity_score = specificity.get(node, 0.0)
-
-            # Combined infrastructure score: frequent + cross-cutting + not strongly feature-specific.
-            combined_score = (0.45 * freq_score) + (0.35 * participation_score) + (0.20 * (1.0 - specificity_score))
-            infra_scores.append(combined_score)
+        # Combined infrastructure score: frequent + cross-cutting + not strongly feature-specific.
+        infra_scores = (0.45 * normalized_frequency) + (0.35 * participation) + (0.20 * (1.0 - specificity))
 
         infra_threshold_dynamic = self._otsu_threshold(infra_scores)
-        infrastructure_nodes = {
-            node for node, score in zip(all_functions, infra_scores) if score >= infra_threshold_dynamic
-        }
+        is_infrastructure = infra_scores >= infra_threshold_dynamic
+
+        feature_members = {cid: set() for cid in range(community_count)}
 
-        feature_members = {cid: set() for cid in range(len(communities))}
+        for index in np.flatnonzero(~is_infrastructure):
+            node = all_functions[index]
+            primary_cid = int(primary_communities[index])
+            primary_score = float(specificity[index])
 
-        for node in all_functions:
-            if node in infrastructure_nodes:
+            feature_members[primary_cid].add(node)
+
+            # Optional overlap assignment: keep nodes in multiple communities when affiliation is similar.
+            if primary_score <= 0.0:
                 continue
 
-            scores = assoc_scores.get(node, {})
-            if scores:
-                primary_cid = max(scores, key=scores.get)
-                primary_score = float(scores[primary_cid])
+            if overlap_alpha <= 0.0:
+                # Communities without any affiliation still reach a non-positive ratio.
+                overlapping = range(community_count)
             else:
-                primary_cid = node_primary_map.get(node, 0)
-                primary_score = 1.0
+                start, stop = association.indptr[index], association.indptr[index + 1]
+                ratios = association.data[start:stop] / primary_score
+                overlapping = association.indices[start:stop][ratios >= overlap_alpha]
 
-            feature_members[primary_cid].add(node)
+            for cid in overlapping:
+                if cid != primary_cid:
+                    feature_members[int(cid)].add(node)
 
-            # Optional overlap assignment: keep nodes in multiple communities when affiliation is similar.
-            if primary_score > 0.0:
-                for cid, score in scores.items():
-                    if cid == primary_cid:
-                        continue
-                    ratio = float(score / primary_score)
-                    if ratio >= overlap_alpha:
-                        feature_members[cid].add(node)
+        infrastructure_nodes = {all_functions[index] for index in np.flatnonzero(is_infrastructure)}
 
         feature_count = sum(1 for members in feature_members.values() if members)
         infra_count = 1 if infrastructure_nodes else 0
         total_features = feature_count + infra_count
         self.service.init_decomposition_progress(total_features, allow_ai)
 
+        operation_edges_by_source = None
+        if allow_ai:
+            operation_edges_by_source = self.service.load_feature_operation_edges(
+                project_id,
+                [*feature_members.values(), infrastructure_nodes],
+                node_lookup,
+            )
+
         for cid, members in feature_members.items():
             if not members:
                 continue
@@ -267,6 +240,8 @@ class GraphCommunityDecomposition:
                 summarizer=summarizer,
                 allow_ai=allow_ai,
                 node_lookup=node_lookup,
+                operation_edges_by_source=operation_edges_by_source,
+                reusable_features=reusable_features,
             )
 
         if infrastructure_nodes:
@@ -279,4 +254,6 @@ class GraphCommunityDecomposition:
                 summarizer=summarizer,
                 allow_ai=allow_ai,
                 node_lookup=node_lookup,
+                operation_edges_by_source=operation_edges_by_source,
+                reusable_features=reusable_features,
             )
@@ -0,0 +1,183 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+# Mersenne prime modulus of the universal hash functions (a * unit + b) mod p.
+HASH_PRIME = (1 << 31) - 1
+
+# Permutations hashed at once, bounding the nnz x chunk block of hash values.
+HASH_CHUNK = 16
+
+# Added to min_similarity every time an oversized neighborhood is split again.
+SPLIT_SIMILARITY_STEP = 0.05
+
+# Candidate pairs whose signatures are compared at once.
+PAIR_CHUNK = 65536
+
+
+class MinHashNeighborhoods:
+    """
+    Splits the rows of a function x unit matrix into candidate neighborhoods of functions with similar unit
+    sets. Every function gets a MinHash signature of its units; LSH banding puts functions whose signatures
+    agree on a whole band in one bucket, and pairs sharing a bucket whose estimated Jaccard similarity
+    reaches min_similarity are linked. Neighborhoods are the connected components of those links. A neighborhood
+    larger than max_size is split again with longer bands and a stricter similarity.
+    """
+
+    def __init__(
+            self,
+            permutations=128,
+            rows_per_band=4,
+            min_similarity=0.2,
+            max_size=5000,
+            max_bucket_size=200,
+            seed=42,
+    ):
+        self.permutations = permutations
+        self.rows_per_band = rows_per_band
+        self.min_similarity = min_similarity
+        self.max_size = max_size
+        self.max_bucket_size = max_bucket_size
+        self.seed = seed
+
+    def signatures(self, X: sparse.csr_matrix):
+        """
+        Minimum hash of every row's non-zero columns under each of the permutations. Rows without any
+        non-zero column keep HASH_PRIME everywhere.
+        """
+
+        X = sparse.csr_matrix(X)
+        rng = np.random.default_rng(self.seed)
+        multipliers = rng.integers(1, HASH_PRIME, size=self.permutations, dtype=np.int64)
+        offsets = rng.integers(0, HASH_PRIME, size=self.permutations, dtype=np.int64)
+
+        signatures = np.full((X.shape[0], self.permutations), HASH_PRIME, dtype=np.int64)
+
+        non_empty = np.diff(X.indptr) > 0
+        if not np.any(non_empty):
+            return signatures
+
+        # Empty rows have no entries, so the starts of the non-empty rows delimit their segments.
+        starts = X.indptr[:-1][non_empty]
+        columns = X.indices.astype(np.int64)
+
+        for start in range(0, self.permutations, HASH_CHUNK):
+            chunk = slice(start, min(self.permutations, start + HASH_CHUNK))
+            hashed = (np.outer(columns, multipliers[chunk]) + offsets[chunk]) % HASH_PRIME
+            signatures[non_empty, chunk] = np.minimum.reduceat(hashed, starts, axis=0)
+
+        return signatures
+
+    def neighborhoods(self, X: sparse.csr_matrix):
+        """
+        Row indices of every neighborhood, each sorted, ordered by their first row.
+        """
+
+        signatures = self.signatures(X)
+        neighborhoods = self._split(signatures, np.arange(X.shape[0]), self.rows_per_band, self.min_similarity)
+
+        return sorted(neighborhoods, key=lambda rows: rows[0])
+
+    def _split(self, signatures, rows, rows_per_band, min_similarity):
+        if rows_per_band > self.permutations:
+            return self._chunks(signatures, rows)
+
+        labels = self._link(signatures[rows], rows_per_band, min_similarity)
+
+        neighborhoods = []
+        order = np.argsort(labels, kind="stable")
+        boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+
+        for members in np.split(rows[order], boundaries):
+            members = np.sort(members)
+
+            if len(members) > self.max_size:
+                # Longer bands only keep pairs that agree on more of the signature.
+                neighborhoods.extend(self._split(
+                    signatures,
+                    members,
+                    rows_per_band + 1,
+                    min_similarity + SPLIT_SIMILARITY_STEP,
+                ))
+            else:
+                neighborhoods.append(members)
+
+        return neighborhoods
+
+    def _link(self, signatures, rows_per_band, min_similarity):
+        """
+        Connected component label of every row after linking the similar pairs that share a bucket in
+        any band. Rows with identical signatures are banded once and always share a label.
+        """
+
+        # np.unique orders the distinct signatures lexicographically, so neighbouring indices are
+        # neighbours in signature order.
+        signatures, inverse = np.unique(signatures, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+
+        row_count = len(signatures)
+        pair_codes = []
+
+        for start in range(0, self.permutations - rows_per_band + 1, rows_per_band):
+            _bands, buckets = np.unique(signatures[:, start:start + rows_per_band], axis=0, return_inverse=True)
+            buckets = buckets.ravel()
+            bucket_sizes = np.bincount(buckets)
+
+            # Buckets above max_bucket_size, e.g. of functions in almost every unit, are too large to pair
+            # every two rows; their rows are chained in signature order instead, which still links a
+            # bucket of near-identical signatures into one component.
+            chained = np.flatnonzero(bucket_sizes[buckets] > self.max_bucket_size)
+            if len(chained) > 1:
+                chained = chained[np.argsort(buckets[chained], kind="stable")]
+                same_bucket = buckets[chained[:-1]] == buckets[chained[1:]]
+                pair_codes.append(chained[:-1][same_bucket] * row_count + chained[1:][same_bucket])
+
+            kept = np.flatnonzero((bucket_sizes[buckets] > 1) & (bucket_sizes[buckets] <= self.max_bucket_size))
+            if not len(kept):
+                continue
+
+            ordered = kept[np.argsort(buckets[kept], kind="stable")]
+            ordered_buckets = buckets[ordered]
+
+            # Rows of one bucket are consecutive, so offsets below the bucket size pair every two of them.
+            for offset in range(1, min(self.max_bucket_size, len(ordered))):
+                same_bucket = ordered_buckets[:-offset] == ordered_buckets[offset:]
+                if not np.any(same_bucket):
+                    break
+
+                left = ordered[:-offset][same_bucket]
+                right = ordered[offset:][same_bucket]
+                pair_codes.append(np.minimum(left, right) * row_count + np.maximum(left, right))
+
+        if pair_codes:
+            pair_codes = np.unique(np.concatenate(pair_codes))
+        else:
+            pair_codes = np.zeros(0, dtype=np.int64)
+
+        left = pair_codes // row_count
+        right = pair_codes % row_count
+
+        # Estimated Jaccard similarity is the share of permutations on which the signatures agree.
+        similar = np.zeros(len(pair_codes), dtype=bool)
+        for chunk_start in range(0, len(pair_codes), PAIR_CHUNK):
+            chunk = slice(chunk_start, chunk_start + PAIR_CHUNK)
+            agreement = np.mean(signatures[left[chunk]] == signatures[right[chunk]], axis=1)
+            similar[chunk] = agreement >= min_similarity
+
+        links = sparse.coo_matrix(
+            (np.ones(int(np.count_nonzero(similar))), (left[similar], right[similar])),
+            shape=(row_count, row_count),
+        )
+        _count, labels = connected_components(links, directed=False)
+
+        return labels[inverse]
+
+    def _chunks(self, signatures, rows):
+        # Last resort for a neighborhood no band length splits: consecutive runs in signature order.
+        order = np.lexsort(signatures[rows].T[::-1])
+        ordered = rows[order]
+
+        return [
+            np.sort(ordered[start:start + self.max_size])
+            for start in range(0, len(ordered), self.max_size)
+        ]
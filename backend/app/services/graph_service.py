@@ -8,6 +8,7 @@ from app.repositories.graph_repo import GraphRepository
 from app.repositories.micro_features_repo import MicroFeaturesRepository
 from app.repositories.trace_repo import TraceRepository
 from app.services.rascal_service import RascalService
+from app.services.node_projection import NodeProjection, node_projection_cache
 from app.core.storage_paths import HOST_DATA_PATH, FULL_PROJECT_SNIPPETS_FILENAME
 from app.core.database import SessionLocal
 from app.models.graph import Node, Edge
@@ -57,6 +58,8 @@ class GraphService:
         with SessionLocal() as db:
             repo = GraphRepository(db)
             repo.delete_project(project_id)
+
+        node_projection_cache.invalidate(project_id)
         
         rascal_service = RascalService()
         rascal_service.delete_workspace(project_id)
@@ -64,6 +67,19 @@ class GraphService:
     def get_all_nodes(self, project_id: int) -> List[Node]:
         return self.repo.get_all_nodes(project_id)
     
+    def get_node_projections(self, project_id: int):
+        """
+        Read-only node id -> NodeProjection lookup of a project, cached until its node version changes.
+        """
+
+        version = self.repo.get_node_version(project_id)
+        lookup = node_projection_cache.get(project_id, version)
+        if lookup is None:
+            rows = self.repo.get_node_projection_rows(project_id)
+            lookup = node_projection_cache.put(project_id, version, map(NodeProjection.from_row, rows))
+
+        return lookup
+
     def get_all_edges(self, project_id: int) -> List[Edge]:
         return self.repo.get_all_edges(project_id)
     
@@ -73,8 +89,13 @@ class GraphService:
     def get_edges_between_nodes(self, project_id: int, node_ids: list[str], labels: list[str] | None = None):
         return self.repo.get_edges_between_nodes(project_id, node_ids, labels)
     
+    def get_edge_endpoints_by_labels(self, project_id: int, labels: list[str]):
+        return self.repo.get_edge_endpoints_by_labels(project_id, labels)
+    
     def update_node(self, node: Node):
         self.repo.update_node(node)
+        # A rewritten summary leaves the node version as it was.
+        node_projection_cache.invalidate(node.project_id)
     
     def get_aggregated_edges(self, project_id: int, visible_ids: list[str]):
         return self.repo.get_aggregated_edges(project_id, visible_ids)
@@ -0,0 +1,75 @@
+import os
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import NamedTuple, Optional
+
+# Projects whose node projections stay cached; the least recently used one is dropped first.
+NODE_PROJECTION_CACHE_PROJECTS = max(1, int(os.getenv("NODE_PROJECTION_CACHE_PROJECTS", "4")))
+
+
+class NodeProjection(NamedTuple):
+    """
+    The fields of a node that decomposition and feature prompts read, without the properties and
+    ai_summary JSON of the ORM Node.
+    """
+
+    db_id: int
+    id: str
+    parent_id: Optional[str]
+    ancestors: tuple
+    labels: tuple
+    simple_name: Optional[str]
+    description: Optional[str]
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            db_id=row.db_id,
+            id=row.id,
+            parent_id=row.parent_id,
+            ancestors=tuple(row.ancestors or ()),
+            labels=tuple(row.labels or ()),
+            simple_name=row.simple_name,
+            description=row.description,
+        )
+
+
+class NodeProjectionCache:
+    """
+    Read-only node id -> NodeProjection lookups per project, valid as long as the project's node version
+    is unchanged. Background tasks run on threads of one process, so entries are shared between them.
+    """
+
+    def __init__(self, max_projects: int = NODE_PROJECTION_CACHE_PROJECTS):
+        self.max_projects = max_projects
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, project_id: int, version):
+        with self._lock:
+            entry = self._entries.get(project_id)
+            if entry is None or entry[0] != version:
+                return None
+
+            self._entries.move_to_end(project_id)
+            return entry[1]
+
+    def put(self, project_id: int, version, projections):
+        lookup = MappingProxyType({projection.id: projection for projection in projections})
+
+        with self._lock:
+            self._entries[project_id] = (version, lookup)
+            self._entries.move_to_end(project_id)
+
+            while len(self._entries) > self.max_projects:
+                self._entries.popitem(last=False)
+
+        return lookup
+
+    def invalidate(self, project_id: int):
+        with self._lock:
+            self._entries.pop(project_id, None)
+
+
+node_projection_cache = NodeProjectionCache()
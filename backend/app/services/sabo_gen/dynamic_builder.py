@@ -5,7 +5,7 @@ from app.services.graph_service import GraphService
 from app.services.sabo_gen.signature_utils import normalized_signature_parameters, signatures_match
 
 class DynamicGraphBuilder:
-    def __init__(self, trace_sequence, project_id: int, db: Session):
+    def __init__(self, trace_sequence, project_id: int, db: Session | None = None, static_lookup: dict | None = None):
         self.trace_sequence = trace_sequence
 
         if self.trace_sequence:
@@ -15,8 +15,13 @@ class DynamicGraphBuilder:
         
         self.trace_id = f"Trace_{ts.replace(',', '').replace(' ','_').replace(':','')}"
         
-        graph_service = GraphService(db)
-        self.static_lookup = graph_service.get_operation_map(project_id)
+        # Workers that resolve many traces receive the operation lookup once
+        # instead of querying it again for every trace.
+        if static_lookup is None:
+            graph_service = GraphService(db)
+            static_lookup = graph_service.get_operation_map(project_id)
+
+        self.static_lookup = static_lookup
 
         self.dynamic_graph = {}
         self.resolution_counts = {
@@ -146,26 +151,17 @@ class DynamicGraphBuilder:
         
         return None, "unresolved"
 
-    def build_graph(self):
-        nodes = []
-        edges = []
-
-        # Create Root Trace Node
-        trace_node = {
-            "data": {
-                "id": self.trace_id,
-                "label": [NODE_TRACE],
-                "properties": { "name": "Execution Trace" }
-            }
-        }
-
-        nodes.append(trace_node)
+    def resolve_steps(self):
+        """
+        Resolves the source and target operation of every step. Each thread
+        keeps its own call stack, so interleaved threads do not borrow each
+        other's callers.
+        """
 
-        previous_action_id = None
-        call_stack = {}
+        resolved_steps = []
+        call_stacks = {}
 
         for step in self.trace_sequence:
-            action_id = f"Action_{step['step']}"
             current_depth = step['depth']
             function_name = step['function']
             scope_qualifiers = step.get('scopeQualifiers', [])
@@ -175,10 +171,9 @@ class DynamicGraphBuilder:
 
             # Identify Target (The function currently executing)
             target_static_id, resolution_status = self._resolve_operation_id(function_name, scope_qualifiers, signature_parameters, signature_known)
-            if resolution_status in self.resolution_counts:
-                self.resolution_counts[resolution_status] += 1
 
             # Update the stack
+            call_stack = call_stacks.setdefault(step.get('thread'), {})
             call_stack[current_depth] = target_static_id
 
             # Identify Source
@@ -190,20 +185,67 @@ class DynamicGraphBuilder:
             if type == 'return':
                 source_static_id, target_static_id = target_static_id, source_static_id
 
+            resolved_steps.append({
+                "step": step,
+                "sourceId": source_static_id,
+                "targetId": target_static_id,
+                "operationResolution": resolution_status,
+            })
+
+        return resolved_steps
+
+    def build_graph(self, resolved_steps=None):
+        """
+        Builds the dynamic graph from resolved steps, in the order given.
+        Steps are resolved here unless they were resolved separately, e.g.
+        per thread in worker processes.
+        """
+
+        if resolved_steps is None:
+            resolved_steps = self.resolve_steps()
+
+        nodes = []
+        edges = []
+
+        # Create Root Trace Node
+        trace_node = {
+            "data": {
+                "id": self.trace_id,
+                "label": [NODE_TRACE],
+                "properties": { "name": "Execution Trace" }
+            }
+        }
+
+        nodes.append(trace_node)
+
+        previous_action_id = None
+
+        for resolved in resolved_steps:
+            step = resolved["step"]
+            action_id = f"Action_{step['step']}"
+            source_static_id = resolved["sourceId"]
+            target_static_id = resolved["targetId"]
+            resolution_status = resolved["operationResolution"]
+
+            if resolution_status in self.resolution_counts:
+                self.resolution_counts[resolution_status] += 1
+
             action_node = {
                 "data": {
                     "id": action_id,
                     "labels": [NODE_ACTION],
                     "properties": {
                         "step": step['step'],
-                        "depth": current_depth,
+                        "depth": step['depth'],
+                        "thread": step.get('thread'),
                         "sourceId": source_static_id,
                         "targetId": target_static_id,
                         "timestamp": step['timestamp'],
+                        "epochMicros": step.get('epochMicros'),
                         "type": step['type'],
                         "parameters": step['parameters'],
-                        "signatureParameters": signature_parameters,
-                        "signatureKnown": signature_known,
+                        "signatureParameters": step.get('signatureParameters', []),
+                        "signatureKnown": step.get('signatureKnown', False),
                         "rawFunctionSignature": step.get('rawFunctionSignature'),
                         "simpleName": f"{step['step']}: {step['type']} {step['function']}",
                         "message": step['message'],
@@ -247,7 +289,7 @@ class DynamicGraphBuilder:
 
             previous_action_id = action_id
         
-        print(f"Added {len(self.trace_sequence)} dynamic actions")
+        print(f"Added {len(resolved_steps)} dynamic actions")
 
         self.dynamic_graph = {
             "elements": {
@@ -0,0 +1,85 @@
+import calendar
+import datetime
+import re
+from typing import Optional
+
+_MONTHS = {
+    name: index
+    for index, name in enumerate(
+        ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"],
+        start=1,
+    )
+}
+
+# Trace timestamps look like "Thu, 01 Feb 2024 10:15:30 123456us +0100".
+_SABOVIZ_TIMESTAMP = re.compile(
+    r"^[A-Za-z]{3},\s+(\d{1,2})\s+([A-Za-z]{3})\s+(\d{4})\s+"
+    r"(\d{2}):(\d{2}):(\d{2})\s+(\d{1,6})us\s+([+-])(\d{2})(\d{2})$"
+)
+
+
+def timestamp_to_epoch_us(timestamp) -> Optional[int]:
+    """
+    Converts a trace timestamp to integer microseconds since the epoch.
+    The "<n>us" field of trace timestamps is taken literally as microseconds.
+    """
+
+    if timestamp is None:
+        return None
+
+    if isinstance(timestamp, bool):
+        return None
+
+    if isinstance(timestamp, (int, float)):
+        return _numeric_to_epoch_us(float(timestamp))
+
+    if not isinstance(timestamp, str):
+        return None
+
+    value = timestamp.strip()
+    if not value:
+        return None
+
+    try:
+        return _numeric_to_epoch_us(float(value))
+    except ValueError:
+        pass
+
+    match = _SABOVIZ_TIMESTAMP.match(value)
+    if match:
+        day, month_name, year, hour, minute, second, micros, sign, tz_hours, tz_minutes = match.groups()
+        month = _MONTHS.get(month_name.lower())
+        if month is None:
+            return None
+
+        try:
+            seconds = calendar.timegm((int(year), month, int(day), int(hour), int(minute), int(second), 0, 0, 0))
+        except (ValueError, OverflowError):
+            return None
+
+        offset = int(tz_hours) * 3600 + int(tz_minutes) * 60
+        if sign == "+":
+            seconds -= offset
+        else:
+            seconds += offset
+
+        return seconds * 1_000_000 + int(micros)
+
+    try:
+        parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+
+    delta = parsed - datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    return (delta.days * 86_400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def _numeric_to_epoch_us(value: float) -> int:
+    # Large numeric timestamps are milliseconds, everything else is seconds.
+    if abs(value) > 1_000_000_000_000:
+        return int(round(value * 1000.0))
+
+    return int(round(value * 1_000_000.0))
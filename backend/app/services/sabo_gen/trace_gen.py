@@ -4,6 +4,7 @@ import json
 from typing import List, Optional
 
 from app.services.sabo_gen.signature_utils import extract_scope_qualifiers, extract_signature_parameters, extract_simple_function_name, has_parameter_list
+from app.services.sabo_gen.timestamps import timestamp_to_epoch_us
 
 class TraceEntry:
     def __init__(self, component: str, field2: str, process: str, timestamp: str, function_name: str, fields: str, pid: str, extra: str, direction: str, message: str, raw_line: str, line_number: int):
@@ -26,9 +27,12 @@ class TraceEntry:
     def is_function_exit(self):
         return self.direction == '<'
     
+    def epoch_micros(self) -> Optional[int]:
+        return timestamp_to_epoch_us(self.timestamp)
+
     def microseconds(self):
-        match = re.search(r'(\d+)us', self.timestamp)
-        return int(match.group(1)) if match else 0
+        epoch = self.epoch_micros()
+        return epoch % 1_000_000 if epoch is not None else 0
     
     def get_clean_function_name(self) -> str:
         clean_name = extract_simple_function_name(self.function_name)
@@ -207,26 +211,46 @@ class TraceParser:
 
         return entry
     
+def thread_key(entry: TraceEntry) -> str:
+    return f"{entry.process}:{entry.pid}"
+
+
+def partition_entries(entries: List[TraceEntry]):
+    """
+    Splits the entry stream into one list per (process, pid), keeping the
+    original order inside each partition.
+    """
+
+    partitions = {}
+    for entry in entries:
+        partitions.setdefault(thread_key(entry), []).append(entry)
+
+    return partitions
+
+
 class SequenceBuilder:
     def __init__(self):
         self.sequence = []
-        self.stack = []
+        # Interleaved threads each unwind their own calls.
+        self.stacks = {}
 
     def process_entries(self, entries: List[TraceEntry]):
         for entry in entries:
             func = entry.function_name
+            thread = thread_key(entry)
+            stack = self.stacks.setdefault(thread, [])
 
             event_type = "unknown"
-            depth = len(self.stack)
+            depth = len(stack)
 
             if entry.is_function_entry():
                 event_type = "call"
-                self.stack.append(func)
+                stack.append(func)
             elif entry.is_function_exit():
                 event_type = "return"
-                if self.stack:
-                    self.stack.pop()
-                    depth = len(self.stack)
+                if stack:
+                    stack.pop()
+                    depth = len(stack)
 
             event_obj = {
                 "step": len(self.sequence) + 1,
@@ -238,6 +262,9 @@ class SequenceBuilder:
                 "rawFunctionSignature": getattr(entry, "raw_function_signature", entry.function_name),
                 "parameters": entry.get_display_parameters(),
                 "timestamp": entry.timestamp,
+                "epochMicros": entry.epoch_micros(),
+                "thread": thread,
+                "lineNumber": entry.line_number,
                 "depth": depth,
                 "message": entry.message
             }
@@ -0,0 +1,178 @@
+import json
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from app.services.sabo_gen.config import NODE_ACTION
+from app.services.sabo_gen.timestamps import timestamp_to_epoch_us
+
+# Marks steps whose timestamp could not be parsed.
+MISSING_EPOCH_US = np.iinfo(np.int64).min
+
+
+def steps_path_for(trace_path) -> Path:
+    return Path(trace_path).with_suffix(".steps.jsonl")
+
+
+def index_path_for(trace_path) -> Path:
+    return Path(trace_path).with_suffix(".index.npz")
+
+
+def sidecar_paths_for(trace_path):
+    return [steps_path_for(trace_path), index_path_for(trace_path)]
+
+
+def _is_action_node(node) -> bool:
+    if not isinstance(node, dict):
+        return False
+
+    labels = node.get("data", {}).get("labels", [])
+    return NODE_ACTION in (labels or [])
+
+
+def write_step_index(dynamic_graph: dict, trace_path) -> int:
+    """
+    Writes the action nodes of a dynamic graph as one JSON line per step,
+    next to the trace file, plus a numpy index holding the byte offset,
+    step number and epoch microseconds of every line. Step and time-window
+    queries then only read the byte ranges they return.
+    """
+
+    elements = dynamic_graph.get("elements", {}) if isinstance(dynamic_graph, dict) else {}
+    nodes = elements.get("nodes", []) if isinstance(elements, dict) else []
+
+    steps_path = steps_path_for(trace_path)
+    index_path = index_path_for(trace_path)
+    token = uuid.uuid4().hex
+    steps_tmp = steps_path.with_name(f".{steps_path.name}.{token}.tmp")
+    index_tmp = index_path.with_name(f".{index_path.name}.{token}.tmp")
+
+    offsets = [0]
+    step_numbers = []
+    epoch_us = []
+
+    try:
+        with open(steps_tmp, "wb") as f:
+            for node in nodes:
+                if not _is_action_node(node):
+                    continue
+
+                properties = node.get("data", {}).get("properties", {}) or {}
+                line = json.dumps(node, separators=(",", ":")).encode("utf-8") + b"\n"
+                f.write(line)
+
+                offsets.append(offsets[-1] + len(line))
+                step_numbers.append(int(properties.get("step") or len(step_numbers) + 1))
+
+                epoch = properties.get("epochMicros")
+                if epoch is None:
+                    epoch = timestamp_to_epoch_us(properties.get("timestamp"))
+                epoch_us.append(MISSING_EPOCH_US if epoch is None else int(epoch))
+
+        with open(index_tmp, "wb") as f:
+            np.savez(
+                f,
+                offsets=np.asarray(offsets, dtype=np.int64),
+                steps=np.asarray(step_numbers, dtype=np.int64),
+                epoch_us=np.asarray(epoch_us, dtype=np.int64),
+            )
+
+        os.replace(steps_tmp, steps_path)
+        os.replace(index_tmp, index_path)
+    finally:
+        for tmp_path in (steps_tmp, index_tmp):
+            if tmp_path.exists():
+                os.remove(tmp_path)
+
+    return len(step_numbers)
+
+
+class TraceStepIndex:
+    def __init__(self, trace_path):
+        self.trace_path = Path(trace_path)
+        self.steps_path = steps_path_for(trace_path)
+        self.index_path = index_path_for(trace_path)
+
+        if not self.steps_path.exists() or not self.index_path.exists():
+            self._build_from_trace_file()
+
+        with np.load(self.index_path) as index:
+            self.offsets = index["offsets"]
+            self.steps = index["steps"]
+            self.epoch_us = index["epoch_us"]
+
+    def _build_from_trace_file(self):
+        # Traces ingested before the index existed are indexed on first use.
+        if not self.trace_path.exists():
+            raise FileNotFoundError(f"Trace file missing from disk: {self.trace_path.name}")
+
+        with open(self.trace_path, "r", encoding="utf-8") as f:
+            dynamic_graph = json.load(f)
+
+        write_step_index(dynamic_graph, self.trace_path)
+
+    @property
+    def total_steps(self) -> int:
+        return int(len(self.steps))
+
+    def time_bounds(self):
+        valid = self.epoch_us[self.epoch_us != MISSING_EPOCH_US]
+        if not len(valid):
+            return None, None
+
+        return int(valid.min()), int(valid.max())
+
+    def positions_for_step_range(self, start_step: int, end_step: int | None = None):
+        start = int(np.searchsorted(self.steps, start_step, side="left"))
+        end = self.total_steps if end_step is None else int(np.searchsorted(self.steps, end_step, side="left"))
+        return start, max(start, end)
+
+    def positions_for_time_window(self, start_us: int | None = None, end_us: int | None = None):
+        mask = self.epoch_us != MISSING_EPOCH_US
+        if start_us is not None:
+            mask &= self.epoch_us >= start_us
+        if end_us is not None:
+            mask &= self.epoch_us < end_us
+
+        return np.flatnonzero(mask)
+
+    def read_range(self, start: int, end: int):
+        """
+        Returns the steps stored at positions [start, end) with a single read.
+        """
+
+        start = max(0, int(start))
+        end = min(self.total_steps, int(end))
+        if start >= end:
+            return []
+
+        byte_start = int(self.offsets[start])
+        byte_end = int(self.offsets[end])
+
+        with open(self.steps_path, "rb") as f:
+            f.seek(byte_start)
+            payload = f.read(byte_end - byte_start)
+
+        return [json.loads(line) for line in payload.splitlines() if line]
+
+    def read_positions(self, positions):
+        """
+        Returns the steps at the given ascending positions, reading each
+        contiguous run of positions in one go.
+        """
+
+        positions = np.asarray(positions, dtype=np.int64)
+        if not len(positions):
+            return []
+
+        run_breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+        run_starts = np.concatenate(([0], run_breaks))
+        run_ends = np.concatenate((run_breaks, [len(positions)]))
+
+        steps = []
+        for run_start, run_end in zip(run_starts, run_ends):
+            steps.extend(self.read_range(positions[run_start], positions[run_end - 1] + 1))
+
+        return steps
@@ -5,6 +5,7 @@ from typing import Dict, Any, List, Set, Optional
 
 from app.models.graph import Node, Edge
 from app.services.graph_service import GraphService
+from app.services.node_projection import NodeProjection
 from app.services.llm_summarization.llm_client import LLMClient
 from app.core.storage_paths import HOST_DATA_PATH, FULL_PROJECT_SNIPPETS_FILENAME
 from app.services.llm_summarization.llm_templates import (
@@ -346,7 +347,7 @@ class SummarizationService:
 
         return self.llm.generate_json(prompt, analyze_project_tool)
     
-    def prompt_feature(self, operation_nodes: list[Node], operation_edges: list[Edge], is_infrastructure: bool = False) -> dict:
+    def prompt_feature(self, operation_nodes: list[NodeProjection], operation_edges: list[Edge], is_infrastructure: bool = False) -> dict:
         feature_kind = "Infrastructure Feature" if is_infrastructure else "Business/User-Facing Feature"
 
         prompt_lines = [
@@ -362,12 +363,10 @@ class SummarizationService:
         node_lookup = {}
 
         for node in operation_nodes:
-            name = node.properties.get("simpleName", node.id)
-            node_lookup[node.id] = node
+            name = node.simple_name or node.id
+            node_lookup[node.id] = name
 
-            summary = "No summary available."
-            if node.ai_summary and isinstance(node.ai_summary, dict):
-                summary = node.ai_summary.get("description") or summary
+            summary = node.description or "No summary available."
 
             prompt_lines.append(f"- {name}: {summary}")
 
@@ -426,7 +425,7 @@ class SummarizationService:
 
         return self.llm.generate_json(prompt, analyze_feature_tool)
 
-    def prompt_micro_feature(self, operation_nodes: List[Node], compressed_flow: Optional[List[Dict[str, Any]]] = None, previous_micro_feature: Optional[Dict[str, Any]] = None) -> dict:
+    def prompt_micro_feature(self, operation_nodes: List[NodeProjection], compressed_flow: Optional[List[Dict[str, Any]]] = None, previous_micro_feature: Optional[Dict[str, Any]] = None) -> dict:
         prompt_lines = [
             "Analyze the following trace segment as a MICRO-FEATURE.",
             "A micro-feature is a small local execution slice inside one larger user-facing feature.",
@@ -456,12 +455,10 @@ class SummarizationService:
         node_lookup = {}
 
         for node in operation_nodes:
-            name = node.properties.get("simpleName", node.id)
+            name = node.simple_name or node.id
             node_lookup[str(node.id)] = name
 
-            summary = "No summary available."
-            if node.ai_summary and isinstance(node.ai_summary, dict):
-                summary = node.ai_summary.get("description") or summary
+            summary = node.description or "No summary available."
 
             prompt_lines.append(f"- {name}: {summary}")
 
@@ -1,8 +1,8 @@
+import heapq
 import re
 
 import numpy as np
 
-from statistics import median
 
 class AdjacentClusterer:
 
@@ -26,11 +26,20 @@ class AdjacentClusterer:
                 progress_step(clusters[0].get("name"))
             return clusters
         
-        partitions, merge_distances = self._build_full_adjacent_hierarchy(clusters, progress_step = progress_step)
+        nodes, merge_log, boundary_distances = self._build_full_adjacent_hierarchy(clusters, progress_step = progress_step)
 
-        selected_partition = self._select_best_partition(
-            partitions = partitions,
-            merge_distances = merge_distances,
+        selected_merge_count = self._select_best_partition(
+            nodes = nodes,
+            merge_log = merge_log,
+            boundary_distances = boundary_distances,
+            initial_cluster_count = len(clusters),
+        )
+
+        selected_partition = self._materialize_partition(
+            clusters = clusters,
+            nodes = nodes,
+            merge_log = merge_log,
+            merge_count = selected_merge_count,
         )
 
         selected_partition = self._merge_weak_top_level_clusters(selected_partition)
@@ -44,79 +53,158 @@ class AdjacentClusterer:
         return selected_partition
     
     def _build_full_adjacent_hierarchy(self, initial_clusters, progress_step=None):
-        clusters = list(initial_clusters)
+        """
+        Repeatedly merges the closest pair of adjacent clusters until one cluster is left.
+        Candidate pairs sit in a heap ordered by distance, then by trace position, so ties still go to the leftmost pair.
+        A merge only adds the two pairs formed with its new neighbours; pairs with a merged cluster are skipped when popped.
+
+        Returns the hierarchy nodes, with only the statistics the distances and partition scores need,
+        the merge log, one (left node, right node, distance) entry per merge, where merge k creates node
+        len(initial_clusters) + k, and the distance of every pair of nodes that were ever adjacent.
+        """
+
+        nodes = [
+            self._leaf_statistics(cluster, index)
+            for index, cluster in enumerate(initial_clusters)
+        ]
 
-        partitions = [list(clusters)]
-        merge_distances = []
+        left_neighbor = [index - 1 for index in range(len(nodes))]
+        right_neighbor = [index + 1 if index + 1 < len(nodes) else -1 for index in range(len(nodes))]
+        merged = [False] * len(nodes)
 
-        total_merges = max(0, len(clusters) - 1)
-        completed_merges = 0
+        boundary_distances = {
+            (index, index + 1): self._mixed_cluster_distance(nodes[index], nodes[index + 1])
+            for index in range(len(nodes) - 1)
+        }
 
-        while len(clusters) > 1:
-            best_index = -1
-            best_distance = float("inf")
+        candidates = [
+            (distance, left_id, left_id, right_id)
+            for (left_id, right_id), distance in boundary_distances.items()
+        ]
+        heapq.heapify(candidates)
 
-            for index in range(len(clusters) - 1):
-                left_cluster = clusters[index]
-                right_cluster = clusters[index + 1]
+        merge_log = []
+        total_merges = max(0, len(nodes) - 1)
 
-                distance = self._mixed_cluster_distance(left_cluster, right_cluster)
+        while candidates:
+            distance, _start, left_id, right_id = heapq.heappop(candidates)
 
-                if distance < best_distance:
-                    best_distance = distance
-                    best_index = index
+            if merged[left_id] or right_neighbor[left_id] != right_id:
+                continue
 
-            if best_index < 0:
-                break
+            node_id = len(nodes)
+            nodes.append(self._merge_cluster_statistics(nodes[left_id], nodes[right_id]))
+            merged[left_id] = merged[right_id] = True
+            merged.append(False)
 
-            left_cluster = clusters[best_index]
-            right_cluster = clusters[best_index + 1]
+            previous_id = left_neighbor[left_id]
+            next_id = right_neighbor[right_id]
 
-            merged_cluster = self._merge_clusters(left_cluster, right_cluster, merge_distance = best_distance)
+            left_neighbor.append(previous_id)
+            right_neighbor.append(next_id)
 
-            clusters = (
-                clusters[:best_index]
-                + [merged_cluster]
-                + clusters[best_index + 2 :]
-            )
+            if previous_id >= 0:
+                right_neighbor[previous_id] = node_id
+                pair_distance = self._mixed_cluster_distance(nodes[previous_id], nodes[node_id])
+                boundary_distances[(previous_id, node_id)] = pair_distance
+                heapq.heappush(candidates, (pair_distance, nodes[previous_id]["start"], previous_id, node_id))
 
-            completed_merges += 1
+            if next_id >= 0:
+                left_neighbor[next_id] = node_id
+                pair_distance = self._mixed_cluster_distance(nodes[node_id], nodes[next_id])
+                boundary_distances[(node_id, next_id)] = pair_distance
+                heapq.heappush(candidates, (pair_distance, nodes[node_id]["start"], node_id, next_id))
 
-            merge_distances.append(best_distance)
-            partitions.append(list(clusters))
+            merge_log.append((left_id, right_id, distance))
 
             if progress_step is not None:
                 progress_step(
-                f"Building hierarchy {completed_merges}/{total_merges}"
+                f"Building hierarchy {len(merge_log)}/{total_merges}"
             )
 
-        return partitions, merge_distances
+        return nodes, merge_log, boundary_distances
     
-    def _select_best_partition(self, partitions, merge_distances):
-        if not partitions:
-            return []
-        
-        if len(partitions) == 1:
-            return partitions[0]
-        
-        initial_cluster_count = len(partitions[0])
-
-        root_partition = partitions[-1]
-        root_dispersion = self._partition_internal_dispersion(root_partition)
-
-        best_partition = partitions[-1]
+    def _select_best_partition(self, nodes, merge_log, boundary_distances, initial_cluster_count):
+        """
+        Returns the number of merges after which the partition scores best.
+        The partitions are visited by replaying the merge log. Every score term is kept as a running total over the
+        current clusters or boundaries, and a merge only swaps the terms of the clusters and boundaries it replaces.
+        """
+
+        if not merge_log:
+            return 0
+
+        merge_distances = [distance for _left_id, _right_id, distance in merge_log]
+        distance_range = max(merge_distances) - min(merge_distances)
+
+        leaf_vectors = [node["vector"] for node in nodes[:initial_cluster_count]]
+        dispersions = [self._node_dispersion(node, leaf_vectors) for node in nodes]
+        strengths = [self._execution_unit_strength(node) for node in nodes]
+        weaknesses = [1.0 - strength for strength in strengths]
+
+        def functional_distance(left_id, right_id):
+            similarity = self._jaccard_similarity(nodes[left_id]["components"], nodes[right_id]["components"])
+            evidence_strength = min(strengths[left_id], strengths[right_id])
+            return (1.0 - similarity) * evidence_strength
+
+        root_dispersion = dispersions[-1]
+
+        left_neighbor = [index - 1 for index in range(len(nodes))]
+        right_neighbor = [index + 1 if index + 1 < initial_cluster_count else -1 for index in range(len(nodes))]
+        alive = [index < initial_cluster_count for index in range(len(nodes))]
+
+        # Running totals over the clusters of the current partition
+        dispersion_total = sum(nodes[index]["segmentCount"] * dispersions[index] for index in range(initial_cluster_count))
+        weakness_total = sum(weaknesses[:initial_cluster_count])
+        weakest = [(-weaknesses[index], index) for index in range(initial_cluster_count)]
+        heapq.heapify(weakest)
+
+        # Running totals over the boundaries between its adjacent clusters
+        separation_total = sum(boundary_distances[(index, index + 1)] for index in range(initial_cluster_count - 1))
+        functional_total = sum(functional_distance(index, index + 1) for index in range(initial_cluster_count - 1))
+
+        # Two heaps holding the merge distances seen so far, for their running median
+        lower_distances = []
+        upper_distances = []
+
+        best_merge_count = len(merge_log)
         best_score = float("-inf")
 
-        for partition_index, partition in enumerate(partitions):
-            cluster_count = len(partition)
-
-            partition_dispersion = self._partition_internal_dispersion(partition)
-            separation = self._partition_boundary_separation(partition)
-            functional_separation = self._partition_functional_separation(partition)
-            merge_jump = self._merge_jump_score(
-                partition_index = partition_index,
-                merge_distances = merge_distances,
-            )
+        for partition_index in range(len(merge_log) + 1):
+            cluster_count = initial_cluster_count - partition_index
+
+            partition_dispersion = dispersion_total / float(initial_cluster_count)
+
+            if cluster_count > 1:
+                boundary_count = float(cluster_count - 1)
+                separation = separation_total / boundary_count
+                functional_separation = functional_total / boundary_count
+
+                while not alive[weakest[0][1]]:
+                    heapq.heappop(weakest)
+
+                weak_execution_unit_penalty = (
+                    0.50 * (weakness_total / float(cluster_count))
+                    + 0.50 * -weakest[0][0]
+                )
+            else:
+                separation = 0.0
+                functional_separation = 0.0
+                weak_execution_unit_penalty = 0.0
+
+            if 0 < partition_index < len(merge_distances):
+                if len(lower_distances) > len(upper_distances):
+                    previous_reference = -lower_distances[0]
+                else:
+                    previous_reference = (-lower_distances[0] + upper_distances[0]) / 2
+
+                merge_jump = self._merge_jump_score(
+                    next_distance = merge_distances[partition_index],
+                    previous_reference = previous_reference,
+                    distance_range = distance_range,
+                )
+            else:
+                merge_jump = 0.0
 
             dispersion_gain = max(0.0, root_dispersion - partition_dispersion)
 
@@ -125,8 +213,6 @@ class AdjacentClusterer:
                 initial_cluster_count = initial_cluster_count,
             )
 
-            weak_execution_unit_penalty = self._weak_execution_unit_penalty(partition)
-
             score = (
                 0.25 * dispersion_gain
                 + 0.20 * separation
@@ -141,9 +227,97 @@ class AdjacentClusterer:
 
             if score > best_score:
                 best_score = score
-                best_partition = partition
+                best_merge_count = partition_index
+
+            if partition_index == len(merge_log):
+                break
+
+            # Apply the next merge to the running totals
+            left_id, right_id, distance = merge_log[partition_index]
+            node_id = initial_cluster_count + partition_index
+            previous_id = left_neighbor[left_id]
+            next_id = right_neighbor[right_id]
+
+            alive[left_id] = alive[right_id] = False
+            alive[node_id] = True
+            left_neighbor[node_id] = previous_id
+            right_neighbor[node_id] = next_id
+
+            dispersion_total += (
+                nodes[node_id]["segmentCount"] * dispersions[node_id]
+                - nodes[left_id]["segmentCount"] * dispersions[left_id]
+                - nodes[right_id]["segmentCount"] * dispersions[right_id]
+            )
+            weakness_total += weaknesses[node_id] - weaknesses[left_id] - weaknesses[right_id]
+            heapq.heappush(weakest, (-weaknesses[node_id], node_id))
+
+            separation_total -= boundary_distances[(left_id, right_id)]
+            functional_total -= functional_distance(left_id, right_id)
+
+            if previous_id >= 0:
+                right_neighbor[previous_id] = node_id
+                separation_total += boundary_distances[(previous_id, node_id)] - boundary_distances[(previous_id, left_id)]
+                functional_total += functional_distance(previous_id, node_id) - functional_distance(previous_id, left_id)
+
+            if next_id >= 0:
+                left_neighbor[next_id] = node_id
+                separation_total += boundary_distances[(node_id, next_id)] - boundary_distances[(right_id, next_id)]
+                functional_total += functional_distance(node_id, next_id) - functional_distance(right_id, next_id)
+
+            if len(lower_distances) > len(upper_distances):
+                heapq.heappush(upper_distances, -heapq.heappushpop(lower_distances, -distance))
+            else:
+                heapq.heappush(lower_distances, -heapq.heappushpop(upper_distances, distance))
+
+        return best_merge_count
+    
+    def _materialize_partition(self, clusters, nodes, merge_log, merge_count):
+        """
+        Builds the full cluster trees, with merged names and descriptions, for the partition left after merge_count merges.
+        Hierarchy nodes outside that partition's trees are never materialized.
+        """
+
+        initial_cluster_count = len(clusters)
+        children = {
+            initial_cluster_count + merge_index: (left_id, right_id, distance)
+            for merge_index, (left_id, right_id, distance) in enumerate(merge_log[:merge_count])
+        }
 
-        return best_partition
+        merged_ids = {node_id for left_id, right_id, _distance in children.values() for node_id in (left_id, right_id)}
+        partition_ids = sorted(
+            (node_id for node_id in range(initial_cluster_count + merge_count) if node_id not in merged_ids),
+            key = lambda node_id: nodes[node_id]["start"],
+        )
+
+        materialized = {}
+
+        for root_id in partition_ids:
+            # Children always have lower ids than their parent, so an explicit stack builds each tree bottom-up.
+            stack = [root_id]
+
+            while stack:
+                node_id = stack[-1]
+
+                if node_id < initial_cluster_count:
+                    materialized[node_id] = clusters[node_id]
+                    stack.pop()
+                    continue
+
+                left_id, right_id, distance = children[node_id]
+                pending = [child_id for child_id in (left_id, right_id) if child_id not in materialized]
+
+                if pending:
+                    stack.extend(pending)
+                    continue
+
+                materialized[node_id] = self._merge_clusters(
+                    materialized.pop(left_id),
+                    materialized.pop(right_id),
+                    merge_distance = distance,
+                )
+                stack.pop()
+
+        return [materialized[node_id] for node_id in partition_ids]
     
     def _make_initial_cluster(self, segment):
         components = set(segment.get("components", []) or [])
@@ -160,6 +334,92 @@ class AdjacentClusterer:
             "mergeDistance": 0.0,
         }
     
+    def _leaf_statistics(self, cluster, index):
+        vector = cluster.get("vector")
+
+        step_count = 0
+        for segment in cluster.get("segments", []) or []:
+            step_count += self._segment_step_count(segment)
+
+        if vector is None:
+            vector_sum = None
+            unit_sum = None
+        else:
+            norm = np.linalg.norm(vector)
+            vector_sum = vector
+            unit_sum = vector / norm if norm > 0.0 else np.zeros_like(vector)
+
+        return {
+            "start": index,
+            "end": index + 1,
+            "segmentCount": 1,
+            "stepCount": step_count,
+            "components": set(cluster.get("components", []) or []),
+            "contextTokens": set(cluster.get("contextTokens", []) or []),
+            "vector": vector,
+            # Running sums of the segment vectors and their unit vectors, used for the internal dispersion.
+            "vectorCount": 0 if vector is None else 1,
+            "vectorSum": vector_sum,
+            "unitSum": unit_sum,
+        }
+
+    def _merge_cluster_statistics(self, cluster_a, cluster_b):
+        vector_sum_a = cluster_a["vectorSum"]
+        vector_sum_b = cluster_b["vectorSum"]
+
+        if vector_sum_a is None:
+            vector_sum, unit_sum = vector_sum_b, cluster_b["unitSum"]
+        elif vector_sum_b is None:
+            vector_sum, unit_sum = vector_sum_a, cluster_a["unitSum"]
+        elif vector_sum_a.shape == vector_sum_b.shape:
+            vector_sum = vector_sum_a + vector_sum_b
+            unit_sum = cluster_a["unitSum"] + cluster_b["unitSum"]
+        else:
+            vector_sum, unit_sum = None, None
+
+        return {
+            "start": cluster_a["start"],
+            "end": cluster_b["end"],
+            "segmentCount": cluster_a["segmentCount"] + cluster_b["segmentCount"],
+            "stepCount": cluster_a["stepCount"] + cluster_b["stepCount"],
+            "components": cluster_a["components"] | cluster_b["components"],
+            "contextTokens": cluster_a["contextTokens"] | cluster_b["contextTokens"],
+            "vector": self._weighted_average_vectors(
+                cluster_a["vector"],
+                cluster_a["segmentCount"],
+                cluster_b["vector"],
+                cluster_b["segmentCount"],
+            ),
+            "vectorCount": cluster_a["vectorCount"] + cluster_b["vectorCount"],
+            "vectorSum": vector_sum,
+            "unitSum": unit_sum,
+        }
+
+    def _node_dispersion(self, node, leaf_vectors):
+        """
+        Mean cosine distance between the segment vectors of a hierarchy node and their centroid, from the
+        running sums alone: 1 - (sum of unit vectors . centroid) / (count * |centroid|), clamped to [0, 1].
+        Unlike _cluster_internal_dispersion, a vector pointing away from the centroid adds more than 1 to
+        the mean instead of being capped; only the mean is clamped.
+        """
+
+        if node["vectorCount"] <= 1:
+            return 0.0
+
+        # Segment vectors of different sizes have no common sum.
+        if node["vectorSum"] is None:
+            segment_vectors = [vector for vector in leaf_vectors[node["start"]:node["end"]] if vector is not None]
+            return self._cluster_internal_dispersion(segment_vectors)
+
+        centroid = node["vectorSum"] / node["vectorCount"]
+        centroid_norm = np.linalg.norm(centroid)
+
+        if centroid_norm == 0.0:
+            return 1.0
+
+        similarity_total = float(np.dot(node["unitSum"], centroid) / centroid_norm)
+        return max(0.0, min(1.0, 1.0 - similarity_total / node["vectorCount"]))
+
     def _merge_clusters(self, cluster_a, cluster_b, merge_distance):
         merged_segments = (
             cluster_a.get("segments", [])
@@ -247,60 +507,17 @@ class AdjacentClusterer:
             + 0.25 * context_distance
         )
     
-    def _partition_functional_separation(self, partition):
-        if len(partition) <= 1:
-            return 0.0
-
-        distances = []
-
-        for index in range(len(partition) - 1):
-            left_cluster = partition[index]
-            right_cluster = partition[index + 1]
-
-            left_components = set(left_cluster.get("components", []) or [])
-            right_components = set(right_cluster.get("components", []) or [])
-
-            similarity = self._jaccard_similarity(left_components, right_components)
-            distance = 1.0 - similarity
-
-            left_strength = self._execution_unit_strength(left_cluster)
-            right_strength = self._execution_unit_strength(right_cluster)
-
-            evidence_strength = min(left_strength, right_strength)
-
-            distances.append(distance * evidence_strength)
-
-        if not distances:
-            return 0.0
-
-        return float(sum(distances) / len(distances))
-    def _weak_execution_unit_penalty(self, partition):
-        if len(partition) <= 1:
-            return 0.0
-        
-        penalties = []
-
-        for cluster in partition:
-            strength = self._execution_unit_strength(cluster)
-            weakness = 1.0 - strength
-            penalties.append(weakness)
-
-        if not penalties:
-            return 0.0
-
-        mean_penalty = sum(penalties) / float(len(penalties))
-        max_penalty = max(penalties)
-
-        return 0.50 * mean_penalty + 0.50 * max_penalty
-
     def _execution_unit_strength(self, cluster):
-        segments = cluster.get("segments", []) or []
+        if "segmentCount" in cluster:
+            segment_count = cluster["segmentCount"]
+            step_count = cluster["stepCount"]
+        else:
+            segments = cluster.get("segments", []) or []
+            segment_count = len(segments)
 
-        segment_count = len(segments)
-
-        step_count = 0
-        for segment in segments:
-            step_count += len(segment.get("steps", []) or [])
+            step_count = 0
+            for segment in segments:
+                step_count += self._segment_step_count(segment)
 
         component_count = len(cluster.get("components", []) or [])
 
@@ -310,28 +527,14 @@ class AdjacentClusterer:
 
         return max(segment_strength, 0.60 * step_strength + 0.40 * component_strength)
     
-    def _partition_internal_dispersion(self, partition):
-        if not partition:
-            return 0.0
-        
-        total_weight = 0.0
-        weighted_dispersion = 0.0
+    def _segment_step_count(self, segment):
+        # Streamed segments no longer hold their steps, only how many there were.
+        if "stepCount" in segment:
+            return int(segment["stepCount"])
 
-        for cluster in partition:
-            weight = max(1, len(cluster.get("segments", []) or []))
-            dispersion = self._cluster_internal_dispersion(cluster)
-
-            weighted_dispersion += dispersion * weight
-            total_weight += weight
-
-        if total_weight == 0.0:
-            return 0.0
-        
-        return weighted_dispersion / total_weight
-    
-    def _cluster_internal_dispersion(self, cluster):
-        segment_vectors = self._cluster_segment_vectors(cluster)
+        return len(segment.get("steps", []) or [])
 
+    def _cluster_internal_dispersion(self, segment_vectors):
         if len(segment_vectors) <= 1:
             return 0.0
         
@@ -350,46 +553,7 @@ class AdjacentClusterer:
         
         return float(sum(distances) / len(distances))
     
-    def _partition_boundary_separation(self, partition):
-        if len(partition) <= 1:
-            return 0.0
-        
-        distances = []
-
-        for index in range(len(partition) - 1):
-            distance = self._mixed_cluster_distance(
-                partition[index],
-                partition[index + 1],
-            )
-            distances.append(distance)
-
-        if not distances:
-            return 0.0
-        
-        return float(sum(distances) / len(distances))
-    
-    def _merge_jump_score(self, partition_index, merge_distances):
-        if not merge_distances:
-            return 0.0
-        
-        if partition_index <= 0:
-            return 0.0
-        
-        if partition_index >= len(merge_distances):
-            return 0.0
-        
-        next_distance = merge_distances[partition_index]
-        previous_distance = merge_distances[:partition_index]
-
-        if not previous_distance:
-            return 0.0
-        
-        previous_reference = float(median(previous_distance))
-
-        min_distance = min(merge_distances)
-        max_distance = max(merge_distances)
-        distance_range = max_distance - min_distance
-
+    def _merge_jump_score(self, next_distance, previous_reference, distance_range):
         if distance_range <= 0.0:
             return 0.0
         
@@ -488,18 +652,12 @@ class AdjacentClusterer:
 
         return weak_index + 1
     
-    def _cluster_segment_vectors(self, cluster):
-        vectors = []
-
-        for segment in cluster.get("segments", []) or []:
-            vector = self._segment_vector(segment)
-
-            if vector is not None:
-                vectors.append(vector)
-
-        return vectors
-    
     def _segment_vector(self, segment):
+        # PELT already stores the mean embedding of each micro segment.
+        segment_embedding = self._to_numpy_vector(segment.get("embedding"))
+        if segment_embedding is not None:
+            return segment_embedding
+
         step_vectors = []
 
         for step in segment.get("steps", []) or []:
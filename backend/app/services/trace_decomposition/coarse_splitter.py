@@ -1,26 +1,25 @@
-import datetime
 import math
 import re
 
 import numpy as np
 
-from app.services.trace_decomposition.utils import TraceDecompositionUtils
+from app.services.sabo_gen.trace_index import MISSING_EPOCH_US
+from app.services.trace_decomposition.step_table import STEP_KIND_CALL, STEP_KIND_RETURN
 
 class CoarseTraceSplitter:
     def __init__(self, pelt_min_size=3):
-        self.utils = TraceDecompositionUtils()
         self.pelt_min_size = pelt_min_size
 
-    def split(self, steps):
+    def split(self, steps, trace_length=None):
         """
-        Splits a trace into coarse segments based on heuristics that identify likely boundaries between different runtime episodes.
+        Splits a step table into coarse segments based on heuristics that identify likely boundaries between different runtime episodes.
+        When steps is only a window of a longer trace, trace_length keeps the minimum segment size relative to the whole trace.
         """
     
-        steps = list(steps or [])
-        if not steps:
+        if steps is None or not len(steps):
             return []
         
-        min_segment_size = self._coarse_min_segment_size(len(steps))
+        min_segment_size = self._coarse_min_segment_size(trace_length or len(steps))
         if len(steps) < 2 * min_segment_size:
             return [steps]
         
@@ -48,7 +47,7 @@ class CoarseTraceSplitter:
         if start < len(steps):
             coarse_segments.append(steps[start:])
 
-        return [segment for segment in coarse_segments if segment]
+        return [segment for segment in coarse_segments if len(segment)]
     
     def _coarse_min_segment_size(self, total_steps):
         """
@@ -78,52 +77,53 @@ class CoarseTraceSplitter:
         Assign a score to each potential boundary between steps based on heuristics that may indicate a transition between different runtime episodes.
         """
 
-        steps = list(steps or [])
         if len(steps) < 2:
             return {}
         
-        timestamp_gaps = self._timestamp_gaps(steps)
+        timestamp_gaps = self._timestamp_gaps(steps.epoch_us)
         timestamp_gap_threshold = self._robust_gap_threshold(timestamp_gaps)
 
-        boundary_scores = {}
+        component_drifts = np.asarray(self._component_drifts(steps), dtype=float)
 
-        for index in range(1, len(steps)):
-            previous_properties = self.utils.get_step_properties(steps[index - 1])
-            current_properties = self.utils.get_step_properties(steps[index])
+        # Every column below describes the boundary between step index - 1 and step index, for index >= 1
+        previous_is_return = steps.kinds[:-1] == STEP_KIND_RETURN
+        current_is_call = steps.kinds[1:] == STEP_KIND_CALL
+        depths = np.nan_to_num(steps.depths, nan=0.0)
+        previous_depth = depths[:-1]
+        current_depth = depths[1:]
 
-            score = 0.0
+        return_to_call = previous_is_return & current_is_call
 
-            # Strong signal:
-            # The previous runtime episode returned to depth 0, and a new root-level call starts
-            if self._is_root_episode_boundary(previous_properties, current_properties):
-                score += 4.0
+        # Strong signal:
+        # The previous runtime episode returned to depth 0, and a new root-level call starts
+        root_episode = return_to_call & (previous_depth <= 0.0) & (current_depth <= 0.0)
 
-            # Weaker version of the same idea:
-            # The trace transitions from a return to a call near the top of the call stack
-            elif self._is_low_depth_transition(previous_properties, current_properties):
-                score += 1.5
+        # Weaker version of the same idea:
+        # The trace transitions from a return to a call near the top of the call stack
+        low_depth = return_to_call & (previous_depth <= 1.0) & (current_depth <= 1.0) & ~root_episode
 
-            # Temporal signal:
-            # A large time gap can mean that the program was idle, waiting for input, or starting a new runtime activity
-            timestamp_gap = timestamp_gaps[index]
-            if timestamp_gap_threshold > 0 and timestamp_gap > timestamp_gap_threshold:
-                gap_ratio = min(timestamp_gap / timestamp_gap_threshold, 2.0)
-                score += 2.5 * gap_ratio
+        scores = np.zeros(len(steps) - 1, dtype=float)
+        scores[root_episode] += 4.0
+        scores[low_depth] += 1.5
 
-            # Static/dynamic component drift
-            # Compare the source/target context before and after the boundary.
-            # If the components around the boundary change strongly, this may be a transition between different runtime episodes.
-            component_drift = self._component_drift_at_boundary(steps, index)
+        # Temporal signal:
+        # A large time gap can mean that the program was idle, waiting for input, or starting a new runtime activity
+        if timestamp_gap_threshold > 0:
+            gaps = timestamp_gaps[1:]
+            large_gap = gaps > timestamp_gap_threshold
+            gap_ratio = np.minimum(gaps[large_gap] / timestamp_gap_threshold, 2.0)
+            scores[large_gap] += 2.5 * gap_ratio
 
-            if component_drift >= 0.75:
-                score += 2.0
-            elif component_drift >= 0.5:
-                score += 1.0
+        # Static/dynamic component drift
+        # Compare the source/target context before and after the boundary.
+        # If the components around the boundary change strongly, this may be a transition between different runtime episodes.
+        drifts = component_drifts[1:]
+        scores[drifts >= 0.75] += 2.0
+        scores[(drifts >= 0.5) & (drifts < 0.75)] += 1.0
 
-            if score > 0.0:
-                boundary_scores[index] = score
+        boundary_indexes = np.flatnonzero(scores > 0.0)
 
-        return boundary_scores
+        return dict(zip((boundary_indexes + 1).tolist(), scores[boundary_indexes].tolist()))
     
     def _select_coarse_boundaries(self, steps, boundary_scores, min_segment_size):
         """
@@ -136,7 +136,6 @@ class CoarseTraceSplitter:
         - Return boundaries in trace order
         """
 
-        steps = list(steps or [])
         total_steps = len(steps)
 
         if total_steps < 2:
@@ -241,65 +240,87 @@ class CoarseTraceSplitter:
         
         return True
     
-    def _is_root_episode_boundary(self, previous_properties, current_properties) -> bool:
-        previous_type = previous_properties.get("type")
-        current_type = current_properties.get("type")
-
-        previous_depth = self.utils.safe_float(previous_properties.get("depth"))
-        current_depth = self.utils.safe_float(current_properties.get("depth"))
-
-        return (
-            previous_type == "return"
-            and current_type == "call"
-            and previous_depth <= 0.0
-            and current_depth <= 0.0
-        )
-    
-    def _is_low_depth_transition(self, previous_properties, current_properties) -> bool:
-        previous_type = previous_properties.get("type")
-        current_type = current_properties.get("type")
-
-        previous_depth = self.utils.safe_float(previous_properties.get("depth"))
-        current_depth = self.utils.safe_float(current_properties.get("depth"))
-
-        return (
-            previous_type == "return"
-            and current_type == "call"
-            and previous_depth <= 1.0
-            and current_depth <= 1.0
-        )
-    
-    def _component_drift_at_boundary(self, steps, boundary_index: int) -> float:
-        window_size = min(25, max(5, int(math.sqrt(len(steps)))))
-
-        left_start = max(0, boundary_index - window_size)
-        right_end = min(len(steps), boundary_index + window_size)
-
-        left_tokens = self._component_context_tokens_for_steps(steps[left_start:boundary_index])
-        right_tokens = self._component_context_tokens_for_steps(steps[boundary_index:right_end])
+    def _component_drifts(self, steps):
+        """
+        Computes the component drift at every boundary index: one minus the Jaccard similarity between the
+        source/target context tokens of the window before and after the boundary.
+        Both windows slide forward one step at a time, so token counts are updated instead of rebuilt.
+        """
 
-        if not left_tokens or not right_tokens:
-            return 0.0
-        
-        union = left_tokens | right_tokens
+        total_steps = len(steps)
+        window_size = min(25, max(5, int(math.sqrt(total_steps))))
+        drifts = [0.0] * total_steps
 
-        if not union:
-            return 0.0
-        
-        similarity = len(left_tokens & right_tokens) / float(len(union))
+        if total_steps < 2:
+            return drifts
+
+        uris = steps.vocabulary.uris
+        uri_tokens = {}
+        pair_tokens = {}
+        step_tokens = []
+
+        # Steps repeat a small set of source/target pairs, so each pair's token set is built once and shared.
+        for source_id, target_id in zip(steps.source_ids.tolist(), steps.target_ids.tolist()):
+            tokens = pair_tokens.get((source_id, target_id))
+            if tokens is None:
+                tokens = pair_tokens[(source_id, target_id)] = (
+                    self._cached_uri_tokens(uris[source_id], uri_tokens)
+                    | self._cached_uri_tokens(uris[target_id], uri_tokens)
+                )
+            step_tokens.append(tokens)
+
+        left_counts = {}
+        right_counts = {}
+        shared = 0
+
+        def add(counts, other_counts, tokens):
+            nonlocal shared
+            for token in tokens:
+                count = counts.get(token, 0)
+                if count == 0 and token in other_counts:
+                    shared += 1
+                counts[token] = count + 1
+
+        def remove(counts, other_counts, tokens):
+            nonlocal shared
+            for token in tokens:
+                count = counts[token] - 1
+                if count:
+                    counts[token] = count
+                else:
+                    del counts[token]
+                    if token in other_counts:
+                        shared -= 1
+
+        add(left_counts, right_counts, step_tokens[0])
+        for index in range(1, min(total_steps, 1 + window_size)):
+            add(right_counts, left_counts, step_tokens[index])
+
+        for boundary_index in range(1, total_steps):
+            if boundary_index > 1:
+                # Slide both windows from [i - 1 - w, i - 1) | [i - 1, i - 1 + w) to [i - w, i) | [i, i + w)
+                add(left_counts, right_counts, step_tokens[boundary_index - 1])
+                if boundary_index - 1 - window_size >= 0:
+                    remove(left_counts, right_counts, step_tokens[boundary_index - 1 - window_size])
+
+                remove(right_counts, left_counts, step_tokens[boundary_index - 1])
+                if boundary_index - 1 + window_size < total_steps:
+                    add(right_counts, left_counts, step_tokens[boundary_index - 1 + window_size])
+
+            if not left_counts or not right_counts:
+                continue
 
-        return 1.0 - similarity
-    
-    def _component_context_tokens_for_steps(self, steps):
-        tokens = set()
+            union = len(left_counts) + len(right_counts) - shared
+            drifts[boundary_index] = 1.0 - shared / float(union)
 
-        for step in steps:
-            properties = self.utils.get_step_properties(step)
+        return drifts
 
-            for key in ("sourceId", "targetId"):
-                tokens.update(self._uri_context_tokens(properties.get(key)))
+    def _cached_uri_tokens(self, uri, uri_tokens):
+        cached = uri_tokens.get(uri)
+        if cached is None:
+            cached = uri_tokens[uri] = self._uri_context_tokens(uri)
 
-        return tokens
+        return cached
 
     def _uri_context_tokens(self, uri):
         if not uri:
@@ -332,36 +353,31 @@ class CoarseTraceSplitter:
 
         return tokens
 
-    def _timestamp_gaps(self, steps):
-        timestamps = []
+    def _timestamp_gaps(self, epoch_us):
+        """
+        Returns the positive time gap in seconds between every step and the step before it, from the epoch
+        microsecond column of a step table.
+        """
 
-        for step in steps:
-            properties = self.utils.get_step_properties(step)
-            timestamps.append(self._timestamp_to_seconds(properties.get("timestamp")))
-        
-        gaps = [0.0] * len(steps)
+        gaps = np.zeros(len(epoch_us), dtype=float)
 
-        for index in range(1, len(steps)):
-            previous_timestamp = timestamps[index - 1]
-            current_timestamp = timestamps[index]
+        if len(epoch_us) < 2:
+            return gaps
 
-            if previous_timestamp is None or current_timestamp is None:
-                continue
+        known = epoch_us != MISSING_EPOCH_US
+        deltas = np.diff(epoch_us)
+        valid = known[1:] & known[:-1] & (deltas > 0)
 
-            gap = current_timestamp - previous_timestamp
-
-            if gap > 0:
-                gaps[index] = gap
+        gaps[1:][valid] = deltas[valid] / 1_000_000.0
 
         return gaps
     
     def _robust_gap_threshold(self, gaps):
-        positive_gaps = [gap for gap in gaps if gap > 0]
+        gap_values = np.asarray(gaps, dtype=float)
+        gap_values = gap_values[gap_values > 0]
 
-        if len(positive_gaps) < 3:
+        if len(gap_values) < 3:
             return 0.0
-        
-        gap_values = np.asarray(positive_gaps, dtype=float)
 
         median_gap = float(np.median(gap_values))
         absolute_deviation = np.abs(gap_values - median_gap)
@@ -371,54 +387,3 @@ class CoarseTraceSplitter:
             return median_gap * 5.0 if median_gap > 0.0 else 0.0
         
         return median_gap + (3.0 * mad)
-
-    def _timestamp_to_seconds(self, timestamp):
-        if timestamp is None:
-            return None
-        
-        if isinstance(timestamp, (int, float)):
-            return self._normalize_numeric_timestamp(float(timestamp))
-        
-        if isinstance(timestamp, str):
-            value = timestamp.strip()
-
-            if not value:
-                return None
-            
-            try:
-                return self._normalize_numeric_timestamp(float(value))
-            except ValueError:
-                pass
-
-            saboviz_match = re.match(
-                r"^[A-Za-z]{3},\s+\d{1,2}\s+[A-Za-z]{3}\s+\d{4}\s+"
-                r"\d{2}:\d{2}:\d{2}\s+\d{1,6}us\s+[+-]\d{4}$",
-                value,
-            )
-
-            if saboviz_match:
-                normalized_value = value.replace("us", "")
-                try:
-                    parsed = datetime.datetime.strptime(
-                        normalized_value,
-                        "%a, %d %b %Y %H:%M:%S %f %z",
-                    )
-                    return parsed.timestamp()
-                except ValueError:
-                    return None
-
-            normalized_value = value.replace("Z", "+00:00")
-
-            try:
-                return datetime.datetime.fromisoformat(normalized_value).timestamp()
-            except ValueError:
-                return None
-            
-        return None
-
-    def _normalize_numeric_timestamp(self, value: float) -> float:
-        if abs(value) > 1_000_000_000_000:
-            return value / 1000.0
-        
-        return value
-    
\ No newline at end of file
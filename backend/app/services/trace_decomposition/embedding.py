@@ -1,9 +1,15 @@
-import hashlib
 import math
 import re
+import zlib
 
+import numpy as np
+
+from app.services.trace_decomposition.step_table import STEP_KIND_CALL, STEP_KIND_RETURN
 from app.services.trace_decomposition.utils import TraceDecompositionUtils
 
+NUMERIC_FEATURE_COUNT = 18
+
+
 class TraceEmbedder:
     def __init__(self, context_radius=2, text_hash_dim=128, structure_hash_dim=128):
         self.utils = TraceDecompositionUtils()
@@ -11,72 +17,154 @@ class TraceEmbedder:
         self.text_hash_dim = text_hash_dim
         self.structure_hash_dim = structure_hash_dim
 
+        # Sources, targets and summaries repeat across steps, so their
+        # features are computed once per distinct value.
+        self._static_row_cache = {}
+        self._bucket_cache = {}
+
+    def clear_cache(self):
+        self._static_row_cache = {}
+        self._bucket_cache = {}
+
+    @property
+    def base_dim(self):
+        return NUMERIC_FEATURE_COUNT + self.text_hash_dim + self.structure_hash_dim
+
+    @property
+    def embedding_dim(self):
+        return 2 * self.base_dim
+
     def embed_segments(self, segments):
-        embedded_segments = []
+        """
+        Embeds every coarse segment as one contiguous float32 matrix with a
+        row per step: the step's base features followed by their average over
+        the surrounding context window.
+        """
+
+        return [self.embed_steps(segment) for segment in segments]
+
+    def embed_steps(self, steps):
+        return self.embed_columns(self.step_columns(steps))
+
+    def step_columns(self, steps):
+        """
+        Compact column form of a step table: step kind codes, raw depths and,
+        per step, an index into the distinct (source, target, summaries) keys.
+        This is all the embedder reads, and all that crosses to pool workers.
+        """
+
+        vocabulary = steps.vocabulary
+        uri_count = max(1, len(vocabulary.uris))
+
+        # Steps share few source/target pairs; keys are built per distinct pair.
+        pair_codes, pair_index = np.unique(
+            steps.source_ids.astype(np.int64) * uri_count + steps.target_ids,
+            return_inverse=True,
+        )
 
-        for segment in segments:
-            if not segment:
-                embedded_segments.append([])
-                continue
+        keys = []
+        key_lookup = {}
+        pair_key_ids = np.empty(len(pair_codes), dtype=np.int64)
 
-            base_vectors = [
-                self._build_step_base_vector(segment, index)
-                for index in range(len(segment))
-            ]
-            contextual_vectors = self._apply_context_window(base_vectors)
+        for pair, pair_code in enumerate(pair_codes.tolist()):
+            source_id, target_id = divmod(pair_code, uri_count)
 
-            embedded_steps = []
-            for index, step in enumerate(segment):
-                embedded_steps.append(
-                    {
-                        **step,
-                        "embedding": contextual_vectors[index],
-                    }
-                )
+            key = (
+                str(vocabulary.uris[source_id] or ""),
+                str(vocabulary.uris[target_id] or ""),
+                self._summary_to_text(vocabulary.summaries[source_id]),
+                self._summary_to_text(vocabulary.summaries[target_id]),
+            )
 
-            embedded_segments.append(embedded_steps)
+            key_id = key_lookup.get(key)
+            if key_id is None:
+                key_id = len(keys)
+                key_lookup[key] = key_id
+                keys.append(key)
 
-        return embedded_segments
-    
-    def _build_step_base_vector(self, steps, index):
-        node_properties = self.utils.get_step_properties(steps[index])
+            pair_key_ids[pair] = key_id
+
+        return {
+            "kinds": np.asarray(steps.kinds, dtype=np.int8),
+            "depths": np.asarray(steps.depths, dtype=np.float64),
+            "key_ids": pair_key_ids[pair_index.reshape(-1)],
+            "keys": keys,
+        }
+
+    def embed_columns(self, columns):
+        if not len(columns["kinds"]):
+            return np.zeros((0, self.embedding_dim), dtype=np.float32)
+
+        base_matrix = self._build_base_matrix(columns)
+        return self._apply_context_window(base_matrix)
+
+    def _build_base_matrix(self, columns):
+        kinds = columns["kinds"]
+        raw_depths = columns["depths"]
+        step_count = len(kinds)
+
+        is_call = kinds == STEP_KIND_CALL
+        is_return = kinds == STEP_KIND_RETURN
+        is_other = ~(is_call | is_return)
+
+        depth = np.where(np.isnan(raw_depths), 0.0, raw_depths)
+
+        previous_depth = np.zeros(step_count, dtype=np.float64)
+        previous_depth[1:] = depth[:-1]
+
+        # A missing depth on the next step means "no change".
+        next_depth = depth.copy()
+        next_depth[:-1] = np.where(np.isnan(raw_depths[1:]), depth[:-1], raw_depths[1:])
 
-        step_type = str(node_properties.get("type") or "").lower()
-        is_call = 1.0 if step_type == "call" else 0.0
-        is_return = 1.0 if step_type == "return" else 0.0
-        is_other = 1.0 if step_type not in ("call", "return") else 0.0
+        previous_was_return = np.zeros(step_count, dtype=bool)
+        previous_was_return[1:] = is_return[:-1]
 
-        depth = self.utils.safe_float(node_properties.get("depth", 0), 0.0)
+        next_is_call = np.zeros(step_count, dtype=bool)
+        next_is_call[:-1] = is_call[1:]
 
-        previous_depth = 0.0
-        previous_type = ""
+        # Static features come from the per-source/target cache; only the
+        # positional columns below differ between steps sharing them.
+        static_rows = [self._static_row(key) for key in columns["keys"]]
+        row_index = columns["key_ids"]
 
-        if index > 0:
-            previous_properties = self.utils.get_step_properties(steps[index - 1])
-            previous_depth = self.utils.safe_float(previous_properties.get("depth", 0), 0.0)
-            previous_type = str(previous_properties.get("type") or "").lower()
+        base_matrix = np.stack(static_rows)[row_index]
+        numeric = base_matrix[:, :NUMERIC_FEATURE_COUNT]
 
-        next_depth = depth
-        next_type = ""
+        numeric[:, 0] = is_call
+        numeric[:, 1] = is_return
+        numeric[:, 2] = is_other
 
-        if index + 1 < len(steps):
-            next_properties = self.utils.get_step_properties(steps[index + 1])
-            next_depth = self.utils.safe_float(next_properties.get("depth"), depth)
-            next_type = str(next_properties.get("type") or "").lower()
+        # Depth-related behavior
+        numeric[:, 3] = np.log1p(np.maximum(depth, 0.0))
+        numeric[:, 4] = self._signed_log_scaled_array(depth - previous_depth)
+        numeric[:, 5] = self._signed_log_scaled_array(next_depth - depth)
 
-        depth_delta = depth - previous_depth
-        next_depth_delta = next_depth - depth
+        # Position inside the current coarse segment
+        numeric[:, 6] = np.arange(step_count, dtype=np.float64) / max(1.0, float(step_count - 1))
 
-        normalized_index = index / max(1.0, float(len(steps) - 1))
+        # Episode-transition hints
+        numeric[:, 12] = is_call & (depth <= 0.0)
+        numeric[:, 13] = is_return & (depth <= 0.0)
+        numeric[:, 14] = previous_was_return
+        numeric[:, 15] = next_is_call
 
-        source_id = str(node_properties.get("sourceId") or "")
-        target_id = str(node_properties.get("targetId") or "")
+        return base_matrix
 
-        source_summary = node_properties.get("sourceSummary")
-        target_summary = node_properties.get("targetSummary")
+    def _static_row(self, key):
+        row = self._static_row_cache.get(key)
+        if row is None:
+            row = self._build_static_row(*key)
+            self._static_row_cache[key] = row
 
-        source_summary_text = self._summary_to_text(source_summary)
-        target_summary_text = self._summary_to_text(target_summary)
+        return row
+
+    def _build_static_row(self, source_id, target_id, source_summary_text, target_summary_text):
+        """
+        The part of a base vector that only depends on the source and target
+        of a step: signature complexity, static context, summary availability
+        and the lexical and structural token hashes. Positional columns are
+        left at zero.
+        """
 
         source_uri_info = self._extract_uri_info(source_id)
         target_uri_info = self._extract_uri_info(target_id)
@@ -99,44 +187,20 @@ class TraceEmbedder:
             and source_uri_info["operation"] == target_uri_info["operation"]
         ) else 0.0
 
-        root_level_call = 1.0 if is_call and depth <= 0.0 else 0.0
-        root_level_return = 1.0 if is_return and depth <= 0.0 else 0.0
-
-        previous_was_return = 1.0 if previous_type == "return" else 0.0
-        next_is_call = 1.0 if next_type == "call" else 0.0
-
-        numeric_features = [
-            is_call,
-            is_return,
-            is_other,
+        row = np.zeros(self.base_dim, dtype=np.float64)
 
-            # Depth-related behavior
-            self._log_scaled(depth),
-            self._signed_log_scaled(depth_delta),
-            self._signed_log_scaled(next_depth_delta),
+        # Call signature complexity
+        row[7] = self._log_scaled(source_param_count)
+        row[8] = self._log_scaled(target_param_count)
 
-            # Position inside the current coarse segment
-            normalized_index,
+        # Source-target static context
+        row[9] = same_root_context
+        row[10] = same_parent_context
+        row[11] = same_operation
 
-            # Call signature complexity
-            self._log_scaled(source_param_count),
-            self._log_scaled(target_param_count),
-
-            # Source-target static context
-            same_root_context,
-            same_parent_context,
-            same_operation,
-
-            # Episode-transition hints
-            root_level_call,
-            root_level_return,
-            previous_was_return,
-            next_is_call,
-
-            #Summary availability
-            1.0 if source_summary_text else 0.0,
-            1.0 if target_summary_text else 0.0,
-        ]
+        #Summary availability
+        row[16] = 1.0 if source_summary_text else 0.0
+        row[17] = 1.0 if target_summary_text else 0.0
 
         structural_tokens = []
 
@@ -152,57 +216,56 @@ class TraceEmbedder:
             self._source_target_pair_tokens(source_uri_info, target_uri_info)
         )
 
-        lexical_payload = " ".join(
-            [
-                source_id,
-                target_id,
-                source_summary_text,
-                target_summary_text
-            ]
-        )
+        lexical_start = NUMERIC_FEATURE_COUNT
+        structural_start = lexical_start + self.text_hash_dim
 
-        lexical_features = self._hashed_text_vector(
-            lexical_payload, 
-            self.text_hash_dim
-        )
+        # Tokens never span the spaces joining the lexical payload, so the
+        # payload's buckets are the union of each part's buckets.
+        lexical_buckets = []
+        for text in (source_id, target_id, source_summary_text, target_summary_text):
+            lexical_buckets.extend(self._hashed_buckets(text, self.text_hash_dim))
 
-        structural_features = self._hashed_text_vector(
-            " ".join(structural_tokens),
-            self.structure_hash_dim,
+        self._fill_hashed_vector(row[lexical_start:structural_start], lexical_buckets)
+        self._fill_hashed_vector(
+            row[structural_start:],
+            self._hashed_buckets(" ".join(structural_tokens), self.structure_hash_dim),
         )
 
+        return row
 
-        return (
-            numeric_features 
-            + lexical_features 
-            + structural_features
-        )
+    def _fill_hashed_vector(self, vector, buckets):
+        if not buckets:
+            return
 
-    def _apply_context_window(self, base_vectors):
-        contextual_vectors = []
+        np.add.at(vector, np.asarray(buckets, dtype=np.int64), 1.0)
 
-        if not base_vectors:
-            return contextual_vectors
-        
-        vector_size = len(base_vectors[0])
+        norm = math.sqrt(float(np.dot(vector, vector)))
+        if norm > 0:
+            vector /= norm
 
-        for index in range(len(base_vectors)):
-            start = max(0, index - self.context_radius)
-            end = min(len(base_vectors), index + self.context_radius + 1)
-            window = base_vectors[start:end]
+    def _apply_context_window(self, base_matrix):
+        """
+        Appends to every row the average of the rows within context_radius
+        of it, using prefix sums instead of summing each window.
+        """
 
-            context_avg = [0.0] * vector_size
+        step_count = base_matrix.shape[0]
 
-            for vector in window:
-                for dim in range(vector_size):
-                    context_avg[dim] += vector[dim]
+        prefix_sums = np.zeros((step_count + 1, base_matrix.shape[1]), dtype=np.float64)
+        np.cumsum(base_matrix, axis=0, out=prefix_sums[1:])
 
-            window_size = float(len(window))
-            context_avg = [value / window_size for value in context_avg]
+        indexes = np.arange(step_count)
+        window_starts = np.maximum(0, indexes - self.context_radius)
+        window_ends = np.minimum(step_count, indexes + self.context_radius + 1)
+        window_sizes = (window_ends - window_starts).astype(np.float64)
 
-            contextual_vectors.append(base_vectors[index] + context_avg)
+        context_average = (prefix_sums[window_ends] - prefix_sums[window_starts]) / window_sizes[:, None]
 
-        return contextual_vectors
+        embedding = np.empty((step_count, 2 * base_matrix.shape[1]), dtype=np.float32)
+        embedding[:, :base_matrix.shape[1]] = base_matrix
+        embedding[:, base_matrix.shape[1]:] = context_average
+
+        return embedding
     
     def _summary_to_text(self, summary):
         if isinstance(summary, str):
@@ -338,28 +401,23 @@ class TraceEmbedder:
 
         return len([p for p in params.split(",") if p.strip()])
 
-    def _hashed_text_vector(self, text, dim):
-        vector = [0.0] * dim
-
+    def _hashed_buckets(self, text, dim):
         if not text:
-            return vector
-
-        tokens = self._tokenize(text)
-
-        if not tokens:
-            return vector
-
-        for token in tokens:
-            digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
-            bucket = int(digest[:8], 16) % dim
-            vector[bucket] += 1.0
+            return []
 
-        norm = math.sqrt(sum(value * value for value in vector))
+        cache_key = (text, dim)
+        buckets = self._bucket_cache.get(cache_key)
 
-        if norm > 0:
-            vector = [value / norm for value in vector]
+        if buckets is None:
+            # CRC32 is stable across processes and far cheaper than a
+            # cryptographic digest for spreading tokens over buckets.
+            buckets = tuple(
+                zlib.crc32(token.encode("utf-8")) % dim
+                for token in self._tokenize(text)
+            )
+            self._bucket_cache[cache_key] = buckets
 
-        return vector
+        return buckets
 
     def _tokenize(self, text):
         if not text:
@@ -395,11 +453,5 @@ class TraceEmbedder:
         value = max(0.0, self.utils.safe_float(value, 0.0))
         return math.log1p(value)
 
-    def _signed_log_scaled(self, value):
-        value = self.utils.safe_float(value, 0.0)
-
-        if value == 0.0:
-            return 0.0
-
-        sign = 1.0 if value > 0.0 else -1.0
-        return sign * math.log1p(abs(value))
\ No newline at end of file
+    def _signed_log_scaled_array(self, values):
+        return np.sign(values) * np.log1p(np.abs(values))
\ No newline at end of file
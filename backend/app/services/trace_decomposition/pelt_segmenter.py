@@ -1,7 +1,6 @@
 import math
 
 import numpy as np
-import ruptures as rpt
 
 class PeltTraceSegmenter:
     def __init__(
@@ -18,39 +17,62 @@ class PeltTraceSegmenter:
         self.absolute_min_segment_size = absolute_min_segment_size
         self.sqrt_min_segment_multiplier = sqrt_min_segment_multiplier
 
-    def apply(self, embedded_segments):
+    def apply(self, coarse_segments, embeddings):
         """
         Apply stable multi-penalty PELT to each embedded coarse segment.
 
         The algorithm automatically runs PELT with several penalties and keeps only
-        stable boundaries.
+        stable boundaries. Each micro segment carries its steps and the mean
+        of their embedding rows.
         """
 
-        pelt_segments = []
+        segmentations = [self.segment_embedding(embedding) for embedding in embeddings]
+        return self.assemble(coarse_segments, segmentations)
+
+    def segment_embedding(self, embedding):
+        """
+        Change points of one coarse segment plus the mean embedding of each
+        resulting micro segment, which is all the later stages need from the
+        embedding matrix.
+        """
+
+        if embedding is None or len(embedding) == 0:
+            return {"change_points": [], "means": []}
 
-        for embedded_segment in embedded_segments:
-            if not embedded_segment:
+        change_points = self._run_stable_pelt(embedding)
+
+        means = []
+        start = 0
+        for end in [*change_points, len(embedding)]:
+            if end <= start:
                 continue
 
-            vectors = [
-                step.get("embedding", [])
-                for step in embedded_segment
-            ]
+            means.append(embedding[start:end].mean(axis=0, dtype=np.float64))
+            start = end
 
-            change_points = self._run_stable_pelt(vectors)
-            boundary_points = set(change_points)
+        return {"change_points": change_points, "means": means}
+
+    def assemble(self, coarse_segments, segmentations):
+        pelt_segments = []
 
-            micro_segment = []
+        for segment_steps, segmentation in zip(coarse_segments, segmentations):
+            if not len(segment_steps):
+                continue
 
-            for index, step in enumerate(embedded_segment):
-                micro_segment.append(step)
+            bounds = []
+            start = 0
+            for end in [*segmentation["change_points"], len(segment_steps)]:
+                if end <= start:
+                    continue
 
-                if (index + 1) in boundary_points:
-                    pelt_segments.append(micro_segment)
-                    micro_segment = []
+                bounds.append((start, end))
+                start = end
 
-            if micro_segment:
-                pelt_segments.append(micro_segment)
+            for (start, end), mean in zip(bounds, segmentation["means"]):
+                pelt_segments.append({
+                    "steps": segment_steps[start:end],
+                    "embedding": mean,
+                })
 
         return pelt_segments
     
@@ -64,12 +86,7 @@ class PeltTraceSegmenter:
 
         all_boundaries = []
 
-        for penalty in penalties:       
-            boundaries = self._run_pelt(
-                vectors = vectors,
-                penalty = penalty,
-            )
-
+        for boundaries in self._run_pelt_for_penalties(vectors, penalties):
             all_boundaries.extend(boundaries)
 
         return self._select_stable_boundaries(
@@ -78,14 +95,22 @@ class PeltTraceSegmenter:
             penalty_count = len(penalties),
         )
     
-    def _run_pelt(self, vectors, penalty):
+    def _run_pelt_for_penalties(self, vectors, penalties):
+        """
+        Optimal change points for every penalty in one PELT search. The L2
+        segment costs come from shared prefix sums and are computed once per
+        candidate for all penalties; each penalty keeps its own optimal costs
+        and pruned candidate set.
+        """
+
+        results = [[] for _ in penalties]
         trace_length = len(vectors)
 
-        if trace_length == 0:
-            return []
+        if trace_length == 0 or not penalties:
+            return results
         
         if not self._has_valid_vectors(vectors):
-            return []
+            return results
 
         min_size = self._effective_min_size(trace_length)
 
@@ -93,34 +118,81 @@ class PeltTraceSegmenter:
             min_size = max(1, trace_length // 2)
 
         if min_size <= 0 or trace_length < 2:
-            return []
+            return results
         
         signal = np.asarray(vectors, dtype=float)
 
         if signal.ndim != 2 or signal.shape[0] != trace_length:
-            return []
+            return results
         
         signal = self._normalize_signal(signal)
 
-        try:
-            model = rpt.Pelt(model="l2", min_size=min_size, jump=1)
+        prefix_sums = np.zeros((trace_length + 1, signal.shape[1]), dtype=np.float64)
+        np.cumsum(signal, axis=0, out=prefix_sums[1:])
 
-            breakpoints = model.fit(signal).predict(pen=float(penalty))
-        except Exception:
-            return []
+        prefix_squares = np.zeros(trace_length + 1, dtype=np.float64)
+        np.cumsum(np.einsum("ij,ij->i", signal, signal), out=prefix_squares[1:])
 
-        change_points = [
-            point
-            for point in breakpoints
-            if 0 < point < trace_length
-        ]
+        penalty_values = np.asarray([float(penalty) for penalty in penalties], dtype=np.float64)
+        penalty_rows = np.arange(len(penalty_values))
+
+        optimal_costs = np.full((len(penalty_values), trace_length + 1), np.inf)
+        optimal_costs[:, 0] = 0.0
+        previous_change = np.zeros((len(penalty_values), trace_length + 1), dtype=np.int64)
+
+        # Union of the admissible sets of all penalties, in ascending order,
+        # with a mask of the penalties that still consider each candidate.
+        candidates = np.zeros(0, dtype=np.int64)
+        admissible = np.zeros((len(penalty_values), 0), dtype=bool)
+
+        for end in [*range(min_size, trace_length), trace_length]:
+            new_point = end - min_size
+
+            # Prefixes shorter than min_size have no segmentation.
+            if new_point == 0 or new_point >= min_size:
+                candidates = np.append(candidates, new_point)
+                admissible = np.hstack((admissible, np.ones((len(penalty_values), 1), dtype=bool)))
+
+            lengths = end - candidates
+            sums = prefix_sums[end] - prefix_sums[candidates]
+            costs = (prefix_squares[end] - prefix_squares[candidates]) - np.einsum("ij,ij->i", sums, sums) / lengths
 
-        return sorted(set(change_points))
+            # Same accumulation order as ruptures: F[t] + (cost + penalty),
+            # and the earliest candidate wins ties.
+            totals = optimal_costs[:, candidates] + (costs[None, :] + penalty_values[:, None])
+            totals[~admissible] = np.inf
+
+            best = np.argmin(totals, axis=1)
+            optimal_costs[:, end] = totals[penalty_rows, best]
+            previous_change[:, end] = candidates[best]
+
+            admissible &= totals <= (optimal_costs[:, end] + penalty_values)[:, None]
+
+            still_used = admissible.any(axis=0)
+            if not still_used.all():
+                candidates = candidates[still_used]
+                admissible = admissible[:, still_used]
+
+        for row in penalty_rows:
+            change_points = []
+            end = trace_length
+
+            while end > 0:
+                end = int(previous_change[row, end])
+                if end > 0:
+                    change_points.append(end)
+
+            results[row] = sorted(change_points)
+
+        return results
 
     def _has_valid_vectors(self, vectors):
-        if not vectors:
+        if vectors is None or len(vectors) == 0:
             return False
 
+        if isinstance(vectors, np.ndarray):
+            return vectors.ndim == 2 and vectors.shape[1] > 0
+
         first_vector_size = len(vectors[0]) if vectors[0] else 0
 
         if first_vector_size == 0:
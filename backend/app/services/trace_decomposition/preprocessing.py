@@ -1,14 +1,27 @@
+from app.services.trace_decomposition.step_table import StepTable, StepVocabulary
+
+
 class TracePreprocessor:
     def __init__(self, graph_service):
         self.graph_service = graph_service
 
-    def preprocess_trace(self, trace_data, project_id):
-        operation_nodes = self.graph_service.get_summary_map(project_id)
+    def preprocess_trace(self, trace_data, project_id, operation_nodes=None):
+        if operation_nodes is None:
+            operation_nodes = self.graph_service.get_summary_map(project_id)
 
         elements = trace_data.get("elements", {}) if isinstance(trace_data, dict) else {}
         steps = elements.get("nodes", []) if isinstance(elements, dict) else []
 
-        preprocessed_steps = []
+        return self.preprocess_steps(steps, StepVocabulary(operation_nodes))
+
+    def preprocess_steps(self, steps, vocabulary):
+        """
+        Keeps the resolved action steps, ordered by step number, as a step table. Source and target
+        summaries live in the vocabulary once per operation instead of on every step. Streaming
+        decomposition calls this once per window of steps, sharing one vocabulary across windows.
+        """
+
+        resolved_properties = []
 
         for step in steps:
             if not isinstance(step, dict):
@@ -30,42 +43,18 @@ class TracePreprocessor:
             if operation_resolution != "resolved":
                 continue
 
-            source_id = properties.get("sourceId")
-            target_id = properties.get("targetId")
-
-            enriched_properties = {
-                **properties,
-                "sourceSummary": operation_nodes.get(source_id, {}),
-                "targetSummary": operation_nodes.get(target_id, {}),
-            }
+            resolved_properties.append(properties)
 
-            enriched_step = {
-                **step,
-                "data": {
-                    **step_data,
-                    "properties": enriched_properties,
-                },
-            }
-
-            preprocessed_steps.append(enriched_step)
-
-        preprocessed_steps.sort(
-            key=lambda step: self._safe_step_number(step)
+        resolved_properties.sort(
+            key=lambda properties: self._safe_step_number(properties)
         )
 
-        return preprocessed_steps
-
-    def _safe_step_number(self, step):
-        properties = (
-            step.get("data", {})
-            .get("properties", {})
-            if isinstance(step, dict)
-            else {}
-        )
+        return StepTable.from_properties(vocabulary, resolved_properties)
 
+    def _safe_step_number(self, properties):
         value = properties.get("step", 0)
 
         try:
             return int(value)
         except (TypeError, ValueError):
-            return 0
\ No newline at end of file
+            return 0
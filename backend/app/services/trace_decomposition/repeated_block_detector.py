@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class RepeatedBlockDetector:
     def __init__(
             self,
@@ -12,93 +15,101 @@ class RepeatedBlockDetector:
         self.min_saved_steps = min_saved_steps
 
     def compress(self, steps):
-        tokens = [self._step_signauture(step) for step in steps]
+        best_block_sizes, best_repeat_counts = self._best_repeats(self._intern_signatures(steps))
         result = []
 
         index = 0
-        while index < len(tokens):
-            repeat = self._find_best_repeat(tokens, index)
+        while index < len(steps):
+            block_size = int(best_block_sizes[index])
 
-            if repeat is None:
+            if block_size == 0:
                 result.append({
                     "type": "step",
-                    **self._step_summary(steps[index]),
+                    **self._step_summary(steps, index),
                 })
                 index += 1
                 continue
 
-            block_size, repeat_count = repeat
-            block_steps = steps[index:index + block_size]
+            repeat_count = int(best_repeat_counts[index])
 
             result.append({
                 "type": "repeat",
                 "repeatCount": repeat_count,
-                "startStep": self._step_number(steps[index]),
-                "endStep": self._step_number(steps[index + (block_size * repeat_count) - 1]),
-                "steps": [self._step_summary(step) for step in block_steps],
+                "startStep": self._step_summary(steps, index)["step"],
+                "endStep": self._step_summary(steps, index + (block_size * repeat_count) - 1)["step"],
+                "steps": [self._step_summary(steps, block_index) for block_index in range(index, index + block_size)],
             })
 
             index += block_size * repeat_count
 
         return result
-    
-    def _find_best_repeat(self, tokens, start_index):
-        remaining = len(tokens) - start_index
-        max_block_size = min(self.max_block_size, remaining // 2)
-
-        best = None
-        best_score = -1
-
-        for block_size in range(1, max_block_size + 1):
-            pattern = tokens[start_index:start_index + block_size]
-            repeat_count = 1
 
-            cursor = start_index + block_size
-            while (cursor + block_size <= len(tokens) and tokens[cursor:cursor + block_size] == pattern):
-                repeat_count += 1
-                cursor += block_size
+    def _intern_signatures(self, steps):
+        """
+        One integer per step that is equal exactly when the (type, source, target) signatures are. Types and
+        URIs are compared by their normalized text, so vocabulary ids that normalize alike share a code.
+        """
 
-            if repeat_count < self.min_repeats:
-                continue
-
-            saved_steps = block_size * (repeat_count - 1)
-
-            if saved_steps < self.min_saved_steps:
-                continue
-
-            score = saved_steps
-
-            if score > best_score:
-                best_score = score
-                best = (block_size, repeat_count)
-
-        return best
-    
-    def _step_signauture(self, step):
-        properties = self.utils.get_step_properties(step)
+        vocabulary = steps.vocabulary
+        type_codes = self._normalized_codes(str(value or "").lower() for value in vocabulary.types)
+        uri_codes = self._normalized_codes(str(value or "") for value in vocabulary.uris)
+        uri_count = max(1, len(vocabulary.uris))
 
         return (
-            str(properties.get("type") or "").lower(),
-            str(properties.get("sourceId") or ""),
-            str(properties.get("targetId") or ""),
+            (type_codes[steps.type_ids] * uri_count + uri_codes[steps.source_ids]) * uri_count
+            + uri_codes[steps.target_ids]
         )
+
+    def _normalized_codes(self, values):
+        codes = {}
+        return np.asarray([codes.setdefault(value, len(codes)) for value in values], dtype=np.int64)
+    
+    def _best_repeats(self, tokens):
+        """
+        Finds the best tandem repeat starting at every position: the block size saving the most steps, the smallest
+        one on ties. For a block size b, a block repeats k times from position s exactly when tokens[i] == tokens[i + b]
+        for the (k - 1) * b positions following s, so one pass over the trace per block size covers all start positions.
+        Returns block sizes (0 where no repeat qualifies) and repeat counts per position.
+        """
+
+        total = len(tokens)
+        best_saved = np.full(total, -1, dtype=np.int64)
+        best_block_sizes = np.zeros(total, dtype=np.int64)
+        best_repeat_counts = np.zeros(total, dtype=np.int64)
+
+        for block_size in range(1, min(self.max_block_size, total // 2) + 1):
+            length = total - block_size
+            positions = np.arange(length)
+
+            # Length of the run of matching positions starting at every index
+            matches = tokens[:length] == tokens[block_size:]
+            next_mismatch = np.where(matches, length, positions)
+            next_mismatch = np.minimum.accumulate(next_mismatch[::-1])[::-1]
+            run_lengths = next_mismatch - positions
+
+            repeat_counts = 1 + run_lengths // block_size
+            saved_steps = block_size * (repeat_counts - 1)
+
+            improves = (
+                (positions <= total - 2 * block_size)
+                & (repeat_counts >= self.min_repeats)
+                & (saved_steps >= self.min_saved_steps)
+                & (saved_steps > best_saved[:length])
+            )
+
+            best_saved[:length][improves] = saved_steps[improves]
+            best_block_sizes[:length][improves] = block_size
+            best_repeat_counts[:length][improves] = repeat_counts[improves]
+
+        return best_block_sizes, best_repeat_counts
     
-    def _step_summary(self, step):
-        properties = self.utils.get_step_properties(step)
+    def _step_summary(self, steps, index):
+        properties = steps.step_properties(index)
 
         return {
-            "step": self._step_number(step),
-            "kind": str(properties.get("type") or "step").lower(),
-            "depth": properties.get("depth"),
-            "sourceId": properties.get("sourceId"),
-            "targetId": properties.get("targetId"),
+            "step": properties["step"],
+            "kind": str(properties["type"] or "step").lower(),
+            "depth": properties["depth"],
+            "sourceId": properties["sourceId"],
+            "targetId": properties["targetId"],
         }
-
-    def _step_number(self, step):
-        properties = self.utils.get_step_properties(step)
-        value = properties.get("step")
-
-        try:
-            return int(value)
-        except (TypeError, ValueError):
-            return None
\ No newline at end of file
@@ -2,6 +2,8 @@ import re
 
 from collections import Counter
 
+import numpy as np
+
 from app.services.sabo_gen.config import NODE_OPERATION
 from app.services.trace_decomposition.utils import TraceDecompositionUtils
 from app.services.trace_decomposition.repeated_block_detector import RepeatedBlockDetector
@@ -12,11 +14,11 @@ class SegmentEnricher:
         self.utils = TraceDecompositionUtils()
         self.repeated_block_detector = RepeatedBlockDetector(self.utils)
 
-    def enrich(self, pelt_segments, summarizer, allow_ai, node_lookup, collect_nodes_with_ancestors, progress_step=None):
+    def enrich(self, pelt_segments, summarizer, allow_ai, node_lookup, collect_nodes_with_ancestors, progress_step=None, start_index=1, previous_micro_feature=None):
         enriched_segments = []
-        previous_micro_feature = None
 
-        for index, segment_steps in enumerate(pelt_segments, start=1):
+        for index, pelt_segment in enumerate(pelt_segments, start=start_index):
+            segment_steps = pelt_segment["steps"]
             components = self._collect_segment_components(segment_steps)
 
             default_name = self._generate_segment_name(components, index)
@@ -57,6 +59,7 @@ class SegmentEnricher:
                     "description": segment_description,
                     "components": components,
                     "steps": segment_steps,
+                    "embedding": pelt_segment.get("embedding"),
                 }
             )
 
@@ -68,20 +71,10 @@ class SegmentEnricher:
         return enriched_segments
     
     def _collect_segment_components(self, segment_steps):
-        components = set()
-
-        for step in segment_steps:
-            properties = self.utils.get_step_properties(step)
-
-            source_id = properties.get("sourceId")
-            target_id = properties.get("targetId")
-
-            if source_id:
-                components.add(source_id)
-            if target_id:
-                components.add(target_id)
+        uris = segment_steps.vocabulary.uris
+        uri_ids = np.unique(np.concatenate([segment_steps.source_ids, segment_steps.target_ids]))
 
-        return sorted(components)
+        return sorted({uris[uri_id] for uri_id in uri_ids.tolist() if uris[uri_id]})
     
     def _generate_segment_name(self, components, segment_index):
         words = []
@@ -110,19 +103,22 @@ class SegmentEnricher:
         summary_lines = []
         seen = set()
 
-        for step in segment_steps:
-            properties = self.utils.get_step_properties(step)
-            for key in ("sourceSummary", "targetSummary"):
-                text = self.utils.summary_to_text(properties.get(key)).strip()
-                if not text:
-                    continue
+        # Source and target of every step in trace order; only the first occurrence of each URI can add a line.
+        uri_sequence = np.column_stack([segment_steps.source_ids, segment_steps.target_ids]).reshape(-1)
+        _, first_positions = np.unique(uri_sequence, return_index=True)
+        summaries = segment_steps.vocabulary.summaries
 
-                normalized = text.lower()
-                if normalized in seen:
-                    continue
+        for uri_id in uri_sequence[np.sort(first_positions)].tolist():
+            text = self.utils.summary_to_text(summaries[uri_id]).strip()
+            if not text:
+                continue
+
+            normalized = text.lower()
+            if normalized in seen:
+                continue
 
-                seen.add(normalized)
-                summary_lines.append(text)
+            seen.add(normalized)
+            summary_lines.append(text)
 
         if summary_lines:
             preview = "; ".join(summary_lines[:3])
@@ -0,0 +1,30 @@
+from app.core.concurrency import create_process_pool
+
+# Embedder and segmenter configured by the decomposition that owns the pool.
+_worker_embedder = None
+_worker_segmenter = None
+
+
+def _init_segment_worker(embedder, segmenter):
+    global _worker_embedder, _worker_segmenter
+    _worker_embedder = embedder
+    _worker_segmenter = segmenter
+
+
+def _embed_and_segment(columns):
+    embedding = _worker_embedder.embed_columns(columns)
+    return _worker_segmenter.segment_embedding(embedding)
+
+
+def embed_and_segment_in_pool(embedder, segmenter, segment_columns, max_workers: int):
+    """
+    Embeds and PELT-segments coarse segments on a process pool. Segments
+    travel as compact columns and come back as change points plus micro
+    segment means, in the order they were given.
+    """
+
+    embedder.clear_cache()
+    worker_count = max(1, min(int(max_workers), len(segment_columns)))
+
+    with create_process_pool(worker_count, _init_segment_worker, (embedder, segmenter)) as pool:
+        return list(pool.map(_embed_and_segment, segment_columns))
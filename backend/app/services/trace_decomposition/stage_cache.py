@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import uuid
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+from app.core.storage_paths import HOST_DATA_PATH
+
+# Bump when a cached stage's algorithm changes in a way its parameters do not capture.
+STAGE_CACHE_VERSION = 1
+
+# Size a project's cache may grow to before its least recently used entries are removed.
+STAGE_CACHE_MAX_BYTES = int(os.getenv("TRACE_STAGE_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+
+def stage_cache_dir(project_id: int) -> Path:
+    return HOST_DATA_PATH / str(project_id) / "cache"
+
+
+def stage_parameters(component) -> dict:
+    """
+    The scalar constructor settings of a pipeline component, which is what its output depends on besides its input.
+    """
+
+    return {
+        name: value
+        for name, value in sorted(vars(component).items())
+        if isinstance(value, (bool, int, float, str))
+    }
+
+
+def stage_key(stage: str, *parts) -> str:
+    digest = hashlib.sha256()
+    digest.update(json.dumps([STAGE_CACHE_VERSION, stage, *parts], sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class StageCache:
+    """
+    Stage outputs of a trace decomposition, stored as .npz files named after the stage and the fingerprint of
+    everything the stage read. A file either exists complete or not at all, and unreadable files count as misses.
+    Keys follow content, not traces, so entries of deleted or changed traces are only dropped once the cache
+    outgrows max_bytes: every save then removes the least recently used files.
+    """
+
+    def __init__(self, project_id: int, max_bytes: int = STAGE_CACHE_MAX_BYTES):
+        self.cache_dir = stage_cache_dir(project_id)
+        self.max_bytes = max_bytes
+
+    def path_for(self, stage: str, key: str) -> Path:
+        return self.cache_dir / f"{stage}-{key}.npz"
+
+    def load(self, stage: str, key: str):
+        path = self.path_for(stage, key)
+        if not path.exists():
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as stored:
+                arrays = {name: stored[name] for name in stored.files}
+        except (OSError, ValueError, zipfile.BadZipFile):
+            return None
+
+        # The modification time doubles as the last use, which prune goes by.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return arrays
+
+    def save(self, stage: str, key: str, **arrays):
+        path = self.path_for(stage, key)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+
+            os.replace(tmp_path, path)
+        except OSError:
+            # The cache only saves work; a decomposition never fails because of it.
+            pass
+        finally:
+            if tmp_path.exists():
+                os.remove(tmp_path)
+
+        self.prune(keep=path)
+
+    def prune(self, keep: Path = None):
+        """
+        Removes the least recently used entries until the cache fits in max_bytes. The entry in keep, the one
+        just saved, is never removed.
+        """
+
+        entries = []
+        try:
+            for path in self.cache_dir.glob("*.npz"):
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+        except OSError:
+            return
+
+        total_bytes = sum(size for _mtime, size, _path in entries)
+
+        for _mtime, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total_bytes <= self.max_bytes:
+                break
+
+            if path == keep:
+                continue
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+            total_bytes -= size
+
+
+def pack_segmentations(segmentations, embedding_dim: int) -> dict:
+    """
+    Flattens per-coarse-segment PELT results into arrays: the change points and micro segment means of all
+    coarse segments back to back, plus how many of each belong to every coarse segment.
+    """
+
+    change_points = [point for segmentation in segmentations for point in segmentation["change_points"]]
+    means = [mean for segmentation in segmentations for mean in segmentation["means"]]
+
+    return {
+        "change_point_counts": np.asarray([len(segmentation["change_points"]) for segmentation in segmentations], dtype=np.int64),
+        "change_points": np.asarray(change_points, dtype=np.int64),
+        "mean_counts": np.asarray([len(segmentation["means"]) for segmentation in segmentations], dtype=np.int64),
+        "means": np.stack(means) if means else np.zeros((0, embedding_dim), dtype=np.float64),
+    }
+
+
+def unpack_segmentations(arrays) -> list:
+    change_point_ends = np.cumsum(arrays["change_point_counts"])
+    mean_ends = np.cumsum(arrays["mean_counts"])
+
+    segmentations = []
+    change_point_start = 0
+    mean_start = 0
+
+    for change_point_end, mean_end in zip(change_point_ends.tolist(), mean_ends.tolist()):
+        segmentations.append({
+            "change_points": arrays["change_points"][change_point_start:change_point_end].tolist(),
+            "means": list(arrays["means"][mean_start:mean_end]),
+        })
+        change_point_start = change_point_end
+        mean_start = mean_end
+
+    return segmentations
@@ -0,0 +1,186 @@
+import math
+
+import numpy as np
+
+from app.services.sabo_gen.timestamps import timestamp_to_epoch_us
+from app.services.sabo_gen.trace_index import MISSING_EPOCH_US
+
+STEP_KIND_OTHER = 0
+STEP_KIND_CALL = 1
+STEP_KIND_RETURN = 2
+
+MISSING_STEP_NUMBER = np.iinfo(np.int64).min
+
+
+class StepVocabulary:
+    """
+    Interned step types and operation URIs, with the summary of every URI. Ids are only ever appended,
+    so step tables built from one vocabulary at different times (the windows of a streamed trace) can
+    be concatenated as they are.
+    """
+
+    def __init__(self, operation_nodes):
+        self.operation_nodes = operation_nodes or {}
+        self.types = []
+        self.uris = []
+        self.summaries = []
+        self._type_ids = {}
+        self._uri_ids = {}
+
+    def type_id(self, value) -> int:
+        type_id = self._type_ids.get(value)
+        if type_id is None:
+            type_id = self._type_ids[value] = len(self.types)
+            self.types.append(value)
+
+        return type_id
+
+    def uri_id(self, value) -> int:
+        uri_id = self._uri_ids.get(value)
+        if uri_id is None:
+            uri_id = self._uri_ids[value] = len(self.uris)
+            self.uris.append(value)
+            self.summaries.append(self.operation_nodes.get(value, {}))
+
+        return uri_id
+
+    def type_kinds(self):
+        kinds = np.full(len(self.types), STEP_KIND_OTHER, dtype=np.int8)
+
+        for type_id, value in enumerate(self.types):
+            step_type = str(value or "").lower()
+            if step_type == "call":
+                kinds[type_id] = STEP_KIND_CALL
+            elif step_type == "return":
+                kinds[type_id] = STEP_KIND_RETURN
+
+        return kinds
+
+
+class StepTable:
+    """
+    The resolved steps of a trace as columns: step numbers, type and URI ids into a shared vocabulary,
+    depths (NaN when missing) and epoch microseconds. Slicing returns views over the same columns, so
+    coarse and micro segments cost no copies.
+    """
+
+    def __init__(self, vocabulary, step_numbers, type_ids, kinds, depths, epoch_us, source_ids, target_ids):
+        self.vocabulary = vocabulary
+        self.step_numbers = step_numbers
+        self.type_ids = type_ids
+        self.kinds = kinds
+        self.depths = depths
+        self.epoch_us = epoch_us
+        self.source_ids = source_ids
+        self.target_ids = target_ids
+
+    @classmethod
+    def from_properties(cls, vocabulary, step_properties):
+        """
+        Builds a table from step property dicts, in the order given.
+        """
+
+        type_id = vocabulary.type_id
+        uri_id = vocabulary.uri_id
+
+        step_numbers = []
+        type_ids = []
+        depths = []
+        epoch_us = []
+        source_ids = []
+        target_ids = []
+
+        for properties in step_properties:
+            step_numbers.append(_step_number(properties.get("step")))
+            type_ids.append(type_id(properties.get("type")))
+            depths.append(_depth(properties.get("depth")))
+
+            epoch = properties.get("epochMicros")
+            if epoch is None:
+                epoch = timestamp_to_epoch_us(properties.get("timestamp"))
+            epoch_us.append(MISSING_EPOCH_US if epoch is None else int(epoch))
+
+            source_ids.append(uri_id(properties.get("sourceId")))
+            target_ids.append(uri_id(properties.get("targetId")))
+
+        type_ids = np.asarray(type_ids, dtype=np.int32)
+
+        return cls(
+            vocabulary,
+            np.asarray(step_numbers, dtype=np.int64),
+            type_ids,
+            vocabulary.type_kinds()[type_ids] if len(type_ids) else np.zeros(0, dtype=np.int8),
+            np.asarray(depths, dtype=np.float64),
+            np.asarray(epoch_us, dtype=np.int64),
+            np.asarray(source_ids, dtype=np.int32),
+            np.asarray(target_ids, dtype=np.int32),
+        )
+
+    @classmethod
+    def concat(cls, tables):
+        non_empty = [table for table in tables if len(table)]
+        if len(non_empty) <= 1:
+            return non_empty[0] if non_empty else tables[0]
+
+        return cls(
+            non_empty[0].vocabulary,
+            *(
+                np.concatenate([getattr(table, column) for table in non_empty])
+                for column in ("step_numbers", "type_ids", "kinds", "depths", "epoch_us", "source_ids", "target_ids")
+            ),
+        )
+
+    def __len__(self):
+        return len(self.step_numbers)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError("StepTable only supports slicing; use step_properties for a single step")
+
+        return StepTable(
+            self.vocabulary,
+            self.step_numbers[index],
+            self.type_ids[index],
+            self.kinds[index],
+            self.depths[index],
+            self.epoch_us[index],
+            self.source_ids[index],
+            self.target_ids[index],
+        )
+
+    def known_step_numbers(self):
+        return self.step_numbers[self.step_numbers != MISSING_STEP_NUMBER]
+
+    def step_properties(self, index: int) -> dict:
+        """
+        Rebuilds the properties of one step, for the few places that hand steps to a prompt.
+        """
+
+        step_number = int(self.step_numbers[index])
+        depth = float(self.depths[index])
+        source_id = int(self.source_ids[index])
+        target_id = int(self.target_ids[index])
+
+        return {
+            "step": None if step_number == MISSING_STEP_NUMBER else step_number,
+            "type": self.vocabulary.types[int(self.type_ids[index])],
+            "depth": None if math.isnan(depth) else (int(depth) if depth.is_integer() else depth),
+            "sourceId": self.vocabulary.uris[source_id],
+            "targetId": self.vocabulary.uris[target_id],
+            "sourceSummary": self.vocabulary.summaries[source_id],
+            "targetSummary": self.vocabulary.summaries[target_id],
+        }
+
+
+def _step_number(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return MISSING_STEP_NUMBER
+
+
+def _depth(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
@@ -1,5 +1,10 @@
+import hashlib
+import json
+import os
 from typing import Any, Optional, Callable
 
+import numpy as np
+
 from app.services.trace_decomposition.preprocessing import TracePreprocessor
 from app.services.trace_decomposition.coarse_splitter import CoarseTraceSplitter
 from app.services.trace_decomposition.embedding import TraceEmbedder
@@ -7,12 +12,33 @@ from app.services.trace_decomposition.pelt_segmenter import PeltTraceSegmenter
 from app.services.trace_decomposition.segment_enricher import SegmentEnricher
 from app.services.trace_decomposition.adjacent_clusterer import AdjacentClusterer
 from app.services.trace_decomposition.serialization import TraceClusterSerializer
-from app.services.trace_decomposition.utils import TraceDecompositionUtils
+from app.services.trace_decomposition.step_table import StepTable, StepVocabulary
+from app.services.trace_decomposition.segment_workers import embed_and_segment_in_pool
+from app.services.trace_decomposition.stage_cache import (
+    StageCache,
+    pack_segmentations,
+    stage_key,
+    stage_parameters,
+    unpack_segmentations,
+)
+from app.core.concurrency import TRACE_DECOMPOSITION_WORKERS
+
+# Below this many steps, starting worker processes costs more than it saves.
+PARALLEL_SEGMENT_MIN_STEPS = 20000
+
+# Traces with at least this many steps are decomposed window by window from their step index.
+STREAMING_MIN_STEPS = int(os.getenv("TRACE_STREAMING_MIN_STEPS", "1000000"))
+STREAMING_WINDOW_STEPS = int(os.getenv("TRACE_STREAMING_WINDOW_STEPS", "100000"))
+
+# An open coarse segment spanning this many windows is closed even without a boundary, which caps streaming memory.
+STREAMING_MAX_OPEN_WINDOWS = 4
 
 
 class TraceDecomposition:
-    def __init__(self, graph_service):
+    def __init__(self, graph_service, segment_workers: int = TRACE_DECOMPOSITION_WORKERS, use_stage_cache: bool = True):
         self.graph_service = graph_service
+        self.segment_workers = segment_workers
+        self.use_stage_cache = use_stage_cache
         self.preprocessor = TracePreprocessor(graph_service)
         self.coarse_splitter = CoarseTraceSplitter()
         self.embedder = TraceEmbedder()
@@ -21,8 +47,6 @@ class TraceDecomposition:
         self.clusterer = AdjacentClusterer()
         self.serializer = TraceClusterSerializer()
 
-        self.utils = TraceDecompositionUtils()
-
     def decompose_trace(
             self,
             trace_data,
@@ -31,20 +55,22 @@ class TraceDecomposition:
             allow_ai: bool,
             node_lookup,
             collect_nodes_with_ancestors,
-            progress_callback: Optional[Callable[[str, int, Optional[int], Optional[str]], None]] = None
+            progress_callback: Optional[Callable[[str, int, Optional[int], Optional[str]], None]] = None,
+            operation_nodes: Optional[dict] = None,
         ):
-        steps = self.preprocessor.preprocess_trace(trace_data, project_id)
+        steps = self.preprocessor.preprocess_trace(trace_data, project_id, operation_nodes)
 
-        if not steps:
+        if not len(steps):
             return {
                 "micro_segments": [],
                 "hierarchical_clusters": [],
             }
         
-        coarse_segments = self.coarse_splitter.split(steps)
-        embedded_segments = self.embedder.embed_segments(coarse_segments)
+        stage_cache = StageCache(project_id) if self.use_stage_cache else None
+        coarse_key, segments_key = self._stage_keys(steps)
 
-        pelt_segments = self.pelt_segmenter.apply(embedded_segments)
+        coarse_segments = self._split_coarse(steps, stage_cache, coarse_key)
+        pelt_segments = self._segment_coarse_segments(coarse_segments, stage_cache, segments_key)
 
         micro_total = len(pelt_segments)
         micro_done = 0
@@ -76,6 +102,117 @@ class TraceDecomposition:
             progress_step = advance_micro_progress,
         )
 
+        return {
+            "micro_segments": enriched_segments,
+            "hierarchical_clusters": self._cluster_segments(enriched_segments, summarizer, allow_ai, progress_callback),
+        }
+
+    def decompose_trace_stream(
+            self,
+            step_index,
+            project_id: int,
+            summarizer,
+            allow_ai: bool,
+            node_lookup,
+            collect_nodes_with_ancestors,
+            persist_micro_segments: Callable[[list], None],
+            progress_callback: Optional[Callable[[str, int, Optional[int], Optional[str]], None]] = None,
+            operation_nodes: Optional[dict] = None,
+        ):
+        """
+        Decomposes a trace read window by window from its step index, for traces too large to hold in memory.
+
+        Each window is appended to the still open last coarse segment and split again; every coarse segment
+        except the last is final and gets segmented, enriched and handed to persist_micro_segments right away.
+        Only light records of the micro segments (names, components, mean embedding, step count) are kept for
+        the final clustering, so memory is bounded by the largest coarse segment rather than the trace.
+        Coarse boundaries are scored against the open segment plus the current window instead of the whole
+        trace; only the minimum coarse segment size still follows the full trace length.
+        """
+
+        if operation_nodes is None:
+            operation_nodes = self.graph_service.get_summary_map(project_id)
+
+        total_steps = step_index.total_steps
+
+        window_steps = max(1, STREAMING_WINDOW_STEPS)
+
+        vocabulary = StepVocabulary(operation_nodes)
+        open_steps = StepTable.from_properties(vocabulary, [])
+        micro_segments = []
+        previous_micro_feature = None
+        micro_done = 0
+
+        def advance_micro_progress(segment_name: Optional[str] = None):
+            nonlocal micro_done
+
+            micro_done += 1
+
+            if progress_callback is not None:
+                progress_callback("micro", micro_done, None, segment_name)
+
+        for window_start in range(0, total_steps, window_steps):
+            window_end = min(total_steps, window_start + window_steps)
+            open_steps = StepTable.concat([
+                open_steps,
+                self.preprocessor.preprocess_steps(step_index.read_range(window_start, window_end), vocabulary),
+            ])
+
+            if not len(open_steps):
+                continue
+
+            coarse_segments = self.coarse_splitter.split(open_steps, trace_length = total_steps)
+
+            if window_end < total_steps and len(open_steps) < STREAMING_MAX_OPEN_WINDOWS * window_steps:
+                coarse_segments, open_steps = coarse_segments[:-1], coarse_segments[-1]
+            else:
+                open_steps = open_steps[:0]
+
+            if not coarse_segments:
+                continue
+
+            enriched_segments = self.enricher.enrich(
+                pelt_segments = self._segment_coarse_segments(coarse_segments),
+                summarizer = summarizer,
+                allow_ai = allow_ai,
+                node_lookup = node_lookup,
+                collect_nodes_with_ancestors = collect_nodes_with_ancestors,
+                progress_step = advance_micro_progress,
+                start_index = len(micro_segments) + 1,
+                previous_micro_feature = previous_micro_feature,
+            )
+
+            if not enriched_segments:
+                continue
+
+            persist_micro_segments(enriched_segments)
+
+            previous_micro_feature = {
+                "name": enriched_segments[-1]["name"],
+                "description": enriched_segments[-1]["description"],
+            }
+
+            micro_segments.extend(
+                {
+                    "segmentIndex": segment["segmentIndex"],
+                    "name": segment["name"],
+                    "description": segment["description"],
+                    "components": segment["components"],
+                    "embedding": segment["embedding"],
+                    "stepCount": len(segment["steps"]),
+                }
+                for segment in enriched_segments
+            )
+
+        if not micro_segments:
+            return []
+
+        if progress_callback is not None:
+            progress_callback("micro", len(micro_segments), len(micro_segments), None)
+
+        return self._cluster_segments(micro_segments, summarizer, allow_ai, progress_callback)
+
+    def _cluster_segments(self, enriched_segments, summarizer, allow_ai, progress_callback=None):
         merge_done = 0
 
         def advance_merge_progress(segment_name: Optional[str] = None):
@@ -108,10 +245,121 @@ class TraceDecomposition:
                 None,
             )
 
-        return {
-            "micro_segments": enriched_segments,
-            "hierarchical_clusters": self.serializer.serialize(hierarhical_segments),
+        return self.serializer.serialize(hierarhical_segments)
+
+    def should_stream(self, total_steps: int) -> bool:
+        return STREAMING_MIN_STEPS > 0 and total_steps >= STREAMING_MIN_STEPS
+
+    def _stage_keys(self, steps):
+        """
+        Cache keys for the coarse split and the embedding + PELT stage. The coarse key covers the step fields
+        the splitter reads and its settings; the segmentation key chains it with the source/target summaries
+        and the embedder and segmenter settings. Enrichment and clustering always rerun.
+        """
+
+        vocabulary = steps.vocabulary
+        step_digest = hashlib.sha256()
+
+        for column in (steps.step_numbers, steps.type_ids, steps.depths, steps.epoch_us, steps.source_ids, steps.target_ids):
+            step_digest.update(np.ascontiguousarray(column).tobytes())
+
+        step_digest.update(json.dumps([vocabulary.types, vocabulary.uris], default=str).encode("utf-8"))
+
+        summaries = {
+            str(uri): summary
+            for uri, summary in zip(vocabulary.uris, vocabulary.summaries)
         }
 
-    def extract_step_numbers(self, segment_steps) -> list[int]:
-        return self.utils.extract_step_numbers(segment_steps)
\ No newline at end of file
+        coarse_key = stage_key(
+            "coarse",
+            step_digest.hexdigest(),
+            stage_parameters(self.coarse_splitter),
+        )
+
+        segments_key = stage_key(
+            "segments",
+            coarse_key,
+            summaries,
+            stage_parameters(self.embedder),
+            stage_parameters(self.pelt_segmenter),
+        )
+
+        return coarse_key, segments_key
+
+    def _split_coarse(self, steps, stage_cache, cache_key):
+        cached = stage_cache.load("coarse", cache_key) if stage_cache is not None else None
+
+        if cached is not None and int(cached["lengths"].sum()) == len(steps):
+            coarse_segments = []
+            start = 0
+
+            for length in cached["lengths"].tolist():
+                coarse_segments.append(steps[start:start + length])
+                start += length
+
+            return coarse_segments
+
+        coarse_segments = self.coarse_splitter.split(steps)
+
+        if stage_cache is not None:
+            stage_cache.save(
+                "coarse",
+                cache_key,
+                lengths = np.asarray([len(segment) for segment in coarse_segments], dtype=np.int64),
+            )
+
+        return coarse_segments
+
+    def _segment_coarse_segments(self, coarse_segments, stage_cache=None, cache_key=None):
+        """
+        Embeds and PELT-segments every coarse segment, on a process pool when
+        the trace is large enough. Either way the micro segments come back in
+        trace order, so segment indexes stay deterministic. Only the change
+        points and micro segment means are cached; the embedding matrices are
+        larger than the trace and nothing after PELT reads them.
+        """
+
+        cached = stage_cache.load("segments", cache_key) if stage_cache is not None else None
+
+        if cached is not None and len(cached["change_point_counts"]) == len(coarse_segments):
+            return self.pelt_segmenter.assemble(coarse_segments, unpack_segmentations(cached))
+
+        total_steps = sum(len(segment) for segment in coarse_segments)
+
+        if self.segment_workers > 1 and len(coarse_segments) > 1 and total_steps >= PARALLEL_SEGMENT_MIN_STEPS:
+            segment_columns = [self.embedder.step_columns(segment) for segment in coarse_segments]
+            segmentations = embed_and_segment_in_pool(
+                self.embedder,
+                self.pelt_segmenter,
+                segment_columns,
+                self.segment_workers,
+            )
+        else:
+            self.embedder.clear_cache()
+            segmentations = [
+                self.pelt_segmenter.segment_embedding(self.embedder.embed_steps(segment))
+                for segment in coarse_segments
+            ]
+
+        if stage_cache is not None:
+            stage_cache.save("segments", cache_key, **pack_segmentations(segmentations, self.embedder.embedding_dim))
+
+        return self.pelt_segmenter.assemble(coarse_segments, segmentations)
+
+    def micro_feature_record(self, segment) -> dict:
+        """
+        What persisting a micro segment needs from it, without its steps.
+        """
+
+        steps = segment["steps"]
+        step_numbers = steps.known_step_numbers()
+
+        return {
+            "segmentIndex": segment.get("segmentIndex"),
+            "name": segment.get("name"),
+            "description": segment.get("description"),
+            "components": segment.get("components", []),
+            "stepCount": len(steps),
+            "startStep": int(step_numbers.min()) if len(step_numbers) else None,
+            "endStep": int(step_numbers.max()) if len(step_numbers) else None,
+        }
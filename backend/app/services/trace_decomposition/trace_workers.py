@@ -0,0 +1,64 @@
+import json
+
+from app.services.sabo_gen.trace_index import TraceStepIndex
+from app.services.trace_decomposition.trace_decomposition import TraceDecomposition
+
+# Decomposition and operation summaries shared by every trace a worker handles.
+_worker_decomposition = None
+_worker_operation_nodes = None
+
+
+def _init_trace_decomposition_worker(operation_nodes: dict, segment_workers: int = 1):
+    global _worker_decomposition, _worker_operation_nodes
+    _worker_decomposition = TraceDecomposition(None, segment_workers=segment_workers)
+    _worker_operation_nodes = operation_nodes
+
+
+def decompose_trace_file(project_id: int, trace_path: str) -> dict:
+    """
+    Decomposes one trace without AI inside a worker process. Micro segments
+    come back as compact records, so only what the DB writer persists
+    crosses the process boundary.
+    """
+
+    decomposition = _worker_decomposition
+    step_index = TraceStepIndex(trace_path)
+
+    if decomposition.should_stream(step_index.total_steps):
+        micro_features = []
+
+        hierarchical_clusters = decomposition.decompose_trace_stream(
+            step_index = step_index,
+            project_id = project_id,
+            summarizer = None,
+            allow_ai = False,
+            node_lookup = {},
+            collect_nodes_with_ancestors = None,
+            persist_micro_segments = lambda segments: micro_features.extend(
+                decomposition.micro_feature_record(segment) for segment in segments
+            ),
+            operation_nodes = _worker_operation_nodes,
+        )
+
+        return {
+            "micro_features": micro_features,
+            "hierarchical_clusters": hierarchical_clusters,
+        }
+
+    with open(trace_path, "r", encoding="utf-8") as f:
+        trace_data = json.load(f)
+
+    result = decomposition.decompose_trace(
+        trace_data = trace_data,
+        project_id = project_id,
+        summarizer = None,
+        allow_ai = False,
+        node_lookup = {},
+        collect_nodes_with_ancestors = None,
+        operation_nodes = _worker_operation_nodes,
+    )
+
+    return {
+        "micro_features": [decomposition.micro_feature_record(segment) for segment in result["micro_segments"]],
+        "hierarchical_clusters": result["hierarchical_clusters"],
+    }
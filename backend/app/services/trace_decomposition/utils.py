@@ -1,26 +1,7 @@
-from typing import Any
-
-
 class TraceDecompositionUtils:
     def __init__(self):
         pass
 
-    def get_step_properties(self, step):
-        if not isinstance(step, dict):
-            return {}
-
-        direct_properties = step.get("properties")
-        if isinstance(direct_properties, dict):
-            return direct_properties
-
-        data = step.get("data")
-        if isinstance(data, dict):
-            nested_properties = data.get("properties")
-            if isinstance(nested_properties, dict):
-                return nested_properties
-
-        return {}
-    
     def summary_to_text(self, summary):
         if isinstance(summary, str):
             return summary
@@ -36,20 +17,3 @@ class TraceDecompositionUtils:
             return float(value)
         except (TypeError, ValueError):
             return default
-        
-    def extract_step_numbers(self, segment_steps) -> list[int]:
-        step_numbers = []
-
-        for step in segment_steps:
-            properties = self.get_step_properties(step)
-            value: Any = properties.get("step")
-
-            if isinstance(value, (int, float)):
-                step_numbers.append(int(value))
-            elif isinstance(value, str):
-                stripped = value.strip()
-                if stripped.isdigit():
-                    step_numbers.append(int(stripped))
-
-        return step_numbers
-        
\ No newline at end of file
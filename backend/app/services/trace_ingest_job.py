@@ -0,0 +1,398 @@
+import hashlib
+import heapq
+import json
+import os
+import shutil
+import uuid
+from concurrent.futures import as_completed
+from pathlib import Path
+
+from sqlalchemy.exc import IntegrityError
+
+from app.core.concurrency import TRACE_INGEST_WORKERS, create_process_pool
+from app.core.database import SessionLocal
+from app.core.exceptions import TraceValidationError
+from app.core.storage_paths import HOST_DATA_PATH
+from app.repositories.graph_repo import GraphRepository
+from app.repositories.trace_job_repo import TraceJobRepository
+from app.repositories.trace_repo import TraceRepository
+from app.services.sabo_gen.dynamic_builder import DynamicGraphBuilder
+from app.services.sabo_gen.trace_index import sidecar_paths_for, write_step_index
+from app.services.sabo_gen.timestamps import timestamp_to_epoch_us
+from app.services.sabo_gen.trace_gen import TraceParser, SequenceBuilder, partition_entries
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Below this many entries, starting a nested pool costs more than it saves.
+PARALLEL_PARTITION_MIN_ENTRIES = 20000
+
+# Operation lookup shared by every trace a worker process resolves, and how
+# many processes each trace may use for its thread partitions.
+_worker_static_lookup: dict = {}
+_worker_partition_budget: int = 1
+
+
+def decode_trace_content(content_bytes: bytes) -> str:
+    try:
+        return content_bytes.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        try:
+            return content_bytes.decode('cp1252')
+        except UnicodeDecodeError as e:
+            raise TraceValidationError("Trace file encoding must be UTF-8 or Windows-1252") from e
+
+
+def _sequence_partition(entries, project_id: int, static_lookup: dict):
+    seq_builder = SequenceBuilder()
+    seq_builder.process_entries(entries)
+
+    dynamic_builder = DynamicGraphBuilder(seq_builder.get_sequence(), project_id, static_lookup=static_lookup)
+    return dynamic_builder.resolve_steps()
+
+
+def _resolve_partition(project_id: int, entries) -> list:
+    return _sequence_partition(entries, project_id, _worker_static_lookup)
+
+
+def _merge_keys(resolved_steps):
+    # Steps without a parseable timestamp keep the time of the step before
+    # them, so they stay in place within their thread.
+    keys = []
+    last_epoch = 0
+    for resolved in resolved_steps:
+        step = resolved["step"]
+        epoch = step.get("epochMicros")
+        if epoch is None:
+            epoch = timestamp_to_epoch_us(step.get("timestamp"))
+        if epoch is not None:
+            last_epoch = epoch
+        keys.append((last_epoch, step.get("lineNumber", 0)))
+
+    return keys
+
+
+def merge_partitions(partitions):
+    """
+    Merges per-thread resolved steps back into one sequence ordered by
+    timestamp, then by line number, and renumbers the steps.
+    """
+
+    keyed_partitions = [
+        [(key, index, position, resolved) for position, (key, resolved) in enumerate(zip(_merge_keys(partition), partition))]
+        for index, partition in enumerate(partitions)
+    ]
+
+    merged = [item[3] for item in heapq.merge(*keyed_partitions, key=lambda item: item[:3])]
+
+    for step_number, resolved in enumerate(merged, start=1):
+        resolved["step"]["step"] = step_number
+
+    return merged
+
+
+def build_dynamic_trace(content_bytes: bytes, project_id: int, static_lookup: dict, partition_workers: int = 1) -> dict:
+    content_str = decode_trace_content(content_bytes)
+
+    parser = TraceParser()
+    entries = parser.parse_file(content_str)
+
+    if not entries:
+        raise TraceValidationError("No valid trace entries were found in uploaded file")
+
+    partitions = list(partition_entries(entries).values())
+    del entries
+
+    if partition_workers > 1 and len(partitions) > 1 and sum(len(partition) for partition in partitions) >= PARALLEL_PARTITION_MIN_ENTRIES:
+        worker_count = min(partition_workers, len(partitions))
+        with create_process_pool(worker_count, _init_trace_worker, (static_lookup,)) as pool:
+            resolved_partitions = list(pool.map(_resolve_partition, [project_id] * len(partitions), partitions))
+    else:
+        resolved_partitions = [_sequence_partition(partition, project_id, static_lookup) for partition in partitions]
+
+    resolved_steps = merge_partitions(resolved_partitions)
+
+    if not resolved_steps:
+        raise TraceValidationError("Trace sequence is empty after parsing")
+
+    trace_sequence = [resolved["step"] for resolved in resolved_steps]
+    dynamic_builder = DynamicGraphBuilder(trace_sequence, project_id, static_lookup=static_lookup)
+    dynamic_builder.build_graph(resolved_steps)
+
+    return {
+        "dynamic_graph": dynamic_builder.dynamic_graph,
+        "total_steps": len(trace_sequence),
+        "resolved_steps": dynamic_builder.resolution_counts.get("resolved", 0),
+        "ambiguous_steps": dynamic_builder.resolution_counts.get("ambiguous", 0),
+        "unresolved_steps": dynamic_builder.resolution_counts.get("unresolved", 0),
+    }
+
+
+def fingerprint_operation_lookup(static_lookup: dict) -> str:
+    # Resolution only depends on the operation lookup, so it stands in for
+    # the version of the project graph.
+    payload = json.dumps(static_lookup, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def hash_trace_content(spool_path: str, lookup_fingerprint: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(lookup_fingerprint.encode('utf-8'))
+
+    with open(spool_path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _init_trace_worker(static_lookup: dict, partition_budget: int = 1):
+    global _worker_static_lookup, _worker_partition_budget
+    _worker_static_lookup = static_lookup
+    _worker_partition_budget = partition_budget
+
+
+def _resolve_spooled_trace(project_id: int, spool_path: str, temp_path: str, trace_path: str) -> dict:
+    """
+    Runs inside a worker process: parses and resolves one spooled trace,
+    writes the dynamic graph to a temporary file next to its final location
+    and writes the step index sidecars for it. Only the small counters travel
+    back to the writer.
+    """
+
+    with open(spool_path, 'rb') as f:
+        content_bytes = f.read()
+
+    if not content_bytes:
+        raise TraceValidationError("Uploaded trace file is empty")
+
+    result = build_dynamic_trace(content_bytes, project_id, _worker_static_lookup, _worker_partition_budget)
+
+    dynamic_graph = result.pop("dynamic_graph")
+
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(dynamic_graph, f, indent=2)
+
+    write_step_index(dynamic_graph, trace_path)
+
+    return result
+
+
+def _describe_trace(result: dict) -> str:
+    return (
+        f"{result['total_steps']} steps | "
+        f"resolved {result['resolved_steps']} | "
+        f"ambiguous {result['ambiguous_steps']} | "
+        f"unresolved {result['unresolved_steps']}"
+    )
+
+
+def _remove_quietly(path: Path):
+    try:
+        if path.exists():
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def run_trace_ingest_job(job_id: int, traces_dir: str, max_workers: int = TRACE_INGEST_WORKERS):
+    """
+    Resolves every file of an ingest job across a process pool. Files are
+    keyed by content hash first: a hash that already has a stored blob, or
+    that appears twice in the job, is resolved at most once. Workers only
+    parse and resolve; this function is the single writer that creates the
+    trace rows and records per-file status as results come back.
+    """
+
+    with SessionLocal() as db:
+        job_repo = TraceJobRepository(db)
+        trace_repo = TraceRepository(db)
+
+        job = job_repo.get_job_by_id(job_id)
+        if not job:
+            return
+
+        project_id = job.project_id
+        traces_path = Path(traces_dir)
+        pending_files = [job_file for job_file in job.files if job_file.status == "queued"]
+
+        try:
+            job_repo.mark_job_status(job, "processing")
+
+            if pending_files:
+                static_lookup = GraphRepository(db).get_operation_map(project_id)
+                lookup_fingerprint = fingerprint_operation_lookup(static_lookup)
+                job_repo.mark_files_processing(pending_files)
+
+                files_by_hash = {}
+                for job_file in pending_files:
+                    try:
+                        content_hash = hash_trace_content(job_file.spool_path, lookup_fingerprint)
+                    except OSError as e:
+                        job_repo.fail_file(job, job_file, str(e))
+                        continue
+                    files_by_hash.setdefault(content_hash, []).append(job_file)
+
+                hashes_to_resolve = {}
+                for content_hash, job_files in files_by_hash.items():
+                    # Locked so a trace deletion cannot release the blob and unlink its files meanwhile.
+                    blob = trace_repo.get_blob_by_hash(project_id, content_hash, for_update=True)
+                    if blob and Path(blob.path).exists():
+                        for job_file in job_files:
+                            _attach_trace(db, job_repo, trace_repo, job, job_file, blob)
+                    else:
+                        db.commit()
+                        hashes_to_resolve[content_hash] = job_files
+
+                if hashes_to_resolve:
+                    worker_count = min(max_workers, len(hashes_to_resolve))
+                    # Cores not taken by whole traces go to thread partitions.
+                    partition_budget = max(1, max_workers // worker_count)
+
+                    with create_process_pool(worker_count, _init_trace_worker, (static_lookup, partition_budget)) as pool:
+                        futures = {}
+
+                        for content_hash, job_files in hashes_to_resolve.items():
+                            temp_path = traces_path / f".{content_hash}.{uuid.uuid4().hex}.tmp"
+                            trace_path = traces_path / f"{content_hash}.json"
+                            future = pool.submit(
+                                _resolve_spooled_trace,
+                                project_id,
+                                job_files[0].spool_path,
+                                str(temp_path),
+                                str(trace_path),
+                            )
+                            futures[future] = (content_hash, job_files, temp_path, trace_path)
+
+                        for future in as_completed(futures):
+                            content_hash, job_files, temp_path, trace_path = futures[future]
+                            _write_blob_result(
+                                db, job_repo, trace_repo, job, job_files,
+                                content_hash, future, temp_path, trace_path,
+                            )
+
+            job_repo.mark_job_status(job, "failed" if job.failed_files == job.total_files else "completed")
+
+        except Exception as e:
+            db.rollback()
+            for job_file in job.files:
+                if job_file.status in ("queued", "processing"):
+                    job_file.status = "failed"
+                    job_file.error = f"Trace ingest job failed: {str(e)[:500]}"
+            job_repo.mark_job_status(job, "failed")
+
+        finally:
+            if pending_files:
+                shutil.rmtree(Path(pending_files[0].spool_path).parent, ignore_errors=True)
+
+
+def fail_interrupted_trace_ingest_jobs():
+    """
+    Fails the jobs a previous API process left queued or processing. Jobs only run as background tasks
+    of the process that accepted them, so at startup none of them can still be running, and every spool
+    directory and temporary trace file left on disk is stale.
+    """
+
+    with SessionLocal() as db:
+        job_repo = TraceJobRepository(db)
+
+        for job in job_repo.get_unfinished_jobs():
+            job_repo.fail_unfinished_job(job, "Trace ingest was interrupted by a server restart. Upload the trace again.")
+
+    for spool_root in HOST_DATA_PATH.glob("*/traces/.spool"):
+        shutil.rmtree(spool_root, ignore_errors=True)
+
+    for temp_path in HOST_DATA_PATH.glob("*/traces/.*.tmp"):
+        _remove_quietly(temp_path)
+
+
+def _attach_trace(db, job_repo, trace_repo, job, job_file, blob):
+    try:
+        trace = trace_repo.create_trace(
+            project_id=job.project_id,
+            name=job_file.trace_name,
+            description=_describe_trace({
+                "total_steps": blob.total_steps,
+                "resolved_steps": blob.resolved_steps,
+                "ambiguous_steps": blob.ambiguous_steps,
+                "unresolved_steps": blob.unresolved_steps,
+            }),
+            trace_seq_path=blob.path,
+            total_steps=blob.total_steps,
+            resolved_steps=blob.resolved_steps,
+            ambiguous_steps=blob.ambiguous_steps,
+            unresolved_steps=blob.unresolved_steps,
+            commit=False,
+        )
+        trace_repo.acquire_blob(blob)
+
+        job_repo.complete_file(job, job_file, trace.id, commit=True)
+    except Exception as e:
+        db.rollback()
+        job_repo.fail_file(job, job_file, str(e))
+
+
+def _discard_blob_files(db, trace_repo, project_id: int, content_hash: str, temp_path: Path, trace_path: Path):
+    _remove_quietly(temp_path)
+
+    # Another job may have stored the same content in the meantime. The count is checked under the row
+    # lock, which is held until the files are gone, so nobody attaches to them in between.
+    blob = trace_repo.get_blob_by_hash(project_id, content_hash, for_update=True)
+    if blob and blob.ref_count:
+        db.commit()
+        return
+
+    if blob:
+        trace_repo.delete_blob(blob)
+
+    for path in [trace_path, *sidecar_paths_for(trace_path)]:
+        _remove_quietly(path)
+
+    db.commit()
+
+
+def _write_blob_result(db, job_repo, trace_repo, job, job_files, content_hash: str, future, temp_path: Path, trace_path: Path):
+    try:
+        result = future.result()
+    except Exception as e:
+        _discard_blob_files(db, trace_repo, job.project_id, content_hash, temp_path, trace_path)
+        for job_file in job_files:
+            job_repo.fail_file(job, job_file, str(e))
+        return
+
+    try:
+        os.replace(temp_path, trace_path)
+
+        try:
+            blob = trace_repo.save_blob(
+                project_id=job.project_id,
+                content_hash=content_hash,
+                path=str(trace_path),
+                total_steps=result["total_steps"],
+                resolved_steps=result["resolved_steps"],
+                ambiguous_steps=result["ambiguous_steps"],
+                unresolved_steps=result["unresolved_steps"],
+                commit=True,
+            )
+        except IntegrityError:
+            # A concurrent job registered the same content first.
+            db.rollback()
+            blob = trace_repo.get_blob_by_hash(job.project_id, content_hash)
+            if not blob:
+                raise
+    except Exception as e:
+        db.rollback()
+        _discard_blob_files(db, trace_repo, job.project_id, content_hash, temp_path, trace_path)
+        for job_file in job_files:
+            job_repo.fail_file(job, job_file, str(e))
+        return
+
+    for job_file in job_files:
+        _attach_trace(db, job_repo, trace_repo, job, job_file, blob)
+
+    # The blob may be gone already if every attach failed and a deletion released it; the check under
+    # the lock in _discard_blob_files decides.
+    if not any(job_file.status == "completed" for job_file in job_files):
+        _discard_blob_files(db, trace_repo, job.project_id, content_hash, temp_path, trace_path)
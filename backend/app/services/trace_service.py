@@ -1,7 +1,8 @@
 import json
 import os
+import shutil
 from pathlib import Path
-from datetime import datetime
+from typing import List
 import uuid
 from sqlalchemy.orm import Session
 from fastapi import UploadFile
@@ -11,20 +12,22 @@ from app.core.exceptions import TraceValidationError
 from app.models.graph import Node
 from app.models.feature import Feature
 
-# Import your custom modules
-from app.services.sabo_gen.trace_gen import TraceParser, SequenceBuilder
-from app.services.sabo_gen.dynamic_builder import DynamicGraphBuilder
+from app.services.sabo_gen.trace_index import TraceStepIndex, sidecar_paths_for
 from app.repositories.trace_repo import TraceRepository
+from app.repositories.trace_job_repo import TraceJobRepository
 from app.repositories.feature_repo import FeatureRepository
 from app.services.graph_service import GraphService
 
 READ_CHUNK_SIZE = 1024 * 1024
+DEFAULT_STEP_PAGE_SIZE = 500
+MAX_STEP_PAGE_SIZE = 5000
 
 class TraceService:
     def __init__(self, db: Session):
         self.db = db
         self.repo = TraceRepository(db)
         self.repo_feature = FeatureRepository(db)
+        self.job_repo = TraceJobRepository(db)
         self.graph_service = GraphService(db)
 
     def get_project_traces(self, project_id: int):
@@ -49,107 +52,127 @@ class TraceService:
         except Exception as e:
             raise RuntimeError(f"Failed to read trace file: {str(e)}")
 
-    def process_trace_file(self, project_id: int, file: UploadFile):
-        if not file.filename:
-            raise TraceValidationError("Uploaded trace file must have a filename")
+    def get_step_index(self, trace_id: int) -> TraceStepIndex:
+        trace = self.repo.get_trace_by_id(trace_id)
+        if not trace:
+            raise FileNotFoundError("Trace not found in database.")
 
-        project_dir = HOST_DATA_PATH / str(project_id)
-        traces_dir = project_dir / "traces"
-        traces_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            return TraceStepIndex(trace.trace_seq_path)
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Failed to read trace step index: {str(e)}")
+
+    def get_trace_steps(self, trace_id: int, start: int = 1, end: int | None = None, page_size: int = DEFAULT_STEP_PAGE_SIZE):
+        """
+        Returns the steps numbered [start, end), at most page_size of them.
+        next_cursor is the step number to pass as start for the next page.
+        """
+
+        index = self.get_step_index(trace_id)
+        page_size = self._clamp_page_size(page_size)
+
+        first, last = index.positions_for_step_range(start, end)
+        page_end = min(last, first + page_size)
+        steps = index.read_range(first, page_end)
+
+        return {
+            "total_steps": index.total_steps,
+            "matched_steps": last - first,
+            "steps": steps,
+            "next_cursor": int(index.steps[page_end]) if page_end < last else None,
+        }
+
+    def get_trace_steps_in_window(self, trace_id: int, start_us: int | None = None, end_us: int | None = None, cursor: int = 0, page_size: int = DEFAULT_STEP_PAGE_SIZE):
+        """
+        Returns the steps whose timestamp falls in [start_us, end_us), in
+        epoch microseconds. cursor is the offset into the matching steps.
+        """
+
+        index = self.get_step_index(trace_id)
+        page_size = self._clamp_page_size(page_size)
+        cursor = max(0, int(cursor or 0))
+
+        positions = index.positions_for_time_window(start_us, end_us)
+        page_positions = positions[cursor:cursor + page_size]
+        steps = index.read_positions(page_positions)
+        first_us, last_us = index.time_bounds()
+
+        return {
+            "total_steps": index.total_steps,
+            "matched_steps": int(len(positions)),
+            "steps": steps,
+            "next_cursor": cursor + page_size if cursor + page_size < len(positions) else None,
+            "first_epoch_us": first_us,
+            "last_epoch_us": last_us,
+        }
+
+    def _clamp_page_size(self, page_size):
+        try:
+            page_size = int(page_size)
+        except (TypeError, ValueError):
+            page_size = DEFAULT_STEP_PAGE_SIZE
 
-        timestamp_str = str(int(datetime.now().timestamp()))
-        safe_name = Path(file.filename).stem.replace(" ", "_")
+        return max(1, min(page_size, MAX_STEP_PAGE_SIZE))
 
-        trace_filename = f"{safe_name}_{timestamp_str}.json"
-        trace_path = traces_dir / trace_filename
-        temp_path = traces_dir / f".{trace_filename}.{uuid.uuid4().hex}.tmp"
+    def get_ingest_job(self, job_id: int):
+        return self.job_repo.get_job_by_id(job_id)
 
-        content_bytes = bytearray()
-        total_size = 0
+    def get_project_ingest_jobs(self, project_id: int):
+        return self.job_repo.get_jobs_by_project_id(project_id)
 
-        while True:
-            chunk = file.file.read(READ_CHUNK_SIZE)
-            if not chunk:
-                break
+    def get_traces_dir(self, project_id: int) -> Path:
+        traces_dir = HOST_DATA_PATH / str(project_id) / "traces"
+        traces_dir.mkdir(parents=True, exist_ok=True)
+        return traces_dir
 
-            total_size += len(chunk)
-            content_bytes.extend(chunk)
+    def spool_trace_files(self, project_id: int, files: List[UploadFile]):
+        """
+        Copies the uploaded trace files to a per-job spool directory and
+        registers them on a new ingest job. Parsing and resolution happen later
+        in run_trace_ingest_job, so the request returns as soon as the bytes
+        are on disk.
+        """
 
-        if total_size == 0:
-            raise TraceValidationError("Uploaded trace file is empty")
+        job = self.job_repo.create_job(project_id, commit=False)
+        spool_dir = self.get_traces_dir(project_id) / ".spool" / str(job.id)
+        spool_dir.mkdir(parents=True, exist_ok=True)
 
         try:
-            content_str = bytes(content_bytes).decode('utf-8-sig')
-        except UnicodeDecodeError:
-            try:
-                content_str = bytes(content_bytes).decode('cp1252')
-            except UnicodeDecodeError as e:
-                raise TraceValidationError("Trace file encoding must be UTF-8 or Windows-1252") from e
-
-        parser = TraceParser()
-        entries = parser.parse_file(content_str)
+            for index, file in enumerate(files, start=1):
+                if not file.filename:
+                    raise TraceValidationError("Uploaded trace file must have a filename")
 
-        if not entries:
-            raise TraceValidationError("No valid trace entries were found in uploaded file")
+                safe_name = Path(file.filename).stem.replace(" ", "_")
+                spool_path = spool_dir / f"{index}_{uuid.uuid4().hex}.log"
 
-        seq_builder = SequenceBuilder()
-        seq_builder.process_entries(entries)
-        trace_sequence = seq_builder.get_sequence()
+                total_size = 0
+                with open(spool_path, 'wb') as spool_file:
+                    while True:
+                        chunk = file.file.read(READ_CHUNK_SIZE)
+                        if not chunk:
+                            break
 
-        if not trace_sequence:
-            raise TraceValidationError("Trace sequence is empty after parsing")
+                        total_size += len(chunk)
+                        spool_file.write(chunk)
 
-        dynamic_builder = DynamicGraphBuilder(trace_sequence, project_id, self.db)
-        dynamic_builder.build_graph()
+                if total_size == 0:
+                    raise TraceValidationError(f"Uploaded trace file '{file.filename}' is empty")
 
-        resolved_steps = dynamic_builder.resolution_counts.get("resolved", 0)
-        ambiguous_steps = dynamic_builder.resolution_counts.get("ambiguous", 0)
-        unresolved_steps = dynamic_builder.resolution_counts.get("unresolved", 0)
-        total_steps = len(trace_sequence)
-
-        file_promoted = False
-        try:
-            with open(temp_path, 'w', encoding='utf-8') as f:
-                json.dump(dynamic_builder.dynamic_graph, f, indent=2)
-
-            trace = self.repo.create_trace(
-                project_id=project_id,
-                name=safe_name,
-                description=(
-                    f"{total_steps} steps | "
-                    f"resolved {resolved_steps} | "
-                    f"ambiguous {ambiguous_steps} | "
-                    f"unresolved {unresolved_steps}"
-                ),
-                trace_seq_path=str(trace_path),
-                total_steps=total_steps,
-                resolved_steps=resolved_steps,
-                ambiguous_steps=ambiguous_steps,
-                unresolved_steps=unresolved_steps,
-                commit=False
-            )
-
-            os.replace(temp_path, trace_path)
-            file_promoted = True
+                self.job_repo.add_job_file(
+                    job,
+                    filename=file.filename,
+                    trace_name=safe_name,
+                    spool_path=str(spool_path),
+                )
 
             self.db.commit()
-            self.db.refresh(trace)
-            return trace
+            self.db.refresh(job)
+            return job
         except Exception:
             self.db.rollback()
-
-            if temp_path.exists():
-                try:
-                    os.remove(temp_path)
-                except OSError:
-                    pass
-
-            if file_promoted and trace_path.exists():
-                try:
-                    os.remove(trace_path)
-                except OSError:
-                    pass
-
+            shutil.rmtree(spool_dir, ignore_errors=True)
             raise
     
     def delete_trace(self, trace_id: int):
@@ -158,11 +181,20 @@ class TraceService:
             raise FileNotFoundError("Trace not found in database.")
         
         file_path = Path(trace.trace_seq_path)
-        if file_path.exists():
-            try:
-                os.remove(file_path)
-            except Exception as e:
-                raise RuntimeError(f"Failed to delete trace file: {str(e)}")
+
+        # Traces sharing a blob keep its files until the last one is deleted.
+        # The blob row stays locked until delete_trace commits, so no upload attaches to files being removed.
+        blob = self.repo.get_blob_by_path(trace.project_id, trace.trace_seq_path, for_update=True)
+        remove_files = blob is None or self.repo.release_blob(blob) == 0
+
+        if remove_files:
+            for path in [file_path, *sidecar_paths_for(file_path)]:
+                if path.exists():
+                    try:
+                        os.remove(path)
+                    except Exception as e:
+                        self.db.rollback()
+                        raise RuntimeError(f"Failed to delete trace file: {str(e)}")
         
         self.repo.delete_trace(trace_id)
     
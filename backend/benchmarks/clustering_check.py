@@ -0,0 +1,89 @@
+"""
+Checks that functional clustering keeps a block of functions that always run together in one cluster,
+in both the exact and the approximate (MinHash/LSH) mode. Run from the backend directory:
+
+    python -m benchmarks.clustering_check --block-sizes 250 1000
+"""
+
+import argparse
+import random
+import sys
+
+from app.services.func_decomp_service import FunctionalDecompositionService
+from app.services.functional_decomposition.agglomerative import AgglomerativeDecomposition
+
+DEFAULT_BLOCK_SIZES = (250, 1000)
+
+
+def generate_units(block_size: int, background_functions: int, unit_count: int, block_units: int, seed: int):
+    """
+    Execution units over background functions drawn from groups of 50, plus block_size functions that
+    appear in exactly the same block_units units.
+    """
+
+    rnd = random.Random(seed)
+    group_count = max(1, background_functions // 50)
+    units = []
+
+    for _ in range(unit_count):
+        groups = rnd.sample(range(group_count), min(3, group_count))
+        functions = {f"f{group * 50 + rnd.randrange(50)}" for group in groups for _ in range(30)}
+        functions |= {f"f{rnd.randrange(background_functions)}" for _ in range(20)}
+        units.append({"functions": functions})
+
+    block = {f"block{index}" for index in range(block_size)}
+    for unit in rnd.sample(units, block_units):
+        unit["functions"] |= block
+
+    return units, block
+
+
+def block_cluster_count(clusters, all_functions, block) -> int:
+    return sum(
+        1
+        for indices in clusters.values()
+        if any(all_functions[index] in block for index in indices)
+    )
+
+
+def check_block(block_size: int, args) -> bool:
+    units, block = generate_units(block_size, args.background, args.units, args.block_units, args.seed)
+
+    # build_feature_matrix reads nothing from the service instance.
+    X, all_functions = FunctionalDecompositionService.build_feature_matrix(None, units)
+    decomposition = AgglomerativeDecomposition(None)
+    X_weighted, _idf_scores = decomposition._frequency_filtering(X)
+
+    passed = True
+    for mode, cluster in (
+        ("exact", decomposition._cluster_traces),
+        ("approximate", decomposition._cluster_traces_approximate),
+    ):
+        count = block_cluster_count(cluster(X_weighted), all_functions, block)
+        passed = passed and count == 1
+        print(f"{block_size} identical functions, {mode}: {count} cluster(s)", file = sys.stderr)
+
+    return passed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description = "Check that identical functions stay in one cluster.")
+    parser.add_argument("--block-sizes", type = int, nargs = "+", default = list(DEFAULT_BLOCK_SIZES), help = "sizes of the identical block")
+    parser.add_argument("--background", type = int, default = 2000, help = "background functions")
+    parser.add_argument("--units", type = int, default = 300, help = "execution units")
+    parser.add_argument("--block-units", type = int, default = 40, help = "units the block appears in")
+    parser.add_argument("--seed", type = int, default = 0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = [check_block(block_size, args) for block_size in args.block_sizes]
+
+    if not all(results):
+        print("Identical functions were split across clusters.", file = sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
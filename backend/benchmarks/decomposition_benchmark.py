@@ -0,0 +1,257 @@
+"""
+Times and memory-profiles every stage of the trace decomposition pipeline on synthetic traces and writes
+a JSON report. Run from the backend directory:
+
+    python -m benchmarks.decomposition_benchmark --steps 10000 100000 1000000 --output report.json
+    python -m benchmarks.decomposition_benchmark --steps 10000 --compare report.json
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+from app.services.trace_decomposition.trace_decomposition import TraceDecomposition
+from benchmarks.synthetic_traces import generate_static_graph, generate_trace, summary_map
+
+REPORT_VERSION = 1
+
+STAGES = ("preprocess", "coarse_split", "embed", "pelt", "enrich", "cluster")
+
+DEFAULT_STEP_COUNTS = (10_000, 100_000, 1_000_000)
+
+# Stage caches are keyed by project; the benchmark never touches them.
+BENCHMARK_PROJECT_ID = 0
+
+
+class StageRecorder:
+    """
+    Accumulates wall time per stage and, when tracemalloc is running, the peak memory a stage allocated on
+    top of what was live when it started.
+    """
+
+    def __init__(self, trace_memory: bool):
+        self.trace_memory = trace_memory
+        self.stages = {
+            stage: {"seconds": 0.0, "peak_bytes": 0}
+            for stage in STAGES
+        }
+
+    @contextmanager
+    def measure(self, stage: str):
+        record = self.stages[stage]
+
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            start_bytes = tracemalloc.get_traced_memory()[0]
+
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            record["seconds"] += time.perf_counter() - started
+
+            if self.trace_memory:
+                peak_bytes = tracemalloc.get_traced_memory()[1]
+                record["peak_bytes"] = max(record["peak_bytes"], peak_bytes - start_bytes)
+
+
+def run_pipeline(trace_data: dict, operation_nodes: dict, recorder: StageRecorder) -> dict:
+    """
+    Runs the stages of TraceDecomposition.decompose_trace one by one, without AI, worker processes or the
+    stage cache. Embedding and PELT alternate per coarse segment as in the pipeline, so only one embedding
+    matrix is alive at a time; their times add up and their peaks are the largest of any coarse segment.
+    """
+
+    decomposition = TraceDecomposition(None, segment_workers = 1, use_stage_cache = False)
+
+    with recorder.measure("preprocess"):
+        steps = decomposition.preprocessor.preprocess_trace(trace_data, BENCHMARK_PROJECT_ID, operation_nodes)
+
+    with recorder.measure("coarse_split"):
+        coarse_segments = decomposition.coarse_splitter.split(steps)
+
+    decomposition.embedder.clear_cache()
+    segmentations = []
+
+    for coarse_segment in coarse_segments:
+        with recorder.measure("embed"):
+            embedding = decomposition.embedder.embed_steps(coarse_segment)
+
+        with recorder.measure("pelt"):
+            segmentations.append(decomposition.pelt_segmenter.segment_embedding(embedding))
+
+        del embedding
+
+    with recorder.measure("pelt"):
+        pelt_segments = decomposition.pelt_segmenter.assemble(coarse_segments, segmentations)
+
+    with recorder.measure("enrich"):
+        enriched_segments = decomposition.enricher.enrich(
+            pelt_segments = pelt_segments,
+            summarizer = None,
+            allow_ai = False,
+            node_lookup = {},
+            collect_nodes_with_ancestors = None,
+        )
+
+    with recorder.measure("cluster"):
+        hierarchical_clusters = decomposition.serializer.serialize(
+            decomposition.clusterer.build(enriched_segments, summarizer = None, allow_ai = False)
+        )
+
+    return {
+        "resolved_steps": len(steps),
+        "coarse_segments": len(coarse_segments),
+        "micro_segments": len(enriched_segments),
+        "top_level_clusters": len(hierarchical_clusters),
+    }
+
+
+def benchmark_size(step_count: int, args, measure_memory: bool) -> dict:
+    static_graph = generate_static_graph(operation_count = args.operations, seed = args.seed)
+
+    started = time.perf_counter()
+    trace_data = generate_trace(
+        static_graph,
+        step_count,
+        max_depth = args.max_depth,
+        episode_count = args.episodes,
+        loop_probability = args.loop_probability,
+        episode_gap_us = args.gap_us,
+        seed = args.seed,
+    )
+    generation_seconds = time.perf_counter() - started
+
+    operation_nodes = summary_map(static_graph)
+
+    gc.collect()
+    timing = StageRecorder(trace_memory = False)
+    counts = run_pipeline(trace_data, operation_nodes, timing)
+
+    stages = {stage: {"seconds": round(record["seconds"], 6)} for stage, record in timing.stages.items()}
+
+    # Memory is measured in a second run: tracemalloc slows allocation-heavy stages too much to time them.
+    if measure_memory:
+        gc.collect()
+        memory = StageRecorder(trace_memory = True)
+
+        tracemalloc.start()
+        try:
+            run_pipeline(trace_data, operation_nodes, memory)
+        finally:
+            tracemalloc.stop()
+
+        for stage, record in memory.stages.items():
+            stages[stage]["peak_bytes"] = record["peak_bytes"]
+
+    return {
+        "steps": step_count,
+        "generation_seconds": round(generation_seconds, 6),
+        "total_seconds": round(sum(stage["seconds"] for stage in stages.values()), 6),
+        "counts": counts,
+        "stages": stages,
+    }
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare_reports(baseline: dict, current: dict) -> list:
+    """
+    Rows of (steps, stage, baseline seconds, current seconds, current / baseline) for every stage both
+    reports measured at the same trace length.
+    """
+
+    baseline_runs = {run["steps"]: run for run in baseline.get("runs", [])}
+    rows = []
+
+    for run in current.get("runs", []):
+        baseline_run = baseline_runs.get(run["steps"])
+        if baseline_run is None:
+            continue
+
+        for stage in (*STAGES, "total"):
+            if stage == "total":
+                before, after = baseline_run["total_seconds"], run["total_seconds"]
+            elif stage in baseline_run["stages"] and stage in run["stages"]:
+                before, after = baseline_run["stages"][stage]["seconds"], run["stages"][stage]["seconds"]
+            else:
+                continue
+
+            rows.append((run["steps"], stage, before, after, after / before if before else None))
+
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description = "Benchmark the trace decomposition pipeline on synthetic traces.")
+    parser.add_argument("--steps", type = int, nargs = "+", default = list(DEFAULT_STEP_COUNTS), help = "trace lengths to benchmark")
+    parser.add_argument("--operations", type = int, default = 400, help = "distinct operations in the static graph")
+    parser.add_argument("--max-depth", type = int, default = 8, help = "maximum call depth")
+    parser.add_argument("--episodes", type = int, default = 8, help = "runtime episodes per trace")
+    parser.add_argument("--loop-probability", type = float, default = 0.05, help = "chance per step of starting a repeated loop")
+    parser.add_argument("--gap-us", type = int, default = 2_000_000, help = "timestamp gap between episodes in microseconds")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--no-memory", action = "store_true", help = "skip the tracemalloc run")
+    parser.add_argument("--output", default = "decomposition-benchmark.json", help = "where to write the JSON report")
+    parser.add_argument("--compare", help = "an earlier report to compare stage times against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    report = {
+        "version": REPORT_VERSION,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "environment": environment(),
+        "parameters": {
+            "operations": args.operations,
+            "max_depth": args.max_depth,
+            "episodes": args.episodes,
+            "loop_probability": args.loop_probability,
+            "gap_us": args.gap_us,
+            "seed": args.seed,
+        },
+        "runs": [],
+    }
+
+    for step_count in args.steps:
+        run = benchmark_size(step_count, args, measure_memory = not args.no_memory)
+        report["runs"].append(run)
+
+        stage_times = ", ".join(f"{stage} {record['seconds']:.2f}s" for stage, record in run["stages"].items())
+        print(f"{step_count} steps: {run['total_seconds']:.2f}s ({stage_times})", file = sys.stderr)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Report written to {args.output}", file = sys.stderr)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+        for steps, stage, before, after, ratio in compare_reports(baseline, report):
+            change = f"{ratio:.2f}x" if ratio is not None else "n/a"
+            print(f"{steps:>9} {stage:<13} {before:10.3f}s -> {after:10.3f}s  {change}")
+
+
+if __name__ == "__main__":
+    main()
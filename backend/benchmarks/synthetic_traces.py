@@ -0,0 +1,243 @@
+import random
+import time
+
+from app.services.sabo_gen.config import (
+    EDGE_CONTAINS,
+    EDGE_DECLARES,
+    EDGE_ENCAPSULATES,
+    EDGE_ENCLOSES,
+    EDGE_INCLUDES,
+    EDGE_INVOKES,
+    NODE_ACTION,
+    NODE_FILE,
+    NODE_FOLDER,
+    NODE_OPERATION,
+    NODE_PROJECT,
+    NODE_SCOPE,
+    NODE_TYPE,
+)
+
+# 2024-02-01 10:00:00 UTC, the start of every synthetic trace.
+TRACE_START_US = 1_706_781_600_000_000
+
+
+def _node(node_id, label, properties, ai_summary=None):
+    return {
+        "data": {
+            "id": node_id,
+            "labels": [label],
+            "properties": properties,
+            "ai_summary": ai_summary,
+        }
+    }
+
+
+def _edge(source, target, label):
+    return {
+        "data": {
+            "source": source,
+            "target": target,
+            "label": label,
+        }
+    }
+
+
+def generate_static_graph(
+        operation_count: int = 200,
+        operations_per_type: int = 8,
+        types_per_scope: int = 5,
+        summary_ratio: float = 0.75,
+        seed: int = 0,
+    ) -> dict:
+    """
+    A static graph shaped like an exported SaboViz project: folders and files declaring namespaces, classes
+    and methods, with invokes edges between methods. Operations get an AI summary with probability
+    summary_ratio, like a partially summarized project.
+    """
+
+    rnd = random.Random(seed)
+
+    project_id = "project:///synthetic"
+    nodes = [_node(project_id, NODE_PROJECT, {"simpleName": "synthetic"})]
+    edges = []
+    operations = []
+
+    type_count = max(1, -(-operation_count // max(1, operations_per_type)))
+    scope_count = max(1, -(-type_count // max(1, types_per_scope)))
+
+    folder_id = "cpp+folder:///src"
+    nodes.append(_node(folder_id, NODE_FOLDER, {"simpleName": "src"}))
+    edges.append(_edge(project_id, folder_id, EDGE_INCLUDES))
+
+    for scope_index in range(scope_count):
+        scope_name = f"module{scope_index}"
+        scope_id = f"cpp+namespace:///{scope_name}"
+        file_id = f"cpp+file:///src/{scope_name}.cpp"
+
+        nodes.append(_node(file_id, NODE_FILE, {"simpleName": f"{scope_name}.cpp"}))
+        nodes.append(_node(scope_id, NODE_SCOPE, {"simpleName": scope_name}))
+        edges.append(_edge(folder_id, file_id, EDGE_CONTAINS))
+        edges.append(_edge(file_id, scope_id, EDGE_DECLARES))
+
+        for type_index in range(types_per_scope):
+            if len(operations) >= operation_count:
+                break
+
+            type_name = f"Component{scope_index}x{type_index}"
+            type_id = f"cpp+class:///{scope_name}/{type_name}"
+
+            nodes.append(_node(type_id, NODE_TYPE, {"simpleName": type_name}))
+            edges.append(_edge(scope_id, type_id, EDGE_ENCLOSES))
+
+            for operation_index in range(operations_per_type):
+                if len(operations) >= operation_count:
+                    break
+
+                operation_name = f"handleStep{operation_index}"
+                operation_id = f"cpp+method:///{scope_name}/{type_name}/{operation_name}(int,std::string)"
+
+                ai_summary = None
+                if rnd.random() < summary_ratio:
+                    ai_summary = {"description": f"{type_name}::{operation_name} processes requests in {scope_name}"}
+
+                nodes.append(_node(operation_id, NODE_OPERATION, {"simpleName": operation_name}, ai_summary))
+                edges.append(_edge(type_id, operation_id, EDGE_ENCAPSULATES))
+                operations.append(operation_id)
+
+    for operation_id in operations:
+        for callee_id in rnd.sample(operations, min(3, len(operations))):
+            if callee_id != operation_id:
+                edges.append(_edge(operation_id, callee_id, EDGE_INVOKES))
+
+    return {
+        "elements": {
+            "nodes": nodes,
+            "edges": edges,
+        }
+    }
+
+
+def summary_map(static_graph: dict) -> dict:
+    """
+    The operation summaries of a static graph, as GraphRepository.get_summary_map returns them.
+    """
+
+    summaries = {}
+
+    for node in static_graph["elements"]["nodes"]:
+        data = node["data"]
+        if NODE_OPERATION in data["labels"] and data.get("ai_summary"):
+            summaries[data["id"]] = data["ai_summary"]
+
+    return summaries
+
+
+def operation_ids(static_graph: dict) -> list:
+    return [
+        node["data"]["id"]
+        for node in static_graph["elements"]["nodes"]
+        if NODE_OPERATION in node["data"]["labels"]
+    ]
+
+
+def generate_trace(
+        static_graph: dict,
+        step_count: int,
+        max_depth: int = 8,
+        episode_count: int = 6,
+        episode_operations: int = 24,
+        loop_probability: float = 0.05,
+        max_loop_body: int = 4,
+        max_loop_repeats: int = 12,
+        step_interval_us: int = 40,
+        episode_gap_us: int = 2_000_000,
+        seed: int = 0,
+    ) -> dict:
+    """
+    A resolved dynamic trace over the operations of static_graph, shaped like DynamicGraphBuilder output.
+
+    The trace is split into episode_count episodes. Each one calls into its own working set of
+    episode_operations operations, starts and ends at depth 0, and is separated from the previous one by
+    a timestamp gap of episode_gap_us. Inside an episode, calls nest up to max_depth and, with
+    loop_probability per step, a body of up to max_loop_body calls repeats up to max_loop_repeats times.
+    Only action nodes are generated; the decomposition does not read trace edges.
+    """
+
+    rnd = random.Random(seed)
+    operations = operation_ids(static_graph)
+    if not operations:
+        raise ValueError("The static graph has no operations to trace")
+
+    episode_count = max(1, min(int(episode_count), step_count))
+    episode_length = -(-step_count // episode_count)
+
+    nodes = []
+    epoch_us = TRACE_START_US
+
+    def emit(step_type, source_id, target_id, depth):
+        nonlocal epoch_us
+
+        step = len(nodes) + 1
+        epoch_us += rnd.randint(1, 2 * step_interval_us)
+        seconds, micros = divmod(epoch_us, 1_000_000)
+
+        nodes.append({
+            "data": {
+                "id": f"Action_{step}",
+                "labels": [NODE_ACTION],
+                "properties": {
+                    "step": step,
+                    "depth": depth,
+                    "sourceId": source_id,
+                    "targetId": target_id,
+                    "timestamp": f"{time.strftime('%a, %d %b %Y %H:%M:%S', time.gmtime(seconds))} {micros}us +0000",
+                    "epochMicros": epoch_us,
+                    "type": step_type,
+                    "operationResolution": "resolved",
+                },
+            }
+        })
+
+    for episode in range(episode_count):
+        if len(nodes) >= step_count:
+            break
+
+        if episode:
+            epoch_us += episode_gap_us
+
+        working_set = rnd.sample(operations, min(episode_operations, len(operations)))
+        episode_end = min(step_count, len(nodes) + episode_length)
+        stack = []
+
+        def call(operation_id):
+            emit("call", stack[-1] if stack else None, operation_id, len(stack))
+            stack.append(operation_id)
+
+        def ret():
+            operation_id = stack.pop()
+            emit("return", operation_id, stack[-1] if stack else None, len(stack))
+
+        while len(nodes) < episode_end:
+            # Leave room to unwind, so every episode returns to depth 0 before the next starts.
+            if stack and (len(nodes) + len(stack) >= episode_end or len(stack) >= max_depth or rnd.random() < 0.45):
+                ret()
+            elif stack and rnd.random() < loop_probability:
+                body = [rnd.choice(working_set) for _ in range(rnd.randint(1, max_loop_body))]
+                for _ in range(rnd.randint(2, max_loop_repeats)):
+                    for operation_id in body:
+                        if len(nodes) + len(stack) + 2 > episode_end:
+                            break
+                        call(operation_id)
+                        ret()
+            else:
+                call(rnd.choice(working_set))
+
+        while stack:
+            ret()
+
+    return {
+        "elements": {
+            "nodes": nodes[:step_count],
+            "edges": [],
+        }
+    }
@@ -2,9 +2,13 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.database import engine, Base
 from app.routers import graph_router, trace_router
+from app.services.trace_ingest_job import fail_interrupted_trace_ingest_jobs
 
 # Create Database Tables on startup
 Base.metadata.create_all(bind=engine)
+
+# Trace ingest jobs of a previous process can no longer finish
+fail_interrupted_trace_ingest_jobs()
 app = FastAPI(title="Sabo Visualization API")
 
 # Configure CORS
@@ -135,6 +135,28 @@ export const projectApi = {
         return response.data;
     },
 
+    getTraceSteps: async (traceId, { start = 1, end = null, pageSize = 500 } = {}) => {
+        const params = { start, page_size: pageSize };
+        if (end !== null) params.end = end;
+
+        const response = await api.get(`/traces/${traceId}/steps`, { params });
+        return response.data;
+    },
+
+    getTraceStepsInWindow: async (traceId, { startUs = null, endUs = null, cursor = 0, pageSize = 500 } = {}) => {
+        const params = { cursor, page_size: pageSize };
+        if (startUs !== null) params.start_us = startUs;
+        if (endUs !== null) params.end_us = endUs;
+
+        const response = await api.get(`/traces/${traceId}/steps/window`, { params });
+        return response.data;
+    },
+
+    getTraceIngestJob: async (jobId) => {
+        const response = await api.get(`/trace-jobs/${jobId}`);
+        return response.data;
+    },
+
     deleteTrace: async (traceId) => {
         const response = await api.delete('/traces/' + traceId);
         return response.data;
@@ -31,6 +31,8 @@ const ProjectsPage = () => {
     const [isCreateOptionsModalOpen, setIsCreateOptionsModalOpen] = useState(false);
     const [selectedProjectForActions, setSelectedProjectForActions] = useState(null);
     const [selectedProjectForLogs, setSelectedProjectForLogs] = useState(null);
+    const [traceIngestJobs, setTraceIngestJobs] = useState([]);
+    const [traceListVersion, setTraceListVersion] = useState(0);
 
     useEffect(() => { 
         loadProjects(); 
@@ -56,6 +58,59 @@ const ProjectsPage = () => {
         };
     }, [projects]);
 
+    useEffect(() => {
+        if (traceIngestJobs.length === 0) return undefined;
+
+        let cancelled = false;
+        const intervalId = setInterval(async () => {
+            const finishedIds = new Set();
+
+            for (const jobId of traceIngestJobs) {
+                try {
+                    const job = await projectApi.getTraceIngestJob(jobId);
+                    if (job.status === 'completed' || job.status === 'failed') {
+                        finishedIds.add(jobId);
+                        if (!cancelled) reportTraceIngestJob(job);
+                    }
+                } catch (err) {
+                    if (err.response?.status === 404) {
+                        finishedIds.add(jobId);
+                    } else {
+                        console.error(err);
+                    }
+                }
+            }
+
+            if (cancelled || finishedIds.size === 0) return;
+
+            setTraceIngestJobs(prev => prev.filter(jobId => !finishedIds.has(jobId)));
+            setTraceListVersion(prev => prev + 1);
+        }, 2000);
+
+        return () => {
+            cancelled = true;
+            clearInterval(intervalId);
+        };
+    }, [traceIngestJobs]);
+
+    const reportTraceIngestJob = (job) => {
+        const failedFiles = (job.files || []).filter(jobFile => jobFile.status === 'failed');
+        const storedCount = (job.files || []).length - failedFiles.length;
+
+        if (failedFiles.length === 0) {
+            showToast(
+                storedCount === 1 ? "Trace processed successfully!" : `${storedCount} traces processed successfully!`,
+                "success"
+            );
+            return;
+        }
+
+        const errors = failedFiles
+            .map(jobFile => `${jobFile.filename}: ${jobFile.error || 'unknown error'}`)
+            .join('; ');
+        showToast(`Trace processing failed for ${failedFiles.length} of ${job.total_files} file(s) - ${errors}`, "error");
+    };
+
     const loadProjects = async (isBackground = false) => {
         try {
             const data = await projectApi.getProjects();
@@ -158,14 +213,17 @@ const ProjectsPage = () => {
 
     const handleUploadTrace = async (projectId, files) => {
         try {
-            const result = await projectApi.uploadTrace(projectId, files);
-            const uploadedCount = Array.isArray(result) ? result.length : 1;
+            const job = await projectApi.uploadTrace(projectId, files);
+            const queuedCount = job?.total_files ?? 1;
             showToast(
-                uploadedCount === 1
-                    ? "Trace uploaded successfully!"
-                    : `${uploadedCount} traces uploaded successfully!`,
-                "success"
+                queuedCount === 1
+                    ? "Trace queued for processing!"
+                    : `${queuedCount} traces queued for processing!`,
+                "info"
             );
+            if (job?.id !== undefined) {
+                setTraceIngestJobs(prev => [...prev, job.id]);
+            }
             setSelectedProjectForTrace(null);
         } catch (error) {
             const msg = error.response?.data?.detail || error.message;
@@ -462,6 +520,7 @@ const ProjectsPage = () => {
             {viewTracesProject && (
                 <TraceListModal
                     project={viewTracesProject}
+                    refreshKey={traceListVersion}
                     onClose={() => setViewTracesProject(null)}
                 />
             )}
@@ -5,7 +5,7 @@ import ModalButton from '../Common/ModalButton';
 import ConfirmationModal from './ConfirmationModal';
 import { useToast } from '../../context/ToastContext';
 
-const TraceListModal = ({ project, onClose }) => {
+const TraceListModal = ({ project, refreshKey = 0, onClose }) => {
     const { showToast } = useToast();
     const [traces, setTraces] = useState([]);
     const [loading, setLoading] = useState(true);
@@ -34,7 +34,7 @@ const TraceListModal = ({ project, onClose }) => {
             });
 
         return () => { mounted = false; };
-    }, [project.id]);
+    }, [project.id, refreshKey]);
 
     const handleRequestDelete = (trace) => {
         setTraceToDelete(trace);